@@ -0,0 +1,144 @@
+"""
+Benchmark of the notebook chunker against the previous fixed-window splitting.
+
+For a corpus of notebooks, compares the previous chunking (each cell flattened and cut into 200-token windows with a
+50-token overlap) with `NotebookChunker`: number of chunks and tokens embedded (the embedding cost), and, given a set
+of questions labelled with the cell that answers them, the retrieval hit rate at k and the mean reciprocal rank of
+that cell.
+
+Questions are read from a JSONL file with one `{"notebook": ..., "question": ..., "cell_index": ...}` object per line
+(`notebook` relative to the file). By default chunks and questions are embedded with a local bag-of-words hashing
+embedding, so the benchmark runs offline; `--openai` uses the OpenAI embedding model of the app instead. The tiktoken
+encoding must be available (downloaded or cached).
+
+Usage:
+    python benchmarks/bench_chunking.py path/to/notebooks [--questions questions.jsonl] [--k 4] [--openai]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "notebook_tutor")]
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.document_loaders.notebook import concatenate_cells, remove_newlines
+from chunking import NotebookChunker
+from notebook_loader import iter_notebook_cells
+from utils import TokenTextSplitter, tiktoken_len
+
+
+def find_notebooks(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                yield from (os.path.join(root, name) for name in sorted(files) if name.endswith(".ipynb"))
+        elif path.endswith(".ipynb"):
+            yield path
+
+
+def fixed_window_chunks(notebook_path):
+    # Previous chunking: one flattened document per cell, cut into 200-token windows with a 50-token overlap
+    docs = []
+    for cell in iter_notebook_cells(notebook_path, include_outputs=False):
+        flattened = remove_newlines({"cell_type": cell["cell_type"], "source": cell["source"], "outputs": []})
+        text = concatenate_cells(flattened, False, 20, False)
+        docs.append(Document(page_content=text, metadata={"cell_indexes": [cell["index"]]}))
+    splitter = TokenTextSplitter(chunk_size=200, chunk_overlap=50)
+    return splitter.split_documents(docs)
+
+
+def structured_chunks(notebook_path):
+    return NotebookChunker().chunk(iter_notebook_cells(notebook_path), notebook_path)
+
+
+class HashingEmbeddings:
+    """Bag-of-words embeddings hashed into a fixed number of dimensions, to run the benchmark offline."""
+    def __init__(self, size=1024):
+        self.size = size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"[a-z0-9_]+", text.lower()):
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.size] += 1
+        return vector
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def evaluate(chunks_by_notebook, questions, embeddings, k):
+    matrices = {
+        notebook: normalize(embeddings.embed_documents([chunk.page_content for chunk in chunks]))
+        for notebook, chunks in chunks_by_notebook.items()
+    }
+    hits, reciprocal_ranks = 0, []
+    for question in questions:
+        chunks = chunks_by_notebook[question["notebook"]]
+        scores = matrices[question["notebook"]] @ normalize(embeddings.embed_query(question["question"]))
+        ranked = [chunks[i] for i in np.argsort(-scores)]
+        rank = next(
+            (rank for rank, chunk in enumerate(ranked, 1) if question["cell_index"] in chunk.metadata["cell_indexes"]),
+            None,
+        )
+        hits += rank is not None and rank <= k
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return hits / len(questions), sum(reciprocal_ranks) / len(questions)
+
+
+def load_questions(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    for question in questions:
+        question["notebook"] = os.path.normpath(os.path.join(base, question["notebook"]))
+    return questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Notebooks, or directories searched for notebooks")
+    parser.add_argument("--questions", help="JSONL file of questions labelled with the cell answering them")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--openai", action="store_true", help="Embed with the OpenAI embedding model")
+    args = parser.parse_args()
+
+    notebooks = [os.path.normpath(os.path.abspath(path)) for path in find_notebooks(args.paths)]
+    questions = load_questions(args.questions) if args.questions else []
+    notebooks += sorted({question["notebook"] for question in questions} - set(notebooks))
+    if not notebooks:
+        parser.error("no .ipynb file found")
+
+    if args.openai:
+        from clients import get_embedding_model
+        embeddings = get_embedding_model("text-embedding-3-small")
+    else:
+        embeddings = HashingEmbeddings()
+
+    print(f"Corpus: {len(notebooks)} notebooks, {len(questions)} questions")
+    for name, chunker in (("fixed 200/50 windows", fixed_window_chunks), ("NotebookChunker", structured_chunks)):
+        chunks_by_notebook = {notebook: chunker(notebook) for notebook in notebooks}
+        chunks = [chunk for notebook_chunks in chunks_by_notebook.values() for chunk in notebook_chunks]
+        tokens = sum(tiktoken_len(chunk.page_content) for chunk in chunks)
+        line = f"{name:<22} {len(chunks):6d} chunks {tokens:9d} tokens embedded"
+        if questions:
+            hit_rate, mrr = evaluate(chunks_by_notebook, questions, embeddings, args.k)
+            line += f"  hit@{args.k} {hit_rate:.0%}  MRR {mrr:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Offline end-to-end load test of the tutor.
+
+Starts the local OpenAI-compatible stub server (`stub_openai_server.py`) and replays scripted student sessions against
+the real pipeline (ingestion workers, `DocumentManager`, `RetrievalManager`, the shared tutor graph and the
+conversation memory, driven the way the Chainlit handlers drive them) at a given concurrency. Each session uploads a
+notebook, asks questions, then requests a quiz and flashcards. Reports the p50/p95/p99 latency of each stage (and the
+time to the first streamed token of the answers), the throughput, the number of model requests and the peak RSS of
+the process.
+
+No OpenAI request is made: every model call goes to the stub, whose latency and generation speed are configurable.
+The tiktoken encoding must be available (downloaded or cached).
+
+Usage:
+    python benchmarks/bench_load.py path/to/notebook.ipynb [--sessions 20] [--concurrency 10] [--questions-per-session 3]
+        [--latency 0.3] [--tokens-per-second 50] [--distinct-notebooks] [--study-bank]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "notebook_tutor")]
+
+DEFAULT_QUESTIONS = [
+    "What does this notebook do?",
+    "How is the data loaded and cleaned?",
+    "Which model is trained and how is it evaluated?",
+    "Explain the plotting code.",
+    "What are the main steps of the analysis?",
+]
+QUIZ_REQUEST = "Create a quiz about the notebook."
+FLASHCARDS_REQUEST = "Create flashcards for the key concepts of the notebook."
+
+
+def start_stub(args):
+    command = [
+        sys.executable, os.path.join(ROOT, "benchmarks", "stub_openai_server.py"), "--port", str(args.port),
+        "--latency", str(args.latency), "--embedding-latency", str(args.embedding_latency),
+        "--tokens-per-second", str(args.tokens_per_second), "--completion-tokens", str(args.completion_tokens),
+    ]
+    process = subprocess.Popen(command)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/stats", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The stub server did not start")
+
+
+def stub_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5) as response:
+        return json.load(response)
+
+
+def session_notebooks(paths, sessions, distinct, directory):
+    # Sessions upload the notebooks in turn; with --distinct-notebooks each session gets its own notebook content
+    notebooks = []
+    for i in range(sessions):
+        path = paths[i % len(paths)]
+        if distinct:
+            with open(path, encoding="utf-8") as f:
+                notebook = json.load(f)
+            notebook["cells"].append({"cell_type": "markdown", "metadata": {}, "source": [f"Session {i}"]})
+            path = os.path.join(directory, f"session_{i}.ipynb")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(notebook, f)
+        notebooks.append(path)
+    return notebooks
+
+
+class StageTimings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def report(self, percentile):
+        print(f"{'stage':<18}{'count':>7}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'mean s':>9}")
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            print(
+                f"{stage:<18}{len(values):7d}{percentile(values, 50):9.3f}{percentile(values, 95):9.3f}"
+                f"{percentile(values, 99):9.3f}{sum(values) / len(values):9.3f}"
+            )
+
+
+async def run(args, notebooks, questions, export_root):
+    # The app modules read their configuration from the environment when imported
+    from langchain_core.callbacks import AsyncCallbackHandler
+    from langchain_core.messages import HumanMessage
+    from document_processing import DocumentManager
+    from graph import get_tutor_chain, TutorState
+    from ingestion import ingestion_service
+    from memory import ConversationMemory, create_summarizer
+    from metrics import percentile
+    from retrieval import RetrievalManager
+    from streaming import AGENT_LLM_TAG
+    from study_bank import study_bank
+
+    class FirstTokenTimer(AsyncCallbackHandler):
+        def __init__(self):
+            self.first_token = None
+
+        async def on_llm_new_token(self, token, *, tags=None, **kwargs):
+            if self.first_token is None and token and AGENT_LLM_TAG in (tags or []):
+                self.first_token = time.perf_counter()
+
+    tutor_chain = get_tutor_chain()
+    ingestion_service.start()
+    timings = StageTimings()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def turn(stage, text, retrieval_chain, qa_chain, documents, memory, notebook_hash, export_dir):
+        # Same graph input and config as the Chainlit message handler
+        user_message = HumanMessage(content=text)
+        state = TutorState(
+            messages=memory.get_messages() + [user_message], next="supervisor", quiz=[], quiz_created=False,
+            question_answered=False, flashcards_created=False, flashcard_files=[],
+        )
+        timer = FirstTokenTimer()
+        config = {
+            "recursion_limit": 10,
+            "configurable": {
+                "retrieval_chain": retrieval_chain, "qa_chain": qa_chain, "documents": documents,
+                "notebook_hash": notebook_hash, "export_dir": export_dir,
+            },
+            "callbacks": [timer],
+        }
+        started = time.perf_counter()
+        answers = []
+        async for step in tutor_chain.astream(state, config):
+            if "supervisor" not in step:
+                answers.extend(next(iter(step.values()))["messages"])
+        timings.record(stage, time.perf_counter() - started)
+        if timer.first_token is not None:
+            timings.record(f"{stage} (ttft)", timer.first_token - started)
+        memory.add_messages([user_message] + answers)
+        await memory.asummarize()
+
+    async def session(index, notebook):
+        async with semaphore:
+            doc_manager = None
+            try:
+                # Same steps as the Chainlit chat start handler
+                started = time.perf_counter()
+                doc_manager = await asyncio.to_thread(DocumentManager, notebook)
+                await doc_manager.aload_document()
+                await doc_manager.ainitialize_retriever()
+                retrieval_manager = RetrievalManager(
+                    doc_manager.get_retriever(),
+                    embedding_model=doc_manager.get_embedding_model(),
+                    cache_namespace=doc_manager.collection_name,
+                )
+                retrieval_chain, qa_chain = retrieval_manager.get_RAG_QA_chain(), retrieval_manager.get_direct_QA_chain()
+                if args.study_bank:
+                    study_bank.schedule(doc_manager.notebook_hash, doc_manager.get_documents())
+                memory = ConversationMemory(create_summarizer())
+                timings.record("upload", time.perf_counter() - started)
+
+                notebook_hash = doc_manager.notebook_hash if args.study_bank else None
+                export_dir = os.path.join(export_root, f"session_{index}")
+                script = [("question", questions[(index + i) % len(questions)]) for i in range(args.questions_per_session)]
+                script += [("quiz", QUIZ_REQUEST), ("flashcards", FLASHCARDS_REQUEST)]
+                for stage, text in script:
+                    await turn(stage, text, retrieval_chain, qa_chain, doc_manager.get_documents(), memory, notebook_hash, export_dir)
+                timings.record("session", time.perf_counter() - started)
+            except Exception as e:
+                timings.errors[type(e).__name__] += 1
+                print(f"Session {index} failed: {e!r}", file=sys.stderr)
+            finally:
+                if doc_manager:
+                    doc_manager.release()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(i, notebook) for i, notebook in enumerate(notebooks)))
+    elapsed = time.perf_counter() - started
+    ingestion_service.shutdown()
+
+    turns = sum(len(values) for stage, values in timings.samples.items() if stage in ("question", "quiz", "flashcards"))
+    sessions = len(timings.samples.get("session", []))
+    print(f"{sessions}/{len(notebooks)} sessions completed in {elapsed:.1f}s at concurrency {args.concurrency}")
+    print(f"Throughput: {sessions / elapsed:.2f} sessions/s, {turns / elapsed:.2f} turns/s")
+    if timings.errors:
+        print(f"Errors: {dict(timings.errors)}")
+    print()
+    timings.report(percentile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("notebooks", nargs="+", help="Notebooks uploaded by the sessions, in turn")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--questions-per-session", type=int, default=3)
+    parser.add_argument("--questions", help="Text file of questions, one per line")
+    parser.add_argument("--distinct-notebooks", action="store_true", help="Give each session its own notebook content")
+    parser.add_argument("--study-bank", action="store_true", help="Enable the precomputed quiz and flashcard bank")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub seconds before the first token")
+    parser.add_argument("--embedding-latency", type=float, default=0.1, help="Stub seconds per embeddings request")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Stub generation speed")
+    parser.add_argument("--completion-tokens", type=int, default=120, help="Stub answer length, in words")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    # Keep the load test away from the real caches and API
+    tmp = tempfile.mkdtemp(prefix="bench_load_")
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-stub",
+        "OPENAI_API_BASE": f"http://127.0.0.1:{args.port}/v1",
+        "EMBEDDING_CACHE_PATH": os.path.join(tmp, "embeddings.sqlite3"),
+        "VECTOR_STORE_PATH": os.path.join(tmp, "vector_store"),
+        "STUDY_BANK_PATH": os.path.join(tmp, "study_bank"),
+    })
+    os.environ.pop("EMBEDDING_API_BASE", None)
+    os.environ.pop("QDRANT_URL", None)
+    notebooks = session_notebooks(args.notebooks, args.sessions, args.distinct_notebooks, tmp)
+
+    stub = start_stub(args)
+    try:
+        asyncio.run(run(args, notebooks, questions, os.path.join(tmp, "flashcards")))
+        requests = stub_stats(args.port)
+        print(f"\nModel requests: {requests['chat']} chat completions, {requests['embeddings']} embeddings")
+    finally:
+        stub.terminate()
+        stub.wait()
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
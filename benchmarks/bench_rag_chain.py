@@ -0,0 +1,87 @@
+"""
+Benchmark of the per-question overhead of the RAG chain.
+
+Compares the previous behaviour (a new ChatOpenAI client and a new runnable pipeline for every question) with the
+shared client registry and the chain compiled once per retriever. The retriever and the chat model are replaced by
+in-process fakes, so only the Python-side overhead is measured and no API call is made.
+
+Usage:
+    python benchmarks/bench_rag_chain.py [--questions 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from operator import itemgetter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "notebook_tutor")]
+
+# Keep the benchmark away from the real caches and API
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+_tmp = tempfile.mkdtemp(prefix="bench_rag_chain_")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(_tmp, "embeddings.sqlite3"))
+os.environ.setdefault("VECTOR_STORE_PATH", os.path.join(_tmp, "vector_store"))
+
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_openai import ChatOpenAI
+from prompt_templates import PromptTemplates
+from retrieval import RetrievalManager
+import clients
+
+DOCS = [Document(page_content=f"'code' cell: 'print({i})'") for i in range(4)]
+
+
+def fake_retriever():
+    return RunnableLambda(lambda question: DOCS)
+
+
+def fake_chat_model():
+    return FakeListChatModel(responses=["An answer."])
+
+
+def per_question_rebuild(question):
+    # Previous behaviour: a new client and a new pipeline for every question
+    ChatOpenAI(model="gpt-4-turbo", temperature=0.1)
+    prompts = PromptTemplates()
+    chain = (
+        {"context": itemgetter("question") | fake_retriever(), "question": itemgetter("question")}
+        | RunnablePassthrough.assign(context=itemgetter("context"))
+        | {"response": prompts.get_rag_qa_prompt() | fake_chat_model(), "context": itemgetter("context")}
+    )
+    return chain.invoke({"question": question})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    args = parser.parse_args()
+
+    manager = RetrievalManager(fake_retriever())
+    manager.chat_model = fake_chat_model()
+    manager.rag_chain = manager._build_RAG_QA_chain()
+
+    def compiled(question):
+        clients.get_chat_model("gpt-4-turbo", temperature=0.1)
+        return manager.get_RAG_QA_chain().invoke({"question": question})
+
+    results = {}
+    for name, run in [("rebuild per question", per_question_rebuild), ("compiled + shared clients", compiled)]:
+        run("warm-up")
+        start = time.perf_counter()
+        for i in range(args.questions):
+            run(f"question {i}")
+        results[name] = (time.perf_counter() - start) / args.questions * 1000
+
+    print(f"{'mode':<28}{'ms / question':>14}")
+    for name, ms in results.items():
+        print(f"{name:<28}{ms:>14.3f}")
+    baseline, optimized = results.values()
+    print(f"speed-up: {baseline / optimized:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
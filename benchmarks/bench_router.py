@@ -0,0 +1,78 @@
+"""
+Benchmark of the supervisor fast path.
+
+Routes a set of labelled user messages with the keyword rules of `router.py` and reports the share of messages routed
+without an LLM call (coverage), the accuracy of those routes against the labels, and the routing latency. Messages the
+rules leave to the LLM supervisor are listed, which is the place to start when tuning the rules.
+
+Usage:
+    python benchmarks/bench_router.py [--repeat 1000]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "notebook_tutor")]
+
+from router import classify_by_rules
+
+LABELLED_MESSAGES = [
+    ("What does this notebook do?", "QAAgent"),
+    ("Explain the second code cell", "QAAgent"),
+    ("How are the embeddings computed?", "QAAgent"),
+    ("why do we split the documents into chunks", "QAAgent"),
+    ("Which model is used for the answers?", "QAAgent"),
+    ("Summarize the notebook for me", "QAAgent"),
+    ("Can you describe the retrieval step?", "QAAgent"),
+    ("is the vector store persisted?", "QAAgent"),
+    ("Tell me about the evaluation section", "QAAgent"),
+    ("the part with RAGAS, I don't get it", "QAAgent"),
+    ("Give me a quiz", "QuizAgent"),
+    ("quiz me on the notebook", "QuizAgent"),
+    ("Can you create a quiz about LangChain?", "QuizAgent"),
+    ("Test me on the main concepts", "QuizAgent"),
+    ("I want some multiple choice questions", "QuizAgent"),
+    ("Prepare practice questions on embeddings", "QuizAgent"),
+    ("Make flashcards", "FlashcardsAgent"),
+    ("Create flashcards about the retrieval chain", "FlashcardsAgent"),
+    ("Can you generate Anki cards?", "FlashcardsAgent"),
+    ("I need flash cards for my revision", "FlashcardsAgent"),
+    ("What is a flashcard?", "QAAgent"),
+    ("Let's do it", "QAAgent"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    routed, correct, fallbacks = 0, 0, []
+    for message, label in LABELLED_MESSAGES:
+        route = classify_by_rules(message)
+        if route is None:
+            fallbacks.append(message)
+            continue
+        routed += 1
+        correct += route == label
+        if route != label:
+            print(f"Misrouted: {message!r} -> {route} (expected {label})")
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for message, _ in LABELLED_MESSAGES:
+            classify_by_rules(message)
+    latency = (time.perf_counter() - started) / (args.repeat * len(LABELLED_MESSAGES))
+
+    print(f"Messages:            {len(LABELLED_MESSAGES)}")
+    print(f"Routed by the rules: {routed} ({routed / len(LABELLED_MESSAGES):.0%})")
+    print(f"Accuracy:            {correct / routed:.0%}" if routed else "Accuracy:            n/a")
+    print(f"Latency per message: {latency * 1e6:.1f}us")
+    for message in fallbacks:
+        print(f"Left to the LLM supervisor: {message!r}")
+
+
+if __name__ == "__main__":
+    main()
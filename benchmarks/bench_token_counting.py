@@ -0,0 +1,107 @@
+"""
+Micro-benchmark of token counting in the notebook text splitter.
+
+Splits the cells of a corpus of notebooks into chunks of `CHUNK_SIZE` tokens three ways:
+
+- `lookup per call`: the previous `tiktoken_len`, looking the encoding up on every call;
+- `cached encoder`: the encoding looked up once, every string encoded on demand;
+- `TokenTextSplitter`: the shared `TokenCounter`, with batched counting and the length cache (a fresh counter per
+  run, so the cache starts cold).
+
+All three must produce the same chunks. The tiktoken encoding must be available (downloaded or cached).
+
+Usage:
+    python benchmarks/bench_token_counting.py path/to/notebooks [more notebooks or directories] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "notebook_tutor")]
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils import TOKEN_COUNT_MODEL, TokenCounter, TokenTextSplitter
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+
+def find_notebooks(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                yield from (os.path.join(root, name) for name in sorted(files) if name.endswith(".ipynb"))
+        elif path.endswith(".ipynb"):
+            yield path
+
+
+def load_cells(notebook_path):
+    with open(notebook_path, encoding="utf-8") as f:
+        notebook = json.load(f)
+    cells = []
+    for cell in notebook.get("cells", []):
+        source = cell.get("source", "")
+        source = "".join(source) if isinstance(source, list) else source
+        if source.strip():
+            cells.append(f"'{cell.get('cell_type')}' cell: '{source}'")
+    return cells
+
+
+def lookup_per_call_len(text):
+    # Previous behaviour of utils.tiktoken_len
+    return len(tiktoken.encoding_for_model(TOKEN_COUNT_MODEL).encode(text, disallowed_special=()))
+
+
+def run(splitter, cells):
+    started = time.perf_counter()
+    chunks = [chunk for cell in cells for chunk in splitter.split_text(cell)]
+    return time.perf_counter() - started, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Notebooks, or directories searched for notebooks")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    notebooks = list(find_notebooks(args.paths))
+    if not notebooks:
+        parser.error("no .ipynb file found")
+    cells = [cell for notebook in notebooks for cell in load_cells(notebook)]
+    print(f"Corpus: {len(notebooks)} notebooks, {len(cells)} cells, {sum(map(len, cells))} characters")
+
+    encoding = tiktoken.encoding_for_model(TOKEN_COUNT_MODEL)
+    variants = {
+        "lookup per call": lambda: RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=lookup_per_call_len,
+        ),
+        "cached encoder": lambda: RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+            length_function=lambda text: len(encoding.encode(text, disallowed_special=())),
+        ),
+        "TokenTextSplitter": lambda: TokenTextSplitter(
+            token_counter=TokenCounter(), chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+        ),
+    }
+
+    reference = None
+    for name, make_splitter in variants.items():
+        timings = []
+        for _ in range(args.repeat):
+            splitter = make_splitter()
+            elapsed, chunks = run(splitter, cells)
+            timings.append(elapsed)
+        if reference is None:
+            reference = chunks
+        elif chunks != reference:
+            raise AssertionError(f"{name} produced different chunks")
+        extra = f"  cache {splitter.token_counter.stats()['hit_rate']:.0%} hits" if name == "TokenTextSplitter" else ""
+        print(f"{name:<18} best {min(timings) * 1000:8.1f}ms  ({len(chunks)} chunks){extra}")
+
+
+if __name__ == "__main__":
+    main()
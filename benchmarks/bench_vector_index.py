@@ -0,0 +1,134 @@
+"""
+Benchmark of the compact in-process vector index against the Qdrant collection.
+
+Indexes synthetic clustered embeddings (the size of a notebook's chunks, by default 300 vectors of the 1536
+dimensions of `text-embedding-3-small`) into an in-memory Qdrant collection, with the payload layout written by
+LangChain, and into `CompactVectorIndex` with each quantization. For each index, reports the memory held by the
+vectors, the p50/p95 latency of top-k queries without and with a metadata filter (`metadata.cell_type`), and the
+recall at k against an exact float32 search.
+
+Usage:
+    python benchmarks/bench_vector_index.py [--vectors 300] [--dimension 1536] [--queries 200] [--k 4]
+        [--rescore-factor 4]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "notebook_tutor")]
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+from compact_index import QUANTIZATIONS, CompactVectorIndex, filter_from_dict, matches_filter
+from metrics import percentile
+
+CELL_TYPES = ("markdown", "code")
+
+
+def synthetic_vectors(count, dimension, clusters, rng):
+    # Chunks of a notebook are close to the few topics they cover, so vectors are drawn around cluster centers
+    centers = rng.standard_normal((clusters, dimension))
+    vectors = centers[rng.integers(0, clusters, count)] + 0.8 * rng.standard_normal((count, dimension))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def exact_top_k(vectors, query, k, mask=None):
+    scores = vectors @ query
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    return set(np.argsort(-scores)[:k].tolist())
+
+
+def timed(search, queries):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - started)
+    return latencies, results
+
+
+def recall(results, expected):
+    return sum(len(set(found) & truth) / len(truth) for found, truth in zip(results, expected)) / len(expected)
+
+
+def build_qdrant(vectors, metadatas):
+    tracemalloc.start()
+    client = QdrantClient(":memory:")
+    client.create_collection(
+        "bench", vectors_config=models.VectorParams(size=vectors.shape[1], distance=models.Distance.COSINE)
+    )
+    client.upsert("bench", points=[
+        models.PointStruct(
+            id=str(uuid.UUID(int=row)), vector=vector.tolist(), payload={"page_content": "", "metadata": metadata}
+        )
+        for row, (vector, metadata) in enumerate(zip(vectors, metadatas))
+    ])
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return client, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=300)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=12)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--rescore-factor", type=int, default=4, help="Binary candidates rescored per result")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_vectors(args.vectors, args.dimension, args.clusters, rng)
+    queries = synthetic_vectors(args.queries, args.dimension, args.clusters, rng)
+    metadatas = [{"cell_type": CELL_TYPES[row % 2], "cell_indexes": [row]} for row in range(args.vectors)]
+    filter = filter_from_dict({"cell_type": "code"})
+    mask = np.array([matches_filter(metadata, filter) for metadata in metadatas])
+    expected = [exact_top_k(vectors, query, args.k) for query in queries]
+    expected_filtered = [exact_top_k(vectors, query, args.k, mask) for query in queries]
+    print(
+        f"{args.vectors} vectors of {args.dimension} dimensions ({vectors.nbytes / 1024:.0f} KB as float32), "
+        f"{args.queries} queries, k={args.k}\n"
+    )
+
+    rows = []
+    client, memory = build_qdrant(vectors, metadatas)
+
+    def qdrant_search(query, query_filter=None):
+        points = client.search("bench", query.tolist(), query_filter=query_filter, limit=args.k)
+        return [uuid.UUID(point.id).int for point in points]
+
+    latencies, results = timed(qdrant_search, queries)
+    filtered_latencies, filtered_results = timed(lambda query: qdrant_search(query, filter), queries)
+    rows.append(("qdrant (memory)", memory, latencies, filtered_latencies,
+                 recall(results, expected), recall(filtered_results, expected_filtered)))
+
+    for quantization in QUANTIZATIONS:
+        index = CompactVectorIndex(vectors, quantization=quantization, rescore_factor=args.rescore_factor)
+
+        def compact_search(query, query_mask=None):
+            return [row for row, _ in index.search(query, args.k, query_mask)]
+
+        latencies, results = timed(compact_search, queries)
+        filtered_latencies, filtered_results = timed(lambda query: compact_search(query, mask), queries)
+        rows.append((f"compact {quantization}", index.nbytes(), latencies, filtered_latencies,
+                     recall(results, expected), recall(filtered_results, expected_filtered)))
+
+    print(f"{'index':<18}{'memory KB':>11}{'p50 ms':>9}{'p95 ms':>9}{'p50 filt':>10}{'p95 filt':>10}"
+          f"{'recall':>8}{'recall filt':>13}")
+    for name, memory, latencies, filtered_latencies, hits, filtered_hits in rows:
+        print(
+            f"{name:<18}{memory / 1024:11.0f}{1000 * percentile(latencies, 50):9.3f}"
+            f"{1000 * percentile(latencies, 95):9.3f}{1000 * percentile(filtered_latencies, 50):10.3f}"
+            f"{1000 * percentile(filtered_latencies, 95):10.3f}{hits:8.3f}{filtered_hits:13.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Local OpenAI-compatible stub server, for load tests that must not call the OpenAI API.
+
+Serves `/v1/chat/completions` (plain and streamed, with function calling) and `/v1/embeddings` with a configurable
+latency and generation speed. Its answers follow the tutor's flows: the supervisor's `route` function is answered from
+keywords of the last user message, agents first call their retrieval tool (and the flashcard tool for the flashcard
+agent) and then answer, and study bank prompts get a JSON bank. Embeddings are hashed bags of words, so similar texts
+get similar vectors and retrieval behaves realistically.
+
+Usage:
+    python benchmarks/stub_openai_server.py [--port 8900] [--latency 0.3] [--tokens-per-second 50]
+    # then point the app at it: OPENAI_API_BASE=http://127.0.0.1:8900/v1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+WORDS = (
+    "the notebook loads the dataset with pandas then cleans the columns and trains a model whose accuracy is "
+    "evaluated on a held out split using cross validation and plotted with matplotlib"
+).split()
+
+
+def hashed_embedding(text_or_tokens, size):
+    vector = [0.0] * size
+    items = text_or_tokens if isinstance(text_or_tokens, list) else re.findall(r"\w+", text_or_tokens.lower())
+    for item in items:
+        vector[int(hashlib.md5(str(item).encode()).hexdigest(), 16) % size] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def last_user_message(messages):
+    return next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+
+
+def called_functions(messages):
+    # Names of the functions called since the last user message
+    names = []
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            break
+        if message.get("role") == "function":
+            names.append(message.get("name"))
+    return names
+
+
+class StubBackend:
+    def __init__(self, latency, embedding_latency, tokens_per_second, completion_tokens, embedding_size, jitter):
+        self.latency = latency
+        self.embedding_latency = embedding_latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.embedding_size = embedding_size
+        self.jitter = jitter
+        self.requests = {"chat": 0, "embeddings": 0}
+
+    def _delay(self, seconds):
+        return asyncio.sleep(max(0.0, seconds * (1 + random.uniform(-self.jitter, self.jitter))))
+
+    def _text(self, count):
+        return " ".join(random.choice(WORDS) for _ in range(count))
+
+    def reply(self, body):
+        """Returns the (content, function_call) the model answers to a chat completion request."""
+        messages = body.get("messages", [])
+        text = last_user_message(messages)
+        functions = {f["name"] for f in body.get("functions") or []}
+
+        if "route" in functions:
+            lowered = text.lower()
+            route = "QuizAgent" if "quiz" in lowered else "FlashcardsAgent" if "flashcard" in lowered else "QAAgent"
+            return None, {"name": "route", "arguments": json.dumps({"next": route})}
+        if functions:
+            called = called_functions(messages)
+            retrieval = next((name for name in functions if name != "create_flashcards"), None)
+            if retrieval and retrieval not in called:
+                return None, {"name": retrieval, "arguments": json.dumps({"query": text[:200]})}
+            if "create_flashcards" in functions and "create_flashcards" not in called:
+                cards = [{"question": f"{self._text(8)}?", "answer": self._text(20)} for _ in range(5)]
+                return None, {"name": "create_flashcards", "arguments": json.dumps({"flashcards": cards})}
+        if '"quiz": [' in text:
+            count = 3
+            bank = {
+                "quiz": [{"question": f"{self._text(10)}?", "choices": [self._text(4) for _ in range(4)],
+                          "answer": self._text(12)} for _ in range(count)],
+                "flashcards": [{"question": f"{self._text(8)}?", "answer": self._text(20)} for _ in range(count)],
+            }
+            return json.dumps(bank), None
+        return self._text(self.completion_tokens), None
+
+    async def chat(self, request: Request):
+        self.requests["chat"] += 1
+        body = await request.json()
+        content, function_call = self.reply(body)
+        model = body.get("model", "gpt-4o")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        prompt_tokens = sum(len(str(m.get("content") or "").split()) for m in body.get("messages", []))
+        completion_tokens = len((content or json.dumps(function_call)).split())
+        await self._delay(self.latency)
+
+        if not body.get("stream"):
+            await self._delay(completion_tokens / self.tokens_per_second)
+            message = {"role": "assistant", "content": content}
+            if function_call:
+                message["function_call"] = function_call
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": message,
+                             "finish_reason": "function_call" if function_call else "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        async def events():
+            def chunk(delta, finish_reason=None):
+                return "data: " + json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }) + "\n\n"
+
+            if function_call:
+                yield chunk({"role": "assistant", "content": None, "function_call": {"name": function_call["name"], "arguments": ""}})
+                await self._delay(completion_tokens / self.tokens_per_second)
+                yield chunk({"function_call": {"arguments": function_call["arguments"]}})
+                yield chunk({}, "function_call")
+            else:
+                yield chunk({"role": "assistant", "content": ""})
+                for word in content.split(" "):
+                    yield chunk({"content": word + " "})
+                    await self._delay(1 / self.tokens_per_second)
+                yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def embeddings(self, request: Request):
+        self.requests["embeddings"] += 1
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        await self._delay(self.embedding_latency)
+        return JSONResponse({
+            "object": "list",
+            "model": body.get("model", "text-embedding-3-small"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": hashed_embedding(text, self.embedding_size)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def stats(self, request: Request):
+        return JSONResponse(self.requests)
+
+
+def create_app(latency=0.3, embedding_latency=0.1, tokens_per_second=50.0, completion_tokens=120, embedding_size=256,
+               jitter=0.2):
+    backend = StubBackend(latency, embedding_latency, tokens_per_second, completion_tokens, embedding_size, jitter)
+    return Starlette(routes=[
+        Route("/v1/chat/completions", backend.chat, methods=["POST"]),
+        Route("/v1/embeddings", backend.embeddings, methods=["POST"]),
+        Route("/stats", backend.stats),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the first token of a chat completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.1, help="Seconds per embeddings request")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Generation speed of chat completions")
+    parser.add_argument("--completion-tokens", type=int, default=120, help="Length of the generated answers, in words")
+    parser.add_argument("--embedding-size", type=int, default=256)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Random variation of the delays, as a fraction")
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.embedding_latency, args.tokens_per_second, args.completion_tokens,
+                     args.embedding_size, args.jitter)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
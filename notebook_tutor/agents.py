@@ -1,20 +1,38 @@
+import asyncio
+import functools
+import logging
+from contextlib import contextmanager
 from typing import Annotated
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool
+from langchain_core.runnables import RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import AIMessage
 from langchain.agents import AgentExecutor, create_openai_functions_agent
 from langchain.output_parsers.openai_functions import JsonOutputFunctionsParser
 from langchain_openai import ChatOpenAI
-from tools import create_flashcards_tool, RetrievalChainWrapper
+from tools import create_flashcards_tool, RetrievalChainWrapper, current_retrieval_chain, current_export_dir, current_exported_files
+from clients import get_chat_model
+from streaming import AGENT_LLM_TAG
+from router import last_user_message
+from study_bank import study_bank, BANK_AGENTS, format_quiz, format_flashcards
+from prompt_templates import NO_ANSWER_MARKER
+from quiz_engine import quiz_engine, QUIZ_MODE
+from tracing import span
 
+logger = logging.getLogger(__name__)
 
-# Instantiate the language model
-llm = ChatOpenAI(model="gpt-4o")
 
-# Function to create an instance of the retrieval tool wrapper
-def get_retrieve_information_tool(retrieval_chain):
+# Instantiate the language models: the agents stream their answers, the supervisor only returns a route
+llm = get_chat_model("gpt-4o", streaming=True, tags=[AGENT_LLM_TAG])
+supervisor_llm = get_chat_model("gpt-4o")
+
+# Function to create an instance of the retrieval tool wrapper (bound to the request's chain when none is given)
+def get_retrieve_information_tool(retrieval_chain=None):
     wrapper_instance = RetrievalChainWrapper(retrieval_chain)
-    return tool(wrapper_instance.retrieve_information)
+    return StructuredTool.from_function(
+        func=wrapper_instance.retrieve_information,
+        coroutine=wrapper_instance.aretrieve_information,
+    )
 
 # Instantiate the flashcard tool
 flashcard_tool = create_flashcards_tool
@@ -56,26 +74,203 @@ def create_agent(
     return executor
 
 # Function to create agent nodes
-def agent_node(state, agent, name):
+def agent_node(state, agent, name, config=None):
     """
     Invoke an agent and update the state based on the agent's output.
 
+    The session's retrieval chain is read from the graph config (`configurable.retrieval_chain`) and bound to the
+    retrieval tool for the duration of the call, so the compiled graph can be shared by all sessions. Likewise, the
+    session's export directory (`configurable.export_dir`) is bound to the flashcard tool, and the paths of the files it
+    writes are returned in the `flashcard_files` of the state.
+    Quiz and flashcard requests are answered from the notebook's study bank without running the agent when the
+    config names the notebook (`configurable.notebook_hash`) and its bank can serve the request. Otherwise, in the
+    `parallel` quiz mode (`QUIZ_MODE`), quizzes are written by the `QuizEngine` from the session's notebook chunks
+    (`configurable.documents`), and the agent only runs when no section of the notebook matches the request.
+
+    Parameters:
+        state (dict): The current state of the conversation.
+        agent (AgentExecutor): The agent to be invoked.
+        name (str): The name of the agent.
+        config (dict, optional): The graph config of the current request.
+
+    Returns:
+        dict: The updated state after invoking the agent.
+
+    Raises:
+        ValueError: If no messages are found in the agent state.
+
+    """
+    with _bind_request(config) as exported_files:
+        answer = _answer_from_bank(state, name, config)
+        if answer is None and _uses_quiz_engine(name, config):
+            answer = _answer_from_quiz_engine(state, name, config)
+        if answer is not None:
+            result = {"messages": [], "output": answer}
+        else:
+            result = agent.invoke(state, _tag_config(config, name))
+    return _update_state(state, result, name, exported_files)
+
+# Function to create async agent nodes
+async def aagent_node(state, agent, name, config=None):
+    """
+    Invoke an agent asynchronously and update the state based on the agent's output.
+
+    This is the asynchronous counterpart of `agent_node`, used when the graph is run with `ainvoke` or `astream`.
+
     Parameters:
         state (dict): The current state of the conversation.
         agent (AgentExecutor): The agent to be invoked.
         name (str): The name of the agent.
+        config (dict, optional): The graph config of the current request.
 
     Returns:
         dict: The updated state after invoking the agent.
 
     Raises:
         ValueError: If no messages are found in the agent state.
+    """
+    with _bind_request(config) as exported_files:
+        answer = await asyncio.to_thread(_answer_from_bank, state, name, config)
+        if answer is None and _uses_quiz_engine(name, config):
+            answer = await _aanswer_from_quiz_engine(state, name, config)
+        if answer is not None:
+            result = {"messages": [], "output": answer}
+        else:
+            result = await agent.ainvoke(state, _tag_config(config, name))
+    return _update_state(state, result, name, exported_files)
 
+# Function to create the direct QA node
+def direct_qa_node(state, agent, name, config=None):
     """
-    result = agent.invoke(state)
+    Answer a question with the session's direct QA chain, and fall back to the agent when it cannot.
+
+    The direct QA chain (`configurable.qa_chain`) retrieves the notebook context of the question and answers it in one
+    streamed LLM call citing the notebook cells, instead of the agent's function-calling loop around the RAG chain.
+    The agent only runs when the chain is not configured or the retrieved context does not cover the question.
+
+    Parameters:
+        state (dict): The current state of the conversation.
+        agent (AgentExecutor): The agent answering the questions the direct QA chain cannot.
+        name (str): The name of the agent.
+        config (dict, optional): The graph config of the current request.
+
+    Returns:
+        dict: The updated state after answering the question.
+    """
+    qa_chain = (config or {}).get("configurable", {}).get("qa_chain")
+    if qa_chain is not None:
+        response = qa_chain.invoke(_qa_inputs(state), _tag_config(config, name))
+        if _is_answered(response, name):
+            return _update_state(state, {"messages": [], "output": response["response"].content}, name)
+    return agent_node(state, agent, name, config)
+
+async def adirect_qa_node(state, agent, name, config=None):
+    """
+    Answer a question with the session's direct QA chain asynchronously, and fall back to the agent when it cannot.
+
+    This is the asynchronous counterpart of `direct_qa_node`.
+
+    Parameters:
+        state (dict): The current state of the conversation.
+        agent (AgentExecutor): The agent answering the questions the direct QA chain cannot.
+        name (str): The name of the agent.
+        config (dict, optional): The graph config of the current request.
+
+    Returns:
+        dict: The updated state after answering the question.
+    """
+    qa_chain = (config or {}).get("configurable", {}).get("qa_chain")
+    if qa_chain is not None:
+        response = await qa_chain.ainvoke(_qa_inputs(state), _tag_config(config, name))
+        if _is_answered(response, name):
+            return _update_state(state, {"messages": [], "output": response["response"].content}, name)
+    return await aagent_node(state, agent, name, config)
+
+def create_direct_qa_node(agent, name="QAAgent"):
+    return RunnableLambda(
+        functools.partial(direct_qa_node, agent=agent, name=name),
+        afunc=functools.partial(adirect_qa_node, agent=agent, name=name),
+        name=name,
+    )
+
+def _qa_inputs(state):
+    return {"question": last_user_message(state), "messages": state["messages"]}
+
+def _is_answered(response, name):
+    if response["response"].content.strip().startswith(NO_ANSWER_MARKER):
+        logger.info("The notebook context does not cover the question, falling back to %s", name)
+        return False
+    return True
+
+# Function to create a graph node running an agent, natively sync and async
+def create_agent_node(agent, name):
+    return RunnableLambda(
+        functools.partial(agent_node, agent=agent, name=name),
+        afunc=functools.partial(aagent_node, agent=agent, name=name),
+        name=name,
+    )
+
+def _tag_config(config, name):
+    # Tag the agent's runs with its name so its LLM tokens can be attributed when streamed
+    config = dict(config or {})
+    config["tags"] = [*config.get("tags", []), name]
+    return config
+
+@contextmanager
+def _bind_request(config):
+    # Bind the session's retrieval chain and export directory to the tools, and collect the files they export
+    configurable = (config or {}).get("configurable", {})
+    exported_files = []
+    tokens = [
+        (current_retrieval_chain, current_retrieval_chain.set(configurable.get("retrieval_chain"))),
+        (current_export_dir, current_export_dir.set(configurable.get("export_dir"))),
+        (current_exported_files, current_exported_files.set(exported_files)),
+    ]
+    try:
+        yield exported_files
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+def _answer_from_bank(state, name, config):
+    # Serve a quiz or flashcards sampled from the study bank, leaving out the items already in the conversation
+    kind = BANK_AGENTS.get(name)
+    notebook_hash = (config or {}).get("configurable", {}).get("notebook_hash")
+    if kind is None or notebook_hash is None:
+        return None
+    conversation = "\n".join(str(message.content) for message in state.get("messages", []))
+    with span("study_bank.sample", kind=kind) as sample_span:
+        items = study_bank.sample(notebook_hash, kind, last_user_message(state), exclude=conversation)
+        sample_span.set(hit=items is not None)
+    if items is None:
+        return None
+    logger.info("%s answered from the study bank with %d items", name, len(items))
+    if kind == "flashcards":
+        flashcard_tool.invoke({"flashcards": [{"question": item["question"], "answer": item["answer"]} for item in items]})
+        return format_flashcards(items)
+    return format_quiz(items)
+
+def _uses_quiz_engine(name, config):
+    return name == "QuizAgent" and QUIZ_MODE == "parallel" and bool((config or {}).get("configurable", {}).get("documents"))
+
+def _answer_from_quiz_engine(state, name, config):
+    # Write the quiz with parallel calls over the notebook sections, leaving out the questions already asked
+    conversation = "\n".join(str(message.content) for message in state.get("messages", []))
+    documents = config["configurable"]["documents"]
+    questions = quiz_engine.create(last_user_message(state), documents, exclude=conversation, config=_tag_config(config, name))
+    return format_quiz(questions) if questions else None
+
+async def _aanswer_from_quiz_engine(state, name, config):
+    conversation = "\n".join(str(message.content) for message in state.get("messages", []))
+    documents = config["configurable"]["documents"]
+    questions = await quiz_engine.acreate(last_user_message(state), documents, exclude=conversation, config=_tag_config(config, name))
+    return format_quiz(questions) if questions else None
+
+def _update_state(state, result, name, exported_files=()):
     if 'messages' not in result:
         raise ValueError(f"No messages found in agent state: {result}")
-    new_state = {"messages": state["messages"] + [AIMessage(content=result["output"], name=name)]}
+    # Only return the new message: the graph appends it to the conversation instead of copying the whole history
+    new_state = {"messages": [AIMessage(content=result["output"], name=name)]}
 
     # Set the appropriate flags and next state
     if name == "QuizAgent":
@@ -86,6 +281,7 @@ def agent_node(state, agent, name):
 
     if name == "FlashcardsAgent":
         new_state["flashcards_created"] = True
+        new_state["flashcard_files"] = list(exported_files)
 
     return new_state
 
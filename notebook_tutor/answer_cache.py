@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    SemanticAnswerCache class.
+
+    This class represents an in-memory cache of RAG answers, partitioned per notebook index and per answering chain, so
+    chains writing different answers never serve each other's. A question is a hit when the embedding of a previously
+    answered question for the same notebook and chain is within `similarity_threshold` (cosine similarity) of its own
+    embedding. Entries expire after `ttl_seconds`, and each notebook and chain keeps at most
+    `max_entries_per_notebook` entries, evicting the least recently used ones.
+
+    Attributes:
+        similarity_threshold (float): The minimum cosine similarity for two questions to share an answer.
+        ttl_seconds (float): How long an answer is served from the cache.
+        max_entries_per_notebook (int): The maximum number of answers kept per notebook and chain.
+        hits (int): The number of questions answered from the cache.
+        misses (int): The number of questions that went through the RAG chain.
+
+    Methods:
+        lookup(namespace, embedding, chain): Returns the cached (answer, context) of the most similar question, or None.
+        store(namespace, question, embedding, answer, context, chain): Caches the answer to a question.
+        invalidate(namespace): Drops all cached answers of a notebook, for every chain.
+        stats(): Returns the number of cached answers and the hit rate.
+    """
+    def __init__(self, similarity_threshold=0.95, ttl_seconds=24 * 3600, max_entries_per_notebook=256):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_notebook = max_entries_per_notebook
+        self.hits = 0
+        self.misses = 0
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, namespace, embedding, chain=None):
+        """
+        Returns the cached answer of the most similar question asked about the same notebook and answered by the same
+        chain.
+
+        Parameters:
+            namespace (str): The notebook index the question is about.
+            embedding (list): The embedding of the question.
+            chain (str): The name of the chain answering the question.
+
+        Returns:
+            tuple: The cached (answer, context), or None when no cached question is similar enough.
+        """
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            entries = self._partitions.get((namespace, chain))
+            if entries:
+                for key in [key for key, entry in entries.items() if now - entry["created"] > self.ttl_seconds]:
+                    del entries[key]
+
+            if not entries:
+                self.misses += 1
+                return None
+
+            keys = list(entries)
+            similarities = np.stack([entries[key]["embedding"] for key in keys]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            entries.move_to_end(keys[best])
+            self.hits += 1
+            entry = entries[keys[best]]
+            return entry["answer"], entry["context"]
+
+    def store(self, namespace, question, embedding, answer, context, chain=None):
+        with self._lock:
+            entries = self._partitions.setdefault((namespace, chain), OrderedDict())
+            entries[question] = {
+                "embedding": self._normalize(embedding),
+                "answer": answer,
+                "context": context,
+                "created": time.time(),
+            }
+            entries.move_to_end(question)
+            while len(entries) > self.max_entries_per_notebook:
+                entries.popitem(last=False)
+
+    def invalidate(self, namespace):
+        with self._lock:
+            for partition in [partition for partition in self._partitions if partition[0] == namespace]:
+                del self._partitions[partition]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": sum(len(entries) for entries in self._partitions.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -5,7 +5,13 @@ from dotenv import load_dotenv
 from document_processing import DocumentManager
 from retrieval import RetrievalManager
 from langchain_core.messages import AIMessage, HumanMessage
-from graph import create_tutor_chain, TutorState
+from graph import get_tutor_chain, TutorState
+from streaming import TokenStreamHandler
+from memory import ConversationMemory, create_summarizer
+from study_bank import study_bank, STUDY_BANK
+from tools import FLASHCARDS_DIR
+from ingestion import ingestion_service
+from tracing import tracer, span
 import shutil
 
 # Load environment variables
@@ -16,6 +22,15 @@ logging.basicConfig(level=logging.INFO)
 
 logger = logging.getLogger(__name__)
 
+# Maximum size of an uploaded notebook; notebooks are streamed cell by cell, so memory does not grow with their size
+NOTEBOOK_MAX_SIZE_MB = int(os.environ.get("NOTEBOOK_MAX_SIZE_MB", "50"))
+
+# Build the tutor graph once at startup; sessions only bind their retrieval chain per request
+tutor_chain = get_tutor_chain()
+
+# Start the ingestion worker processes in the background, ready for the first uploads
+ingestion_service.start()
+
 @cl.on_chat_start
 async def start_chat():
     settings = {
@@ -32,26 +47,54 @@ async def start_chat():
     files = None
     while files is None:
         files = await cl.AskFileMessage(
-            content="Please upload a Jupyter notebook (.ipynb, max. 5mb) to start:",
+            content=f"Please upload a Jupyter notebook (.ipynb, max. {NOTEBOOK_MAX_SIZE_MB}mb) to start:",
             accept={"application/x-ipynb+json": [".ipynb"]},
-            max_size_mb=5
+            max_size_mb=NOTEBOOK_MAX_SIZE_MB
         ).send()
 
     file = files[0]  # Get the first file
 
     if file:
         notebook_path = file.path
-        doc_manager = DocumentManager(notebook_path)
-        doc_manager.load_document()
-        doc_manager.initialize_retriever()
-        cl.user_session.set("docs", doc_manager.get_documents())
-        cl.user_session.set("retrieval_manager", RetrievalManager(doc_manager.get_retriever()))
-
-        # Initialize LangGraph chain with the retrieval chain
-        retrieval_chain = cl.user_session.get("retrieval_manager").get_RAG_QA_chain()
-        cl.user_session.set("retrieval_chain", retrieval_chain)
-        tutor_chain = create_tutor_chain(retrieval_chain)
-        cl.user_session.set("tutor_chain", tutor_chain)
+        # Trace the processing of the upload, when tracing is enabled; a failed upload is exported with its error
+        with tracer.trace("upload", session=cl.user_session.get("id")):
+            doc_manager = await cl.make_async(DocumentManager)(notebook_path)
+            # Stored before indexing, so the chat end releases its collection even when the upload fails
+            cl.user_session.set("doc_manager", doc_manager)
+            # Parse and chunk the notebook in an ingestion worker process, off the event loop
+            await doc_manager.aload_document()
+
+            # Stream the embedding progress to the user while the notebook is indexed
+            progress_message = cl.Message(content="Processing the notebook...")
+            await progress_message.send()
+
+            async def report_progress(done, total):
+                progress_message.content = f"Processing the notebook... {done}/{total} chunks embedded."
+                await progress_message.update()
+
+            await doc_manager.ainitialize_retriever(progress_callback=report_progress)
+            cl.user_session.set("docs", doc_manager.get_documents())
+            cl.user_session.set("retrieval_manager", RetrievalManager(
+                doc_manager.get_retriever(),
+                embedding_model=doc_manager.get_embedding_model(),
+                cache_namespace=doc_manager.collection_name,
+            ))
+
+            # Keep the retrieval chain the shared LangGraph chain will use for this session
+            retrieval_chain = cl.user_session.get("retrieval_manager").get_RAG_QA_chain()
+            cl.user_session.set("retrieval_chain", retrieval_chain)
+            cl.user_session.set("qa_chain", cl.user_session.get("retrieval_manager").get_direct_QA_chain())
+
+            # Pre-generate the notebook's quiz questions and flashcards in the background, once per notebook content
+            if STUDY_BANK:
+                study_bank.schedule(doc_manager.notebook_hash, doc_manager.get_documents())
+                cl.user_session.set("notebook_hash", doc_manager.notebook_hash)
+
+            # Keep the session's conversation history within a token budget, summarizing its older turns
+            cl.user_session.set("memory", ConversationMemory(create_summarizer()))
+
+            # Export the session's flashcards to its own directory
+            cl.user_session.set("export_dir", os.path.join(FLASHCARDS_DIR, cl.user_session.get("id")))
 
         logger.info("Chat started and notebook uploaded successfully.")
 
@@ -72,87 +115,117 @@ async def main(message: cl.Message):
     - message (cl.Message): The message to be processed.
     """
 
-    # Retrieve the LangGraph chain from the session
-    tutor_chain = cl.user_session.get("tutor_chain")
+    # Retrieve the session's retrieval chain
+    retrieval_chain = cl.user_session.get("retrieval_chain")
 
-    if not tutor_chain:
+    if not retrieval_chain:
         await cl.Message(content="No document processing setup found. Please upload a Jupyter notebook first.").send()
         return
 
-    # Create the initial state with the user message
-    user_message = message.content
+    # Create the initial state with the conversation history and the user message
+    memory = cl.user_session.get("memory")
+    user_message = HumanMessage(content=message.content)
     state = TutorState(
-        messages=[HumanMessage(content=user_message)],
+        messages=memory.get_messages() + [user_message],
         next="supervisor",
         quiz=[],
         quiz_created=False,
         question_answered=False,
         flashcards_created=False,
+        flashcard_files=[],
     )
 
     logger.info(f"Initial state: {state}")
 
-    # Process the message through the LangGraph chain
-    for s in tutor_chain.stream(state, {"recursion_limit": 10}):
-        logger.info(f"State after processing: {s}")
-
-        agent_state = next(iter(s.values()))
-
-        if "QAAgent" in s:
-            if s['QAAgent']['question_answered']:
-                qa_message = agent_state["messages"][-1].content
-                logger.info(f"Sending QAAgent message: {qa_message}")
-                await cl.Message(content=qa_message).send()
-
-        if "QuizAgent" in s:
-            if s['QuizAgent']['quiz_created']:
-                quiz_message = agent_state["messages"][-1].content
-                logger.info(f"Sending QuizAgent message: {quiz_message}")
-                await cl.Message(content=quiz_message).send()
-
-        if "FlashcardsAgent" in s:
-            if s['FlashcardsAgent']['flashcards_created']:
-                flashcards_message = agent_state["messages"][-1].content
-                logger.info(f"Sending FlashcardsAgent message: {flashcards_message}")
-                await cl.Message(content=flashcards_message).send()
-
-                # Search for the flashcard file in the specified directory
-                flashcard_directory = 'flashcards'
-                flashcard_file = None
-                latest_time = 0
-                for root, dirs, files in os.walk(flashcard_directory):
-                    for file in files:
-                        if file.startswith('flashcards_') and file.endswith('.csv'):
-                            file_path = os.path.join(root, file)
-                            file_time = os.path.getmtime(file_path)
-                            if file_time > latest_time:
-                                latest_time = file_time
-                                flashcard_file = file_path
-
-                if flashcard_file:
-                    logger.info(f"Flashcard path: {flashcard_file}")
-                    # Use the File class to send the file
-                    file_element = cl.File(name="Flashcards", path=flashcard_file, display="inline")
-                    logger.info(f"Sending flashcards file: {file_element}")
-
-                    await cl.Message(
-                        content="Download the flashcards in .csv here:",
-                        elements=[file_element]
-                    ).send()
-
-    logger.info("Reached END state.")
+    # Trace the stages of the turn, when tracing is enabled; a failed turn is exported with its error
+    with tracer.trace("turn", session=cl.user_session.get("id")) as trace:
+        # Process the message through the LangGraph chain, streaming the agents' answers as they are generated
+        stream_handler = TokenStreamHandler()
+        config = {
+            "recursion_limit": 10,
+            "configurable": {
+                "retrieval_chain": retrieval_chain,
+                "qa_chain": cl.user_session.get("qa_chain"),
+                "documents": cl.user_session.get("docs"),
+                "notebook_hash": cl.user_session.get("notebook_hash"),
+                "export_dir": cl.user_session.get("export_dir"),
+            },
+            "callbacks": [stream_handler] + ([trace.callback_handler()] if trace else []),
+        }
+        answers = []
+        async for s in tutor_chain.astream(state, config):
+            logger.info(f"State after processing: {s}")
+
+            agent_state = next(iter(s.values()))
+            if "supervisor" not in s:
+                answers.extend(agent_state["messages"])
+
+            if "QAAgent" in s:
+                if s['QAAgent']['question_answered']:
+                    qa_message = agent_state["messages"][-1].content
+                    logger.info(f"Sending QAAgent message: {qa_message}")
+                    await send_agent_answer(stream_handler, "QAAgent", qa_message)
+
+            if "QuizAgent" in s:
+                if s['QuizAgent']['quiz_created']:
+                    quiz_message = agent_state["messages"][-1].content
+                    logger.info(f"Sending QuizAgent message: {quiz_message}")
+                    await send_agent_answer(stream_handler, "QuizAgent", quiz_message)
+
+            if "FlashcardsAgent" in s:
+                if s['FlashcardsAgent']['flashcards_created']:
+                    flashcards_message = agent_state["messages"][-1].content
+                    logger.info(f"Sending FlashcardsAgent message: {flashcards_message}")
+                    await send_agent_answer(stream_handler, "FlashcardsAgent", flashcards_message)
+
+                    # Send the files the flashcard tool exported during this turn
+                    file_elements = [
+                        cl.File(name=os.path.basename(path), path=path, display="inline")
+                        for path in agent_state.get("flashcard_files", [])
+                    ]
+                    if file_elements:
+                        logger.info(f"Sending flashcards files: {agent_state['flashcard_files']}")
+                        await cl.Message(
+                            content="Download the flashcards (.csv, or .apkg to import directly into Anki) here:",
+                            elements=file_elements
+                        ).send()
+
+        logger.info("Reached END state.")
+
+        # Record the turn, and summarize the older turns once the history exceeds its budget
+        memory.add_messages([user_message] + answers)
+        with span("memory.summarize"):
+            await memory.asummarize()
+
+
+async def send_agent_answer(stream_handler, agent, content):
+    """
+    Sends an agent's answer, unless its tokens were already streamed, in which case the streamed message is finalized.
+
+    Parameters:
+    - stream_handler (TokenStreamHandler): The handler that streamed the turn's tokens.
+    - agent (str): The name of the agent.
+    - content (str): The agent's complete answer.
+    """
+    streamed = stream_handler.has_streamed(agent)
+    await stream_handler.finish_agent(agent)
+    if not streamed:
+        await cl.Message(content=content).send()
 
 
 @cl.on_chat_end
 async def end_chat():
     """
-    Clean up the flashcards directory after the chat ends.
+    Clean up the session's flashcards directory after the chat ends.
     This function is executed when the chat session ends.
-    It removes the 'flashcards' directory and all its contents, if it exists.
-    If the directory does not exist, it creates a new empty directory with the same name.
+    It releases the session's reference on the shared notebook collection and removes the session's flashcards directory and all its contents, if it exists, leaving the files of the other sessions untouched.
     """
-    # Clean up the flashcards directory
-    flashcard_directory = 'flashcards'
-    if os.path.exists(flashcard_directory):
-        shutil.rmtree(flashcard_directory)
-        os.makedirs(flashcard_directory)
+    # Release the shared notebook collection
+    doc_manager = cl.user_session.get("doc_manager")
+    if doc_manager:
+        doc_manager.release()
+
+    # Clean up the session's flashcards directory
+    export_dir = cl.user_session.get("export_dir")
+    if export_dir and os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
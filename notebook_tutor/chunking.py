@@ -0,0 +1,196 @@
+import os
+import re
+import ast
+import hashlib
+from langchain_core.documents import Document
+from utils import TokenTextSplitter, get_token_counter
+
+# Configuration for the notebook chunker
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "400"))
+CHUNK_MIN_TOKENS = int(os.environ.get("CHUNK_MIN_TOKENS", "80"))
+CHUNK_HARD_MAX_TOKENS = 8000  # below the input limit of the embedding model
+
+HEADING_PATTERN = re.compile(r"^\s{0,3}(#{1,6})\s+(.+?)\s*#*\s*$")
+
+
+def format_cell(cell_type, source):
+    return f"```python\n{source}\n```" if cell_type == "code" else source
+
+
+def format_outputs(outputs):
+    return "Output:\n```\n" + "\n".join(outputs) + "\n```"
+
+
+def format_notebook_cell(cell):
+    text = format_cell(cell["cell_type"], cell["source"])
+    if cell.get("outputs"):
+        text += "\n" + format_outputs(cell["outputs"])
+    return text
+
+
+def code_blocks(source):
+    """
+    Splits a code cell into top-level blocks (statements, functions, classes with their decorators and the comments
+    above them), so a cell can be split without ever cutting a function or a class. Cells that are not valid Python
+    (e.g. with IPython magics) are split at blank lines followed by an unindented line.
+    """
+    lines = source.split("\n")
+    try:
+        body = ast.parse(source).body
+        starts = [min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1 for node in body]
+    except SyntaxError:
+        starts = [
+            i for i, line in enumerate(lines)
+            if i == 0 or (line and not line[0].isspace() and not lines[i - 1].strip())
+        ]
+    if not starts:
+        return [source]
+
+    # Comments and blank lines between two blocks belong to the block below them
+    boundaries = [0]
+    for start in starts[1:]:
+        while start > boundaries[-1] + 1 and lines[start - 1].lstrip().startswith("#"):
+            start -= 1
+        boundaries.append(start)
+    boundaries.append(len(lines))
+    blocks = ["\n".join(lines[begin:end]).strip("\n") for begin, end in zip(boundaries, boundaries[1:])]
+    return [block for block in blocks if block.strip()]
+
+
+class NotebookChunker:
+    """
+    NotebookChunker class.
+
+    This class cuts a notebook into chunks following its structure instead of a fixed token window. A markdown cell
+    starting with a heading opens a section, which holds the heading and the cells following it until the next
+    heading. A section is one chunk when it fits in `max_tokens`; longer sections are packed cell by cell into several
+    chunks, each repeating the section heading. Cells longer than `max_tokens` are split between top-level
+    statements (code) or paragraphs (markdown), so a function is never split. Chunks smaller than `min_tokens` are
+    merged with the next one when both fit in `max_tokens`.
+
+    Each chunk carries the index and type of its cells, its section heading and a hash of its text in its metadata.
+
+    Attributes:
+        max_tokens (int): The token budget of a chunk.
+        min_tokens (int): The size under which a chunk is merged with the next one.
+        token_counter (TokenCounter): The token counter measuring the chunks.
+
+    Methods:
+        chunk(cells, source): Returns the chunks of the cells of a notebook.
+    """
+    def __init__(self, max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS, token_counter=None):
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.token_counter = token_counter or get_token_counter()
+        self._fallback_splitter = TokenTextSplitter(
+            token_counter=self.token_counter, chunk_size=max_tokens, chunk_overlap=0
+        )
+
+    def chunk(self, cells, source):
+        """
+        Returns the chunks of the cells of a notebook.
+
+        Parameters:
+            cells (iterable): The cells, as yielded by `notebook_loader.iter_notebook_cells`.
+            source (str): The notebook path, recorded in the metadata of the chunks.
+
+        Returns:
+            list: The chunks, as Documents.
+        """
+        chunks = []
+        for heading, section_cells in self._sections(cells):
+            chunks.extend(self._pack(heading, section_cells))
+        return [self._document(chunk, source) for chunk in self._merge_small(chunks)]
+
+    def _sections(self, cells):
+        heading, section_cells = None, []
+        for cell in cells:
+            match = HEADING_PATTERN.match(cell["source"].split("\n", 1)[0]) if cell["cell_type"] == "markdown" else None
+            if match and section_cells:
+                yield heading, section_cells
+                section_cells = []
+            if match:
+                heading = match.group(2)
+            section_cells.append(cell)
+        if section_cells:
+            yield heading, section_cells
+
+    def _pieces(self, cell):
+        # Split a cell longer than the budget into pieces of whole blocks
+        text = format_notebook_cell(cell)
+        tokens = self.token_counter.count(text)
+        if tokens <= self.max_tokens:
+            return [(text, tokens)]
+
+        if cell["cell_type"] == "code":
+            blocks = [format_cell("code", block) for block in code_blocks(cell["source"])]
+        else:
+            blocks = [block for block in cell["source"].split("\n\n") if block.strip()]
+        if cell.get("outputs"):
+            blocks.append(format_outputs(cell["outputs"]))
+
+        pieces = []
+        for block, block_tokens in zip(blocks, self.token_counter.count_batch(blocks)):
+            if block_tokens > CHUNK_HARD_MAX_TOKENS:
+                # Only a block too long to be embedded at all is cut mid-block
+                pieces.extend((part, self.token_counter.count(part)) for part in self._fallback_splitter.split_text(block))
+            elif pieces and pieces[-1][1] + block_tokens <= self.max_tokens:
+                merged = pieces[-1][0] + "\n\n" + block
+                pieces[-1] = (merged, self.token_counter.count(merged))
+            else:
+                pieces.append((block, block_tokens))
+        return pieces
+
+    def _pack(self, heading, cells):
+        # Pack the pieces of a section's cells into chunks, repeating the heading at the top of continued chunks
+        heading_text = f"# {heading} (continued)" if heading else None
+        heading_tokens = self.token_counter.count(heading_text) if heading_text else 0
+
+        chunks, current = [], None
+        for cell in cells:
+            for text, tokens in self._pieces(cell):
+                if current and current["tokens"] + tokens <= self.max_tokens:
+                    current["texts"].append(text)
+                    current["tokens"] += tokens
+                else:
+                    if current:
+                        chunks.append(current)
+                    prefix = [heading_text] if heading_text and current else []
+                    current = {
+                        "texts": prefix + [text],
+                        "tokens": tokens + (heading_tokens if prefix else 0),
+                        "cells": [],
+                        "heading": heading,
+                    }
+                if (cell["index"], cell["cell_type"]) not in current["cells"]:
+                    current["cells"].append((cell["index"], cell["cell_type"]))
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _merge_small(self, chunks):
+        merged = []
+        for chunk in chunks:
+            previous = merged[-1] if merged else None
+            if previous and previous["tokens"] < self.min_tokens and previous["tokens"] + chunk["tokens"] <= self.max_tokens:
+                previous["texts"].extend(chunk["texts"])
+                previous["tokens"] += chunk["tokens"]
+                previous["cells"].extend(cell for cell in chunk["cells"] if cell not in previous["cells"])
+                previous["heading"] = previous["heading"] or chunk["heading"]
+            else:
+                merged.append(chunk)
+        return merged
+
+    @staticmethod
+    def _document(chunk, source):
+        text = "\n\n".join(chunk["texts"])
+        metadata = {
+            "source": str(source),
+            "cell_index": chunk["cells"][0][0],
+            "cell_type": chunk["cells"][0][1],
+            "cell_indexes": [index for index, _ in chunk["cells"]],
+            "cell_types": [cell_type for _, cell_type in chunk["cells"]],
+            "section": chunk["heading"],
+            "cell_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        }
+        return Document(page_content=text, metadata=metadata)
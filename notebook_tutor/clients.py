@@ -0,0 +1,112 @@
+import os
+import threading
+import httpx
+import openai
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from langchain_openai.embeddings import OpenAIEmbeddings
+
+# Load environment variables
+load_dotenv()
+
+# Configuration for the pooled HTTP connections shared by all model clients
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE")
+HTTP_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30"))
+
+# Tag carried by the agent LLM, whose answer tokens are streamed to the user
+AGENT_LLM_TAG = "agent_llm"
+
+_lock = threading.RLock()
+_openai_clients = {}
+_chat_models = {}
+_embedding_models = {}
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_openai_clients(base_url=None, max_retries=2):
+    """
+    Returns the process-wide OpenAI clients for an API base URL.
+
+    The sync and async clients each hold one pooled, keep-alive HTTP connection pool; clients with a different
+    `max_retries` are derived from them and share the same pools.
+
+    Parameters:
+        base_url (str, optional): The API base URL, defaults to `OPENAI_API_BASE` (or the OpenAI API).
+        max_retries (int): The number of retries of failed requests.
+
+    Returns:
+        tuple: The (openai.OpenAI, openai.AsyncOpenAI) clients.
+    """
+    base_url = base_url or OPENAI_API_BASE
+    with _lock:
+        if (base_url, None) not in _openai_clients:
+            _openai_clients[(base_url, None)] = (
+                openai.OpenAI(base_url=base_url, http_client=httpx.Client(limits=_limits())),
+                openai.AsyncOpenAI(base_url=base_url, http_client=httpx.AsyncClient(limits=_limits())),
+            )
+        if (base_url, max_retries) not in _openai_clients:
+            sync_client, async_client = _openai_clients[(base_url, None)]
+            _openai_clients[(base_url, max_retries)] = (
+                sync_client.with_options(max_retries=max_retries),
+                async_client.with_options(max_retries=max_retries),
+            )
+        return _openai_clients[(base_url, max_retries)]
+
+
+def get_chat_model(model, temperature=0.7, **kwargs):
+    """
+    Returns the process-wide ChatOpenAI instance for a model and its settings, creating it on first use.
+
+    Parameters:
+        model (str): The OpenAI chat model name.
+        temperature (float): The sampling temperature.
+        **kwargs: Other ChatOpenAI settings (e.g. `streaming`), part of the registry key.
+
+    Returns:
+        ChatOpenAI: The shared chat model.
+    """
+    key = (model, temperature, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in kwargs.items())))
+    with _lock:
+        if key not in _chat_models:
+            sync_client, async_client = get_openai_clients()
+            _chat_models[key] = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                client=sync_client.chat.completions,
+                async_client=async_client.chat.completions,
+                **kwargs,
+            )
+        return _chat_models[key]
+
+
+def get_embedding_model(model, base_url=None, max_retries=2):
+    """
+    Returns the process-wide OpenAIEmbeddings instance for a model, creating it on first use.
+
+    Parameters:
+        model (str): The OpenAI embedding model name.
+        base_url (str, optional): The API base URL, defaults to `OPENAI_API_BASE` (or the OpenAI API).
+        max_retries (int): The number of retries of failed requests.
+
+    Returns:
+        OpenAIEmbeddings: The shared embedding model.
+    """
+    key = (model, base_url, max_retries)
+    with _lock:
+        if key not in _embedding_models:
+            sync_client, async_client = get_openai_clients(base_url, max_retries)
+            _embedding_models[key] = OpenAIEmbeddings(
+                model=model,
+                client=sync_client.embeddings,
+                async_client=async_client.embeddings,
+            )
+        return _embedding_models[key]
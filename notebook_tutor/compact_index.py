@@ -0,0 +1,362 @@
+import os
+import copy
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from qdrant_client.http import models
+
+# Configuration for the compact in-process vector index
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "qdrant")  # "qdrant", or "compact" for the in-process NumPy index
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "int8")  # one of "float16", "int8", "binary"
+VECTOR_RESCORE_FACTOR = int(os.environ.get("VECTOR_RESCORE_FACTOR", "4"))  # binary candidates rescored per result
+COMPACT_INDEX_CACHE_SIZE = int(os.environ.get("COMPACT_INDEX_CACHE_SIZE", "32"))
+
+VECTOR_INDEXES = ("qdrant", "compact")
+QUANTIZATIONS = ("float16", "int8", "binary")
+
+# Rows scored at once, bounding the float32 copy made by a search
+SEARCH_BLOCK_SIZE = 4096
+
+# Number of set bits of every byte, to count the differing bits of binary codes
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint16)
+
+
+def _field_values(metadata, key):
+    # Values of a (dotted) payload key, with Qdrant's array semantics: a list matches when one of its items does
+    values = [metadata]
+    for part in key.removeprefix("metadata.").replace("[]", "").split("."):
+        values = [value.get(part) for value in values if isinstance(value, dict)]
+        values = [item for value in values for item in (value if isinstance(value, list) else [value])]
+    return [value for value in values if value is not None]
+
+
+def _matches_condition(metadata, condition):
+    if isinstance(condition, models.Filter):
+        return matches_filter(metadata, condition)
+    if isinstance(condition, models.IsEmptyCondition):
+        return not _field_values(metadata, condition.is_empty.key)
+    if isinstance(condition, models.IsNullCondition):
+        return not _field_values(metadata, condition.is_null.key)
+    if not isinstance(condition, models.FieldCondition):
+        raise ValueError(f"Unsupported filter condition: {condition!r}")
+
+    values = _field_values(metadata, condition.key)
+    match, range_ = condition.match, condition.range
+    if isinstance(match, models.MatchValue):
+        return match.value in values
+    if isinstance(match, models.MatchAny):
+        return any(value in match.any for value in values)
+    if isinstance(match, models.MatchExcept):
+        return bool(values) and all(value not in match.except_ for value in values)
+    if isinstance(match, models.MatchText):
+        return any(match.text in str(value) for value in values)
+    if range_ is not None:
+        bounds = [(range_.gt, lambda a, b: a > b), (range_.gte, lambda a, b: a >= b),
+                  (range_.lt, lambda a, b: a < b), (range_.lte, lambda a, b: a <= b)]
+        return any(
+            isinstance(value, (int, float)) and all(bound is None or compare(value, bound) for bound, compare in bounds)
+            for value in values
+        )
+    raise ValueError(f"Unsupported filter condition: {condition!r}")
+
+
+def matches_filter(metadata, filter):
+    """
+    Returns whether document metadata matches a Qdrant filter, evaluated as Qdrant evaluates payloads.
+
+    Parameters:
+        metadata (dict): The metadata of a document.
+        filter (Filter): The Qdrant filter, with `must`, `should` and `must_not` conditions on `FieldCondition`
+            matches (value, any, except, text), ranges, emptiness checks and nested filters.
+
+    Returns:
+        bool: True when the document matches.
+    """
+    def conditions(clause):
+        return clause if isinstance(clause, list) else [clause] if clause is not None else []
+
+    return (
+        all(_matches_condition(metadata, condition) for condition in conditions(filter.must))
+        and (not conditions(filter.should) or any(_matches_condition(metadata, c) for c in conditions(filter.should)))
+        and not any(_matches_condition(metadata, condition) for condition in conditions(filter.must_not))
+    )
+
+
+def filter_from_dict(filter):
+    """
+    Converts a LangChain `Qdrant` metadata filter dictionary (e.g. `{"cell_type": "code"}`) into a Qdrant filter.
+    """
+    def conditions(key, value):
+        if isinstance(value, dict):
+            return [condition for sub_key, sub_value in value.items() for condition in conditions(f"{key}.{sub_key}", sub_value)]
+        if isinstance(value, list):
+            return [condition for item in value for condition in conditions(key, item)]
+        return [models.FieldCondition(key=f"metadata.{key}", match=models.MatchValue(value=value))]
+
+    return models.Filter(must=[condition for key, value in filter.items() for condition in conditions(key, value)])
+
+
+class CompactVectorIndex:
+    """
+    CompactVectorIndex class.
+
+    This class is an exact, in-process vector index for the few hundred chunks of a notebook: the normalized vectors
+    are stored in one contiguous quantized NumPy array and searched by cosine similarity with vectorized top-k
+    selection, without the per-point objects of a Qdrant collection.
+
+    - `float16` halves the memory of float32 vectors, with scores within about 1e-3 of exact.
+    - `int8` quarters it, with a scale per vector.
+    - `binary` keeps one bit per dimension for the candidate scan (Hamming distance), then rescores the
+      `rescore_factor * k` best candidates with int8 codes kept next to the bits.
+
+    Attributes:
+        quantization (str): "float16", "int8" or "binary".
+        rescore_factor (int): The number of binary candidates rescored per result.
+        size (int): The number of vectors.
+        dimension (int): The dimension of the vectors.
+
+    Methods:
+        search(vector, k, mask): Returns the (row, cosine similarity) pairs of the k most similar vectors.
+        extend(vectors): Returns a new index with vectors appended, leaving this one unchanged.
+        nbytes(): Returns the memory used by the vectors.
+    """
+    def __init__(self, vectors, quantization=VECTOR_QUANTIZATION, rescore_factor=VECTOR_RESCORE_FACTOR):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = self._normalize(vectors.reshape(len(vectors), vectors.shape[-1] if vectors.ndim > 1 else 0))
+        self.size, self.dimension = vectors.shape
+        self._scales = None
+        self._bits = None
+        if quantization == "float16":
+            self._codes = vectors.astype(np.float16)
+        else:
+            # Symmetric int8 codes with a scale per vector
+            self._scales = np.maximum(np.abs(vectors).max(axis=1, initial=0.0), 1e-12) / 127.0
+            self._codes = np.rint(vectors / self._scales[:, None]).astype(np.int8)
+            self._scales = self._scales.astype(np.float32)
+        if quantization == "binary":
+            self._bits = np.packbits(vectors > 0, axis=1)
+
+    def extend(self, vectors):
+        """
+        Returns a new index holding the vectors of this index followed by the given ones.
+
+        Indexes are shared by the sessions of a notebook, so they are never modified in place: the new vectors are
+        quantized on their own (the scales are per vector) and the arrays are copied into the new index.
+
+        Parameters:
+            vectors (list): The vectors to append.
+
+        Returns:
+            CompactVectorIndex: The extended index.
+        """
+        added = CompactVectorIndex(vectors, self.quantization, self.rescore_factor)
+        if self.size == 0:
+            return added
+        if added.size == 0:
+            return self
+        if added.dimension != self.dimension:
+            raise ValueError(f"Cannot add vectors of dimension {added.dimension} to an index of dimension {self.dimension}")
+        extended = copy.copy(self)
+        extended.size = self.size + added.size
+        for name in ("_codes", "_scales", "_bits"):
+            if getattr(self, name) is not None:
+                setattr(extended, name, np.concatenate([getattr(self, name), getattr(added, name)]))
+        return extended
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (self._codes, self._scales, self._bits) if array is not None)
+
+    def _scores(self, query, rows=None):
+        # Cosine similarities of the query with the given rows (all by default), scored block by block
+        codes = self._codes if rows is None else self._codes[rows]
+        scales = self._scales if rows is None or self._scales is None else self._scales[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SEARCH_BLOCK_SIZE):
+            scores[start:start + SEARCH_BLOCK_SIZE] = codes[start:start + SEARCH_BLOCK_SIZE].astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    @staticmethod
+    def _top_k(scores, k):
+        if k >= len(scores):
+            return np.argsort(-scores, kind="stable")
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def search(self, vector, k=4, mask=None):
+        """
+        Returns the k vectors most similar to a query vector.
+
+        Parameters:
+            vector (list): The query vector.
+            k (int): The number of results.
+            mask (array, optional): The rows that may be returned, as a boolean array (e.g. from a metadata filter).
+
+        Returns:
+            list: The (row, cosine similarity) pairs, most similar first.
+        """
+        if self.size == 0 or k <= 0:
+            return []
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+        rows = np.flatnonzero(mask) if mask is not None else None
+        if rows is not None and len(rows) == 0:
+            return []
+        candidates = np.arange(self.size) if rows is None else rows
+
+        if self._bits is not None and len(candidates) > k * self.rescore_factor:
+            # Keep the candidates agreeing with the query on the most signs, then rescore them
+            query_bits = np.packbits(query > 0)
+            distances = POPCOUNT[np.bitwise_xor(self._bits[candidates], query_bits)].sum(axis=1)
+            candidates = candidates[self._top_k(-distances.astype(np.float32), k * self.rescore_factor)]
+
+        scores = self._scores(query, None if len(candidates) == self.size else candidates)
+        return [(int(candidates[i]), float(scores[i])) for i in self._top_k(scores, k)]
+
+
+class CompactVectorStore(VectorStore):
+    """
+    CompactVectorStore class.
+
+    This class is a LangChain vector store over a `CompactVectorIndex` and its documents, a drop-in replacement of the
+    `Qdrant` store of a notebook collection: searches accept the same `filter` argument (a Qdrant `Filter` or a
+    metadata dictionary) and relevance scores use the same cosine normalization.
+
+    Texts added to a store extend its own copy of the index, so the other sessions sharing the notebook index do not
+    see them.
+
+    Attributes:
+        index (CompactVectorIndex): The quantized vectors.
+        documents (list): The document of each vector.
+        ids (list): The id of each vector.
+        embeddings (Embeddings): The embedding model of the queries and of the added texts.
+    """
+    def __init__(self, index, documents, embedding, ids=None):
+        self.index = index
+        self.documents = list(documents)
+        self.ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in self.documents]
+        self._embedding = embedding
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, quantization=VECTOR_QUANTIZATION, ids=None, **kwargs):
+        store = cls(CompactVectorIndex(np.empty((0, 0), dtype=np.float32), quantization), [], embedding)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                  **kwargs: Any) -> List[str]:
+        """
+        Embeds texts and appends them to the store.
+
+        Parameters:
+            texts (Iterable[str]): The texts to add.
+            metadatas (list, optional): The metadata of each text.
+            ids (list, optional): The id of each text, random ones by default.
+
+        Returns:
+            list: The ids of the added texts.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        if not len(metadatas) == len(ids) == len(texts):
+            raise ValueError("The number of metadatas and ids must match the number of texts")
+        vectors = self._embedding.embed_documents(texts)
+        with self._lock:
+            self.index = self.index.extend(vectors)
+            self.documents = self.documents + [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+            self.ids = self.ids + ids
+        return ids
+
+    @staticmethod
+    def _mask(documents, filter):
+        if filter is None:
+            return None
+        if isinstance(filter, dict):
+            filter = filter_from_dict(filter)
+        return np.array([matches_filter(document.metadata, filter) for document in documents], dtype=bool)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, score_threshold=None, **kwargs):
+        # Search a consistent snapshot of the index and its documents, whatever texts are added meanwhile
+        with self._lock:
+            index, documents = self.index, self.documents
+        results = [(documents[row], score) for row, score in index.search(embedding, k, self._mask(documents, filter))]
+        if score_threshold is not None:
+            results = [(document, score) for document, score in results if score >= score_threshold]
+        return results
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, filter, **kwargs)
+
+    async def asimilarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = await self._embedding.aembed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k, filter, **kwargs)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
+
+    async def asimilarity_search(self, query, k=4, filter=None, **kwargs):
+        return [document for document, _ in await self.asimilarity_search_with_score(query, k, filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Same normalization as the `Qdrant` store with cosine distance, so score thresholds carry over
+        return lambda score: (score + 1.0) / 2.0
+
+
+class CompactIndexCache:
+    """
+    CompactIndexCache class.
+
+    This class keeps the compact indexes of the most recently used notebooks, keyed by index key, so the sessions of
+    the same notebook share one index.
+
+    Methods:
+        get(key): Returns the index and documents of a notebook, or None.
+        put(key, index, documents): Stores the index and documents of a notebook, evicting the least recently used.
+    """
+    def __init__(self, max_size=COMPACT_INDEX_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, index, documents):
+        with self._lock:
+            self._entries[key] = (index, documents)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+# Instantiate the compact index cache shared by all sessions
+compact_indexes = CompactIndexCache()
@@ -1,19 +1,73 @@
 import os
-from langchain_community.document_loaders import NotebookLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import asyncio
+import hashlib
+import logging
 from langchain_community.vectorstores import Qdrant
-from langchain.retrievers import MultiQueryRetriever
-from langchain_openai.embeddings import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
-from notebook_tutor.utils import tiktoken_len
+from chunking import CHUNK_MAX_TOKENS, CHUNK_MIN_TOKENS
+from notebook_loader import NOTEBOOK_INCLUDE_OUTPUTS, NOTEBOOK_MAX_OUTPUT_CHARS
+from ingestion import chunk_notebook, ingestion_service
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from vector_store import CollectionRegistry, hash_file
+from embedding_pipeline import AsyncEmbeddingPipeline
+from clients import get_chat_model, get_embedding_model
+from tracing import span, tracer
+from retrievers import (
+    RETRIEVAL_MODES, VECTOR_MODE, MULTI_QUERY_MODE,
+    QueryVariantCache, CachedMultiQueryRetriever, HybridRetriever, FusionRetriever,
+)
+from keyword_index import KeywordRetriever
+from compact_index import VECTOR_INDEX, VECTOR_INDEXES, VECTOR_QUANTIZATION, CompactVectorIndex, CompactVectorStore, compact_indexes
 
 # Load environment variables
 load_dotenv()
 
 # Configuration for OpenAI
 OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
-openai_chat_model = ChatOpenAI(model="gpt-4o", temperature=0.1)
+openai_chat_model = get_chat_model("gpt-4o", temperature=0.1)
+
+# Configuration for the embeddings
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+EMBEDDING_API_BASE = os.environ.get("EMBEDDING_API_BASE")  # e.g. a local fake embeddings server; defaults to OPENAI_API_BASE
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+# Configuration for the vector store
+VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", os.path.join(".cache", "vector_store"))
+VECTOR_STORE_URL = os.environ.get("QDRANT_URL")
+VECTOR_STORE_TTL_SECONDS = float(os.environ.get("VECTOR_STORE_TTL_SECONDS", str(24 * 3600)))
+
+# Bump when the loading or splitting logic changes, so notebooks get re-indexed
+INDEX_VERSION = (
+    f"{EMBEDDING_MODEL}:{CHUNK_MAX_TOKENS}:{CHUNK_MIN_TOKENS}:"
+    f"{NOTEBOOK_MAX_OUTPUT_CHARS if NOTEBOOK_INCLUDE_OUTPUTS else 0}:sections:v4"
+)
+
+# Minimum share of chunks a previously indexed notebook must have in common with a new upload to be reused
+INCREMENTAL_MIN_OVERLAP = float(os.environ.get("INCREMENTAL_MIN_OVERLAP", "0.5"))
+
+# Configuration for the retriever
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")  # one of "vector", "multi_query", "hybrid"
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "4"))
+# Relevance score, (cosine + 1) / 2 for the cosine collections, under which the hybrid mode rewrites the query:
+# 0.75 is a cosine of 0.5, which the best hit of an unrelated question with text-embedding-3-small stays under
+HYBRID_SCORE_THRESHOLD = float(os.environ.get("HYBRID_SCORE_THRESHOLD", "0.75"))
+QUERY_VARIANT_CACHE_SIZE = int(os.environ.get("QUERY_VARIANT_CACHE_SIZE", "1024"))
+KEYWORD_SEARCH = os.environ.get("KEYWORD_SEARCH", "true").lower() in ("1", "true", "yes")  # BM25 fused with the vectors
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+# Instantiate the persistent embedding cache shared by all sessions
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+
+# Instantiate the registry of notebook collections shared by all sessions
+collection_registry = CollectionRegistry(VECTOR_STORE_PATH, url=VECTOR_STORE_URL, ttl_seconds=VECTOR_STORE_TTL_SECONDS)
+
+# Instantiate the cache of multi-query rewrites shared by all sessions
+query_variant_cache = QueryVariantCache(max_size=QUERY_VARIANT_CACHE_SIZE)
+
+logger = logging.getLogger(__name__)
 
 class DocumentManager:
     """
@@ -21,25 +75,54 @@ class DocumentManager:
 
     Attributes:
         notebook_path (str): The path to the notebook file.
-        docs (list): A list of loaded documents.
+        notebook_hash (str): The SHA-256 hash of the notebook content.
+        collection_name (str): The name of the shared collection holding the notebook vectors.
+        retrieval_mode (str): How documents are retrieved: "vector" (plain vector search), "multi_query" (LLM query
+            rewriting on every question) or "hybrid" (query rewriting only when the vector search is not confident).
+        vector_index (str): Where the vectors are searched: "qdrant" (the shared Qdrant collection) or "compact" (a
+            quantized in-process `CompactVectorIndex`, shared by the sessions of the same notebook).
+        docs (list): The chunks of the notebook, built by `NotebookChunker`.
+        keyword_index (BM25Index): The local keyword index of the chunks, fused with the vector search.
+        compact_index (tuple): The (`CompactVectorIndex`, chunks) entry searched with the "compact" vector index.
         retriever (object): The retriever object used for document retrieval.
+        embedding_model (object): The embedding model used to embed queries against the notebook collection.
+        embedding_stats (dict): The embedding cache hits and misses of the last `initialize_retriever` call.
 
     Methods:
         load_document(): Loads the documents from the notebook file.
+        aload_document(ingestion=None): Loads the documents in an ingestion worker process.
         initialize_retriever(): Initializes the retriever object for document retrieval.
+        ainitialize_retriever(progress_callback=None): Initializes the retriever object without blocking the event loop.
+        release(): Releases the shared collection used by this manager.
         get_retriever(): Returns the retriever object.
+        get_embedding_model(): Returns the embedding model used for queries.
         get_documents(): Returns the loaded documents.
     """
-    def __init__(self, notebook_path):
+    def __init__(self, notebook_path, retrieval_mode=RETRIEVAL_MODE, vector_index=VECTOR_INDEX):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {retrieval_mode!r}, expected one of {RETRIEVAL_MODES}")
+        if vector_index not in VECTOR_INDEXES:
+            raise ValueError(f"Unknown vector index {vector_index!r}, expected one of {VECTOR_INDEXES}")
         self.notebook_path = notebook_path
+        self.retrieval_mode = retrieval_mode
+        self.vector_index = vector_index
+        self.notebook_hash = hash_file(notebook_path)
+        self.collection_name = CollectionRegistry.collection_name(
+            hashlib.sha256(f"{INDEX_VERSION}:{self.notebook_hash}".encode("utf-8")).hexdigest()
+        )
         self.docs = None
+        self.keyword_index = None
+        self.compact_index = None
         self.retriever = None
+        self.embedding_model = None
+        self.embedding_stats = None
+        self._acquired = False
 
     def load_document(self):
         """
         Loads the documents from the notebook file.
 
-        This method initializes a `NotebookLoader` object with the specified parameters and uses it to load the documents from the notebook file. The loaded documents are stored in the `docs` attribute of the `DocumentManager` instance.
+        This method streams the cells of the notebook file, with the text of their outputs when `NOTEBOOK_INCLUDE_OUTPUTS` is set (images and other binary outputs are skipped), and cuts them into chunks with a `NotebookChunker`, which keeps markdown headings with the cells that follow them and never splits a function. The chunks are stored in the `docs` attribute of the `DocumentManager` instance, and indexed by a local BM25 keyword index.
 
         Parameters:
             None
@@ -50,46 +133,307 @@ class DocumentManager:
         Raises:
             None
         """
-        loader = NotebookLoader(
-            self.notebook_path,
-            include_outputs=False,
-            max_output_length=20,
-            remove_newline=True,
-            traceback=False
-        )
-        self.docs = loader.load()
+        with span("document.load") as load_span:
+            self.docs, self.keyword_index, _, _ = chunk_notebook(self.notebook_path)
+            load_span.set(chunks=len(self.docs))
+
+    async def aload_document(self, ingestion=None):
+        """
+        Loads the documents from the notebook file in a worker process of the ingestion service.
+
+        This is the asynchronous counterpart of `load_document`: the notebook is parsed, chunked and indexed by the
+        shared `IngestionService` (or the given one), off the web process, and uploads of the same notebook content
+        in progress at the same time share one job.
+
+        Parameters:
+            ingestion (IngestionService, optional): The ingestion service, defaults to the shared one.
+
+        Returns:
+            None
+        """
+        ingestion = ingestion or ingestion_service
+        with span("document.load") as load_span:
+            self.docs, self.keyword_index = await ingestion.submit(self.notebook_path, self.notebook_hash)
+            load_span.set(chunks=len(self.docs))
 
     def initialize_retriever(self):
         """
-        A class for managing documents and retrieving information from them.
-
-        Attributes:
-            notebook_path (str): The path to the notebook file.
-            docs (list): A list of loaded documents.
-            retriever (object): The retriever object used for document retrieval.
-
-        Methods:
-            load_document(): Loads the documents from the notebook file.
-            initialize_retriever(): Initializes the retriever object for document retrieval.
-            get_retriever(): Returns the retriever object.
-            get_documents(): Returns the loaded documents.
+        Initializes the retriever object for document retrieval.
+
+        The notebook vectors live in a collection keyed by the notebook content hash and shared by all sessions. The
+        notebook is only split and embedded when no session indexed the same content before; otherwise the existing
+        collection is reused as is. When a previous version of the notebook was indexed, only its added or changed
+        chunks are embedded, and the vectors of the unchanged chunks are copied over. With the "compact" vector index,
+        the chunk vectors (mostly served by the embedding cache) are quantized into an in-process index instead.
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+        embedding_model = self._get_embedding_model()
+        if self.vector_index == "compact":
+            with collection_registry.lock(self.collection_name):
+                self.compact_index = compact_indexes.get(self.collection_name)
+                if self.compact_index is None:
+                    texts = [doc.page_content for doc in self.docs]
+                    with span("index.embed", chunks=len(texts)) as embed_span:
+                        vectors = embedding_model.embed_documents(texts)
+                        embed_span.set(**tracer.embedding_usage(EMBEDDING_MODEL, texts, embedding_model.misses))
+                    self.compact_index = self._build_compact_index(vectors)
+            self._record_embedding_stats(embedding_model)
+            self._set_retriever(embedding_model)
+            return
+
+        self._acquire()
+
+        try:
+            with collection_registry.lock(self.collection_name):
+                if collection_registry.is_ready(self.collection_name):
+                    logger.info("Reusing collection %s", self.collection_name)
+                else:
+                    with span("index.plan"):
+                        plan = self._plan_index()
+                    try:
+                        texts = [chunk.page_content for chunk in plan["chunks"]]
+                        with span("index.embed", chunks=len(texts)) as embed_span:
+                            vectors = embedding_model.embed_documents(texts)
+                            embed_span.set(**tracer.embedding_usage(EMBEDDING_MODEL, texts, embedding_model.misses))
+                        with span("index.store"):
+                            self._store_index(plan, vectors)
+                    finally:
+                        self._release_base(plan)
+
+            self._record_embedding_stats(embedding_model)
+            self._set_retriever(embedding_model)
+        except BaseException:
+            # Give the collection back on failure, so it can still expire
+            self.release()
+            raise
+
+    async def ainitialize_retriever(self, progress_callback=None):
+        """
+        Initializes the retriever object for document retrieval without blocking the event loop.
+
+        This is the asynchronous counterpart of `initialize_retriever`: splitting and vector store writes run in worker
+        threads, and the chunks are embedded by an `AsyncEmbeddingPipeline` in concurrent, rate-limit-aware batches.
+
+        Parameters:
+            progress_callback (callable, optional): Awaited with (embedded chunks, total chunks) after each batch.
+
+        Returns:
+            None
+        """
+        embedding_model = self._get_embedding_model()
+        # Rate limits of the indexing requests are retried by the pipeline itself
+        indexing_model = self._get_embedding_model(max_retries=0)
+        if self.vector_index != "compact":
+            await asyncio.to_thread(self._acquire)
+
+        try:
+            lock = collection_registry.lock(self.collection_name)
+            await asyncio.to_thread(lock.acquire)
+            try:
+                if self.vector_index == "compact":
+                    self.compact_index = compact_indexes.get(self.collection_name)
+                    if self.compact_index is None:
+                        pipeline = AsyncEmbeddingPipeline(
+                            indexing_model,
+                            batch_size=EMBEDDING_BATCH_SIZE,
+                            max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                        )
+                        texts = [doc.page_content for doc in self.docs]
+                        with span("index.embed", chunks=len(texts)) as embed_span:
+                            vectors = await pipeline.embed(texts, progress_callback)
+                            embed_span.set(**tracer.embedding_usage(EMBEDDING_MODEL, texts, indexing_model.misses))
+                        self.compact_index = await asyncio.to_thread(self._build_compact_index, vectors)
+                elif await asyncio.to_thread(collection_registry.is_ready, self.collection_name):
+                    logger.info("Reusing collection %s", self.collection_name)
+                else:
+                    with span("index.plan"):
+                        plan = await asyncio.to_thread(self._plan_index)
+                    try:
+                        pipeline = AsyncEmbeddingPipeline(
+                            indexing_model,
+                            batch_size=EMBEDDING_BATCH_SIZE,
+                            max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                        )
+                        texts = [chunk.page_content for chunk in plan["chunks"]]
+                        with span("index.embed", chunks=len(texts)) as embed_span:
+                            vectors = await pipeline.embed(texts, progress_callback)
+                            embed_span.set(**tracer.embedding_usage(EMBEDDING_MODEL, texts, indexing_model.misses))
+                        with span("index.store"):
+                            await asyncio.to_thread(self._store_index, plan, vectors)
+                    finally:
+                        await asyncio.to_thread(self._release_base, plan)
+            finally:
+                lock.release()
+
+            self._record_embedding_stats(indexing_model)
+            self._set_retriever(embedding_model)
+        except BaseException:
+            # Give the collection back on failure, so it can still expire
+            self.release()
+            raise
+
+    def _get_embedding_model(self, max_retries=2):
+        # Only chunks that were never embedded before are sent to OpenAI
+        return CachedEmbeddings(
+            get_embedding_model(EMBEDDING_MODEL, base_url=EMBEDDING_API_BASE, max_retries=max_retries),
+            embedding_cache,
+            EMBEDDING_MODEL,
+        )
+
+    def _acquire(self):
+        # Hold a reference before building so the collection cannot expire underneath us
+        if not self._acquired:
+            collection_registry.acquire(self.collection_name)
+            self._acquired = True
+
+    def _plan_index(self):
+        """
+        Selects the chunks that need to be embedded, diffing against a previously indexed version of the notebook.
+
+        Returns:
+            dict: The base collection, the notebook chunk hashes, the reused chunk hashes and the chunks to embed.
         """
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=50, length_function=tiktoken_len)
+        # Chunks are identified by the hash of their text (the `cell_hash` metadata)
+        cell_hashes = [doc.metadata["cell_hash"] for doc in self.docs]
+
+        # Look for a previously indexed version of this notebook to diff against
+        base_name = collection_registry.find_base(cell_hashes, INDEX_VERSION, min_overlap=INCREMENTAL_MIN_OVERLAP)
+        if base_name:
+            # Keep the previous version alive while its vectors are copied
+            collection_registry.acquire(base_name)
+
+        reused_hashes = set(collection_registry.cell_hashes(base_name)) & set(cell_hashes) if base_name else set()
+
+        return {
+            "base_name": base_name,
+            "cell_hashes": cell_hashes,
+            "reused_hashes": reused_hashes,
+            "chunks": [doc for doc in self.docs if doc.metadata["cell_hash"] not in reused_hashes],
+        }
+
+    def _store_index(self, plan, vectors):
+        base_name, split_chunks = plan["base_name"], plan["chunks"]
+
+        if vectors:
+            vector_size = len(vectors[0])
+        elif base_name:
+            vector_size = collection_registry.vector_size(base_name)
+        else:
+            raise ValueError(f"No content to index in notebook {self.notebook_path}")
 
-        split_chunks = text_splitter.split_documents(self.docs)
+        collection_registry.create_collection(self.collection_name, vector_size)
 
-        embedding_model = OpenAIEmbeddings(model="text-embedding-3-small")
+        copied = 0
+        if base_name:
+            # Unchanged chunks keep their vectors; only the position of their cells in the notebook may have moved
+            positions = {}
+            for doc in self.docs:
+                positions.setdefault(doc.metadata["cell_hash"], {
+                    "cell_index": doc.metadata["cell_index"],
+                    "cell_indexes": doc.metadata["cell_indexes"],
+                })
+            copied = collection_registry.copy_points(base_name, self.collection_name, plan["reused_hashes"], positions)
 
-        qdrant_vectorstore = Qdrant.from_documents(split_chunks, embedding_model, location=":memory:", collection_name="Notebook")
+        collection_registry.upsert(self.collection_name, split_chunks, vectors)
+        collection_registry.mark_ready(
+            self.collection_name,
+            notebook_hash=self.notebook_hash,
+            index_version=INDEX_VERSION,
+            cell_hashes=plan["cell_hashes"],
+            points=copied + len(split_chunks),
+        )
+
+        if base_name:
+            logger.info(
+                "Indexed collection %s incrementally from %s: %d chunks reused, %d chunks re-embedded",
+                self.collection_name, base_name, copied, len(split_chunks),
+            )
+        else:
+            logger.info("Indexed %d chunks into collection %s", len(split_chunks), self.collection_name)
+
+    def _build_compact_index(self, vectors):
+        if not vectors:
+            raise ValueError(f"No content to index in notebook {self.notebook_path}")
+        with span("index.store"):
+            index = CompactVectorIndex(vectors, quantization=VECTOR_QUANTIZATION)
+            compact_indexes.put(self.collection_name, index, self.docs)
+        logger.info(
+            "Indexed %d chunks into a %s compact index of %.0f KB",
+            index.size, index.quantization, index.nbytes() / 1024,
+        )
+        return index, self.docs
+
+    def _release_base(self, plan):
+        if plan["base_name"]:
+            collection_registry.release(plan["base_name"])
+
+    def _record_embedding_stats(self, embedding_model):
+        self.embedding_stats = embedding_model.stats()
+        logger.info(
+            "Embedding cache: %d hits, %d misses (hit rate %.0f%%)",
+            self.embedding_stats["hits"], self.embedding_stats["misses"], 100 * self.embedding_stats["hit_rate"],
+        )
+
+    def _set_retriever(self, embedding_model):
+        self.embedding_model = embedding_model
+        self.retriever = self._dense_retriever(embedding_model)
+
+        # Fuse the vector results with a local keyword search, which resolves exact identifiers
+        if KEYWORD_SEARCH and self.keyword_index is not None:
+            self.retriever = FusionRetriever(
+                dense_retriever=self.retriever,
+                keyword_retriever=KeywordRetriever(index=self.keyword_index, k=RETRIEVAL_TOP_K),
+                k=RETRIEVAL_TOP_K,
+                rrf_k=RRF_K,
+            )
 
-        qdrant_retriever = qdrant_vectorstore.as_retriever()
+    def _vectorstore(self, embedding_model):
+        if self.vector_index == "compact":
+            index, docs = self.compact_index
+            return CompactVectorStore(index, docs, embedding_model)
+        return Qdrant(collection_registry.client, self.collection_name, embedding_model)
 
-        multiquery_retriever = MultiQueryRetriever.from_llm(retriever=qdrant_retriever, llm=openai_chat_model, include_original=True) # Create a multi-query retriever on top of the Qdrant retriever
+    def _dense_retriever(self, embedding_model):
+        qdrant_vectorstore = self._vectorstore(embedding_model)
 
-        self.retriever = multiquery_retriever
+        qdrant_retriever = qdrant_vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_TOP_K})
+
+        if self.retrieval_mode == VECTOR_MODE:
+            return qdrant_retriever
+
+        # Create a multi-query retriever on top of the Qdrant retriever, reusing the rewrites of previous questions
+        multiquery_retriever = CachedMultiQueryRetriever.from_llm(
+            retriever=qdrant_retriever, llm=openai_chat_model, variant_cache=query_variant_cache, include_original=True
+        )
+
+        if self.retrieval_mode == MULTI_QUERY_MODE:
+            return multiquery_retriever
+        return HybridRetriever(
+            vectorstore=qdrant_vectorstore,
+            multi_query_retriever=multiquery_retriever,
+            keyword_index=self.keyword_index if KEYWORD_SEARCH else None,
+            score_threshold=HYBRID_SCORE_THRESHOLD,
+            k=RETRIEVAL_TOP_K,
+        )
+
+    def release(self):
+        """
+        Releases the shared collection used by this manager, so it can expire once no session uses it.
+        """
+        if self._acquired:
+            collection_registry.release(self.collection_name)
+            self._acquired = False
 
     def get_retriever(self):
         return self.retriever
 
+    def get_embedding_model(self):
+        return self.embedding_model
+
     def get_documents(self):
         return self.docs
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    EmbeddingCache class.
+
+    This class represents a persistent, content-addressed store of embedding vectors kept in a local SQLite file.
+    Each entry is keyed on a hash of (model name, text) and the cache is bounded in size: when it grows over
+    `max_entries`, the least recently used entries are evicted.
+
+    Attributes:
+        path (str): The path to the SQLite file backing the cache.
+        max_entries (int): The maximum number of vectors kept on disk.
+        hits (int): The number of lookups served from the cache since the process started.
+        misses (int): The number of lookups that were not found in the cache since the process started.
+
+    Methods:
+        get_many(model, texts): Returns the cached vectors for the texts (None where missing).
+        put_many(model, texts, vectors): Stores the vectors for the texts and evicts old entries if needed.
+        stats(): Returns the cache size and the hit/miss counters.
+    """
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Returns the cached vectors for the given texts.
+
+        Parameters:
+            model (str): The name of the embedding model.
+            texts (List[str]): The texts to look up.
+
+        Returns:
+            List[Optional[List[float]]]: One entry per text, None when the text is not cached.
+        """
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Query in slices to stay under SQLite's host parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return [array("f", found[key]).tolist() if key in found else None for key in keys]
+
+    def put_many(self, model, texts: List[str], vectors: List[List[float]]):
+        """
+        Stores the vectors for the given texts and evicts the least recently used entries if the cache is full.
+
+        Parameters:
+            model (str): The name of the embedding model.
+            texts (List[str]): The embedded texts.
+            vectors (List[List[float]]): The vectors, in the same order as the texts.
+        """
+        now = time.time()
+        rows = [
+            (self.make_key(model, text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            return {"entries": size, "hits": self.hits, "misses": self.misses}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    CachedEmbeddings class.
+
+    This class wraps an embedding model so that only texts missing from the `EmbeddingCache` are sent to it.
+    It keeps its own hit/miss counters, so a wrapper created for one indexing run reports the savings of that run.
+    Queries are embedded by the underlying model directly: user questions are never written to the persistent cache.
+
+    Attributes:
+        underlying (Embeddings): The embedding model used for cache misses.
+        cache (EmbeddingCache): The cache storing previously computed vectors.
+        model_name (str): The model name used in the cache key.
+        hits (int): The number of texts served from the cache by this wrapper.
+        misses (int): The number of texts embedded by the underlying model through this wrapper.
+    """
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.underlying = underlying
+        self.cache = cache
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+    def _split_cached(self, texts):
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        return vectors, missing
+
+    def _count(self, texts, missing):
+        # Counted once the texts are embedded, so retried batches are not counted twice
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._split_cached(texts)
+        if missing:
+            new_vectors = self.underlying.embed_documents([texts[i] for i in missing])
+            self.cache.put_many(self.model_name, [texts[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        self._count(texts, missing)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = await asyncio.to_thread(self._split_cached, texts)
+        if missing:
+            new_vectors = await self.underlying.aembed_documents([texts[i] for i in missing])
+            await asyncio.to_thread(self.cache.put_many, self.model_name, [texts[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        self._count(texts, missing)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.underlying.aembed_query(text)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
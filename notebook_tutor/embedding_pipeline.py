@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, List, Optional
+import openai
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class AsyncEmbeddingPipeline:
+    """
+    AsyncEmbeddingPipeline class.
+
+    This class embeds large lists of texts without blocking the event loop: texts are sent in batches of `batch_size`,
+    at most `max_concurrency` batches are in flight at once, and rate-limit (429) responses pause every worker for the
+    delay suggested by the server (or an exponential backoff with jitter) before the batch is retried.
+
+    Attributes:
+        embeddings (Embeddings): The embedding model, called through `aembed_documents`.
+        batch_size (int): The number of texts sent per request.
+        max_concurrency (int): The maximum number of requests in flight.
+        max_retries (int): The maximum number of retries of a rate-limited batch.
+        initial_backoff (float): The first backoff delay, in seconds.
+        max_backoff (float): The maximum backoff delay, in seconds.
+
+    Methods:
+        embed(texts, progress_callback=None): Embeds the texts and returns their vectors in order.
+    """
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = 64,
+        max_concurrency: int = 4,
+        max_retries: int = 6,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._paused_until = 0.0
+
+    async def embed(self, texts: List[str], progress_callback: Optional[ProgressCallback] = None) -> List[List[float]]:
+        """
+        Embeds the texts and returns their vectors in order.
+
+        Parameters:
+            texts (List[str]): The texts to embed.
+            progress_callback (Optional[ProgressCallback]): Awaited with (embedded texts, total texts) after each batch.
+
+        Returns:
+            List[List[float]]: The vector of each text.
+        """
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        done = 0
+
+        async def embed_batch(start):
+            nonlocal done
+            batch = texts[start:start + self.batch_size]
+            async with semaphore:
+                batch_vectors = await self._embed_with_backoff(batch)
+            vectors[start:start + len(batch)] = batch_vectors
+            done += len(batch)
+            if progress_callback:
+                await progress_callback(done, len(texts))
+
+        await asyncio.gather(*(embed_batch(start) for start in range(0, len(texts), self.batch_size)))
+        return vectors
+
+    async def _embed_with_backoff(self, batch):
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            # A rate limit hit by any batch holds back all of them
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                return await self.embeddings.aembed_documents(batch)
+            except openai.RateLimitError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_after(e) or backoff * (1 + random.random())
+                backoff = min(backoff * 2, self.max_backoff)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning("Embedding batch rate limited, retrying in %.1fs (attempt %d)", delay, attempt + 1)
+
+    @staticmethod
+    def _retry_after(error):
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,187 @@
+import os
+import csv
+import json
+import time
+import html
+import base64
+import hashlib
+import secrets
+import sqlite3
+import zipfile
+from itertools import islice
+
+# Number of cards written per database transaction, so decks of any size are written in bounded memory
+EXPORT_BATCH_SIZE = 500
+
+# Spread of the random offset added to the millisecond clock for the first note id of an export
+NOTE_ID_SPREAD = 1 << 24
+
+# Anki collection schema (version 11), the format read by the .apkg importer of every Anki version
+ANKI_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null, ver integer not null,
+    dty integer not null, usn integer not null, ls integer not null, conf text not null, models text not null,
+    decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null, usn integer not null,
+    tags text not null, flds text not null, sfld integer not null, csum integer not null, flags integer not null,
+    data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null, mod integer not null,
+    usn integer not null, type integer not null, queue integer not null, due integer not null, ivl integer not null,
+    factor integer not null, reps integer not null, lapses integer not null, left integer not null,
+    odue integer not null, odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null, ivl integer not null,
+    lastIvl integer not null, factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+DEFAULT_DECK_CONFIG = {
+    "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "autoplay": True, "timer": 0, "replayq": True,
+    "dyn": False,
+    "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500, "separate": True, "order": 1, "perDay": 20,
+            "bury": True},
+    "rev": {"perDay": 100, "ease4": 1.3, "fuzz": 0.05, "minSpace": 1, "ivlFct": 1, "maxIvl": 36500, "bury": True},
+    "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8, "leechAction": 0},
+}
+
+
+def write_csv(cards, path):
+    """
+    Writes flashcards to a .csv file with a Front and a Back column, one row at a time.
+
+    Parameters:
+        cards (iterable): The flashcards, as dictionaries with 'question' and 'answer' keys.
+        path (str): The path of the file.
+
+    Returns:
+        int: The number of cards written.
+    """
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=["Front", "Back"])
+        writer.writeheader()
+        for card in cards:
+            writer.writerow({"Front": card["question"], "Back": card["answer"]})
+            count += 1
+    return count
+
+
+def _stable_id(*parts):
+    # Ids derived from names, so decks exported twice are merged by Anki instead of duplicated
+    digest = hashlib.sha1(":".join(parts).encode("utf-8")).hexdigest()
+    return (1 << 30) + int(digest[:12], 16) % (1 << 30)
+
+
+def _field(text):
+    return html.escape(str(text)).replace("\n", "<br>")
+
+
+def _collection(deck_id, deck_name, model_id, now):
+    deck = {
+        "id": deck_id, "name": deck_name, "mod": now, "usn": -1, "desc": "", "dyn": 0, "conf": 1, "collapsed": False,
+        "extendNew": 10, "extendRev": 50, "lrnToday": [0, 0], "revToday": [0, 0], "newToday": [0, 0],
+        "timeToday": [0, 0],
+    }
+    default_deck = {**deck, "id": 1, "name": "Default"}
+    model = {
+        "id": model_id, "name": "Basic (Notebook Tutor)", "type": 0, "mod": now, "usn": -1, "sortf": 0, "did": deck_id,
+        "flds": [
+            {"name": name, "ord": ord, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+            for ord, name in enumerate(("Front", "Back"))
+        ],
+        "tmpls": [{
+            "name": "Card 1", "ord": 0, "qfmt": "{{Front}}", "afmt": "{{FrontSide}}<hr id=answer>{{Back}}",
+            "did": None, "bqfmt": "", "bafmt": "",
+        }],
+        "css": ".card { font-family: arial; font-size: 20px; text-align: center; color: black; background-color: white; }",
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage[utf8]{inputenc}\n"
+                    "\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "tags": [], "vers": [], "req": [[0, "all", [0]]],
+    }
+    conf = {
+        "activeDecks": [1], "curDeck": 1, "newSpread": 0, "collapseTime": 1200, "timeLim": 0, "estTimes": True,
+        "dueCounts": True, "curModel": None, "nextPos": 1, "sortType": "noteFld", "sortBackwards": False,
+        "addToCur": True,
+    }
+    return (
+        1, now - now % 86400, now * 1000, now * 1000, 11, 0, 0, 0, json.dumps(conf),
+        json.dumps({str(model_id): model}), json.dumps({"1": default_deck, str(deck_id): deck}),
+        json.dumps({"1": DEFAULT_DECK_CONFIG}), "{}",
+    )
+
+
+def write_apkg(cards, path, deck_name="Notebook Tutor"):
+    """
+    Writes flashcards to an Anki package (.apkg): a zip holding an Anki collection (SQLite) with one deck of Basic
+    notes. Cards are inserted in batches of `EXPORT_BATCH_SIZE`, and the collection is written to disk before being
+    compressed, so memory does not grow with the size of the deck.
+
+    Parameters:
+        cards (iterable): The flashcards, as dictionaries with 'question' and 'answer' keys.
+        path (str): The path of the file.
+        deck_name (str): The name of the deck created by the import.
+
+    Returns:
+        int: The number of cards written.
+    """
+    now = int(time.time())
+    # Anki ids are millisecond timestamps: a random offset keeps the ids of exports made in the same millisecond, or
+    # by different sessions imported into the same profile, from colliding and overwriting each other's notes
+    base_id = int(time.time() * 1000) + secrets.randbelow(NOTE_ID_SPREAD)
+    deck_id = _stable_id("deck", deck_name)
+    model_id = _stable_id("model", "Basic (Notebook Tutor)")
+    database_path = f"{path}.anki2"
+    count = 0
+    connection = sqlite3.connect(database_path)
+    try:
+        connection.executescript(ANKI_SCHEMA)
+        connection.execute("INSERT INTO col VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", _collection(deck_id, deck_name, model_id, now))
+        cards = iter(cards)
+        while True:
+            batch = list(islice(cards, EXPORT_BATCH_SIZE))
+            if not batch:
+                break
+            notes, anki_cards = [], []
+            for card in batch:
+                front, back = str(card["question"]), str(card["answer"])
+                checksum = hashlib.sha1(front.encode("utf-8")).hexdigest()
+                # Notes are matched by guid on import: the same card in the same deck updates the note, nothing else does
+                guid = hashlib.sha1(f"{deck_name}\x1f{front}\x1f{back}".encode("utf-8")).digest()[:8]
+                note_id = base_id + count
+                notes.append((
+                    note_id, base64.b64encode(guid).decode("ascii"), model_id, now, -1, "",
+                    _field(front) + "\x1f" + _field(back), front, int(checksum[:8], 16), 0, "",
+                ))
+                anki_cards.append((note_id, note_id, deck_id, 0, now, -1, 0, 0, count + 1, 0, 0, 0, 0, 0, 0, 0, 0, ""))
+                count += 1
+            connection.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", notes)
+            connection.executemany("INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", anki_cards)
+        connection.commit()
+    finally:
+        connection.close()
+
+    try:
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as package:
+            package.write(database_path, "collection.anki2")
+            package.writestr("media", "{}")
+    finally:
+        os.remove(database_path)
+    return count
+
+
+# Writer of each export format
+EXPORTERS = {"csv": write_csv, "apkg": write_apkg}
@@ -1,27 +1,38 @@
+import os
 from dotenv import load_dotenv
 from langgraph.graph import END, StateGraph
 from states import TutorState
-from agents import create_agent, agent_node, create_team_supervisor, get_retrieve_information_tool, llm, flashcard_tool
+from agents import create_agent, create_agent_node, create_direct_qa_node, create_team_supervisor, get_retrieve_information_tool, llm, supervisor_llm, flashcard_tool
 from prompt_templates import PromptTemplates
+from router import SupervisorRouter, EmbeddingRouter, ROUTER_MODE, ROUTER_EMBEDDING_MODEL, ROUTER_SIMILARITY_THRESHOLD, ROUTER_SIMILARITY_MARGIN
+from clients import get_embedding_model
 import functools
 
 # Load environment variables
 load_dotenv()
 
+# Configuration for the QA node: "direct" answers from the retrieved context in one call, "agent" runs the QA agent
+QA_MODE = os.environ.get("QA_MODE", "direct")
+
+QA_MODES = ("direct", "agent")
+if QA_MODE not in QA_MODES:
+    raise ValueError(f"Unknown QA mode {QA_MODE!r}, expected one of {QA_MODES}")
+
 # Create the LangGraph chain
-def create_tutor_chain(retrieval_chain):
+def create_tutor_chain():
     """
     Create a tutor chain for the notebook tutor system.
 
     This function creates a tutor chain for the notebook tutor system. The tutor chain consists of multiple agents, including a QA Agent, Quiz Agent, Flashcards Agent, and Supervisor Agent. Each agent is created with specific tools and prompts.
-
-    Parameters:
-        retrieval_chain (object): The retrieval chain used for information retrieval.
+    The supervisor node is a `SupervisorRouter`: the turn finishes without an LLM call once an agent has answered, and unambiguous messages are routed by local rules (and, in the `embeddings` router mode, by similarity to labelled examples) before falling back to the LLM supervisor.
+    In the `direct` QA mode (`QA_MODE`), questions are answered by the session's direct QA chain with a single streamed LLM call citing the notebook cells, and the QA agent only runs when the retrieved context does not cover the question.
+    In the `parallel` quiz mode (`QUIZ_MODE`), quizzes are written by the `QuizEngine` with parallel calls over the sections of the notebook chunks, and the quiz agent only runs when no section matches the request.
+    The graph does not depend on any session: the session's retrieval chains and notebook chunks are passed with each request through the graph config, as `{"configurable": {"retrieval_chain": retrieval_chain, "qa_chain": qa_chain, "documents": documents}}`.
 
     Returns:
         StateGraph: The compiled tutor graph representing the tutor chain.
     """
-    retrieve_information_tool = get_retrieve_information_tool(retrieval_chain)
+    retrieve_information_tool = get_retrieve_information_tool()
 
     # Create QA Agent
     qa_agent = create_agent(
@@ -29,7 +40,7 @@ def create_tutor_chain(retrieval_chain):
         [retrieve_information_tool],
         PromptTemplates().get_qa_agent_prompt(),
     )
-    qa_node = functools.partial(agent_node, agent=qa_agent, name="QAAgent")
+    qa_node = create_direct_qa_node(qa_agent) if QA_MODE == "direct" else create_agent_node(qa_agent, "QAAgent")
 
     # Create Quiz Agent
     quiz_agent = create_agent(
@@ -37,7 +48,7 @@ def create_tutor_chain(retrieval_chain):
         [retrieve_information_tool],
         PromptTemplates().get_quiz_agent_prompt(),
     )
-    quiz_node = functools.partial(agent_node, agent=quiz_agent, name="QuizAgent")
+    quiz_node = create_agent_node(quiz_agent, "QuizAgent")
 
     # Create Flashcards Agent
     flashcards_agent = create_agent(
@@ -45,21 +56,29 @@ def create_tutor_chain(retrieval_chain):
         [retrieve_information_tool, flashcard_tool],
         PromptTemplates().get_flashcards_agent_prompt(),
     )
-    flashcards_node = functools.partial(agent_node, agent=flashcards_agent, name="FlashcardsAgent")
+    flashcards_node = create_agent_node(flashcards_agent, "FlashcardsAgent")
 
     # Create Supervisor Agent
     supervisor_agent = create_team_supervisor(
-        llm,
+        supervisor_llm,
         PromptTemplates().get_supervisor_agent_prompt(),
         ["QAAgent", "QuizAgent", "FlashcardsAgent"],
     )
+    embedding_router = None
+    if ROUTER_MODE == "embeddings":
+        embedding_router = EmbeddingRouter(
+            get_embedding_model(ROUTER_EMBEDDING_MODEL),
+            threshold=ROUTER_SIMILARITY_THRESHOLD,
+            margin=ROUTER_SIMILARITY_MARGIN,
+        )
+    supervisor_node = SupervisorRouter(supervisor_agent, embedding_router=embedding_router).as_runnable()
 
     # Build the LangGraph
     tutor_graph = StateGraph(TutorState)
     tutor_graph.add_node("QAAgent", qa_node)
     tutor_graph.add_node("QuizAgent", quiz_node)
     tutor_graph.add_node("FlashcardsAgent", flashcards_node)
-    tutor_graph.add_node("supervisor", supervisor_agent)
+    tutor_graph.add_node("supervisor", supervisor_node)
 
     tutor_graph.add_edge("QAAgent", "supervisor")
     tutor_graph.add_edge("QuizAgent", "supervisor")
@@ -75,3 +94,9 @@ def create_tutor_chain(retrieval_chain):
 
     tutor_graph.set_entry_point("supervisor")
     return tutor_graph.compile()
+
+
+# Return the tutor chain shared by all sessions, building it on first use
+@functools.lru_cache(maxsize=None)
+def get_tutor_chain():
+    return create_tutor_chain()
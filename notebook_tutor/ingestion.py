@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from chunking import NotebookChunker
+from keyword_index import BM25Index
+from metrics import percentile
+from notebook_loader import iter_notebook_cells
+from tracing import tracer
+
+# Configuration for the ingestion workers; 0 runs the jobs in a thread of the web process
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_notebook(notebook_path):
+    """
+    Reads and chunks a notebook and builds its keyword index. Runs in an ingestion worker process.
+
+    Parameters:
+        notebook_path (str): The path to the .ipynb file.
+
+    Returns:
+        tuple: The chunks, their `BM25Index`, and the wall-clock times the job started and finished.
+    """
+    started = time.time()
+    docs = NotebookChunker().chunk(iter_notebook_cells(notebook_path), notebook_path)
+    keyword_index = BM25Index(docs)
+    return docs, keyword_index, started, time.time()
+
+
+def _warm_up():
+    # Imports the chunking modules in a worker process
+    return os.getpid()
+
+
+class IngestionStats:
+    """
+    IngestionStats class.
+
+    This class collects the time ingestion jobs wait for a worker and the time they run, and counts the jobs shared
+    by concurrent uploads of the same notebook.
+
+    Methods:
+        record(wait, run): Records the latencies of one job, in seconds.
+        record_shared(): Counts an upload served by a job already in progress.
+        summary(): Returns the job count, the shared uploads and the p50/p95 latencies.
+    """
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._samples = {"wait": [], "run": [], "total": []}
+        self._shared = 0
+        self._lock = threading.Lock()
+
+    def record(self, wait, run):
+        with self._lock:
+            for name, value in (("wait", wait), ("run", run), ("total", wait + run)):
+                self._samples[name] = (self._samples[name] + [value])[-self.max_samples:]
+
+    def record_shared(self):
+        with self._lock:
+            self._shared += 1
+
+    def summary(self):
+        with self._lock:
+            summary = {"jobs": len(self._samples["total"]), "shared": self._shared}
+            for name, values in self._samples.items():
+                summary[f"{name}_p50"] = percentile(values, 50)
+                summary[f"{name}_p95"] = percentile(values, 95)
+            return summary
+
+
+class IngestionService:
+    """
+    IngestionService class.
+
+    This class runs the CPU-bound part of notebook uploads (parsing, chunking, token counting and keyword indexing) in
+    a pool of `max_workers` processes, so a burst of uploads is processed in parallel and never blocks the event loop
+    of the web process. Jobs are queued in the pool; uploads of a notebook whose content is already being processed
+    wait for that job instead of starting another one.
+
+    Attributes:
+        max_workers (int): The number of worker processes, or 0 to run the jobs in a thread.
+        stats (IngestionStats): The latencies of the jobs.
+
+    Methods:
+        start(): Starts the worker processes in the background, so the first uploads do not wait for them.
+        submit(notebook_path, notebook_hash): Processes a notebook and returns its chunks and keyword index.
+        queue_depth(): Returns the number of jobs waiting for a worker.
+        in_flight(): Returns the number of jobs queued or running.
+        shutdown(): Stops the worker processes.
+    """
+    def __init__(self, max_workers=INGESTION_WORKERS):
+        self.max_workers = max_workers
+        self.stats = IngestionStats()
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Workers are spawned rather than forked, so they do not inherit the threads and sockets of the web process
+        with self._lock:
+            if self._executor is None and self.max_workers > 0:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def start(self):
+        executor = self._get_executor()
+        if executor is not None:
+            for _ in range(self.max_workers):
+                executor.submit(_warm_up)
+
+    async def submit(self, notebook_path, notebook_hash):
+        """
+        Processes a notebook in a worker, sharing the job of any upload of the same content already in progress.
+
+        Parameters:
+            notebook_path (str): The path to the .ipynb file.
+            notebook_hash (str): The content hash of the notebook.
+
+        Returns:
+            tuple: The chunks of the notebook and their `BM25Index`.
+        """
+        job = self._jobs.get(notebook_hash)
+        if job is not None:
+            self.stats.record_shared()
+            logger.info("Notebook %s is already being processed, waiting for its job", notebook_hash[:12])
+        else:
+            job = asyncio.ensure_future(self._run(notebook_path))
+            self._jobs[notebook_hash] = job
+            job.add_done_callback(lambda _: self._jobs.pop(notebook_hash, None))
+        return await asyncio.shield(job)
+
+    async def _run(self, notebook_path):
+        submitted = time.time()
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        if executor is None:
+            docs, keyword_index, started, finished = await asyncio.to_thread(chunk_notebook, notebook_path)
+        else:
+            docs, keyword_index, started, finished = await loop.run_in_executor(executor, chunk_notebook, notebook_path)
+        wait, run = max(0.0, started - submitted), finished - started
+        self.stats.record(wait, run)
+        tracer.record("ingestion.wait", wait, started=submitted)
+        tracer.record("ingestion.run", run, started=started, chunks=len(docs))
+        logger.info(
+            "Processed %s into %d chunks in %.2fs (%.2fs in queue, %d jobs waiting)",
+            notebook_path, len(docs), run, wait, self.queue_depth(),
+        )
+        return docs, keyword_index
+
+    def in_flight(self):
+        return len(self._jobs)
+
+    def queue_depth(self):
+        return max(0, self.in_flight() - max(1, self.max_workers))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# Instantiate the ingestion service shared by all sessions; worker processes are started by `start` or on the first upload
+ingestion_service = IngestionService()
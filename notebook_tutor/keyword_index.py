@@ -0,0 +1,111 @@
+import re
+import math
+from collections import Counter, defaultdict
+from typing import List
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Identifiers, dotted names (np.linalg.norm) and numbers
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*|\d+")
+# Parts of snake_case and camelCase identifiers
+_SUBWORD = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+# Words of a question that look like code: dotted, snake_case, camelCase or followed by a call
+_CODE_LIKE = re.compile(
+    r"[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)+|\w*_\w*|[a-z]+[A-Z]\w*|[A-Za-z_]\w*(?=\()"
+)
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or the this that to what when where "
+    "which who why with you your".split()
+)
+
+
+def code_tokens(text):
+    """
+    Splits a text into lowercase search terms, keeping code identifiers whole and adding their parts: `np.linalg.norm`
+    gives `np.linalg.norm`, `np`, `linalg` and `norm`; `load_dataset` gives `load_dataset`, `load` and `dataset`.
+    """
+    tokens = []
+    for match in _IDENTIFIER.finditer(text):
+        word = match.group()
+        parts = word.split(".")
+        tokens.append(word.lower())
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+        for part in parts:
+            subwords = _SUBWORD.findall(part)
+            if len(subwords) > 1:
+                tokens.extend(subword.lower() for subword in subwords)
+    return [token for token in tokens if len(token) > 1 and token not in STOPWORDS]
+
+
+def code_identifiers(text):
+    """
+    Returns the words of a text that look like code identifiers, lowercased.
+    """
+    return {match.group().lower() for match in _CODE_LIKE.finditer(text) if match.group().strip("_")}
+
+
+class BM25Index:
+    """
+    BM25Index class.
+
+    This class represents an in-memory inverted index of documents, scored with Okapi BM25 over `code_tokens`, so
+    questions about exact function, variable or library names find the chunks that contain them.
+
+    Attributes:
+        documents (list): The indexed documents.
+        k1 (float): The term frequency saturation of BM25.
+        b (float): The length normalization of BM25.
+
+    Methods:
+        search(query, k): Returns the k best (document, score) pairs for a query.
+        has_identifier_match(query): Returns whether a code identifier of the query appears in the documents.
+    """
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(list)  # term -> [(document position, term frequency)]
+        self._lengths = []
+        for position, document in enumerate(self.documents):
+            tokens = code_tokens(document.page_content)
+            self._lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self._postings[term].append((position, frequency))
+        self._average_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+    def _idf(self, term):
+        frequency = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self.documents) - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, query, k=4):
+        scores = defaultdict(float)
+        for term in set(code_tokens(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for position, frequency in postings:
+                length_norm = 1 - self.b + self.b * self._lengths[position] / (self._average_length or 1)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[position], score) for position, score in best]
+
+    def has_identifier_match(self, query):
+        return any(identifier in self._postings for identifier in code_identifiers(query))
+
+
+class KeywordRetriever(BaseRetriever):
+    """
+    A retriever returning the k best documents of a `BM25Index`. The search is local and synchronous.
+    """
+    index: BM25Index
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [document for document, _ in self.index.search(query, k=self.k)]
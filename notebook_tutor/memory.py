@@ -0,0 +1,135 @@
+import os
+import logging
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from prompt_templates import PromptTemplates
+from clients import get_chat_model
+from utils import tiktoken_len
+
+# Configuration for the conversation memory
+MEMORY_MAX_TOKENS = int(os.environ.get("MEMORY_MAX_TOKENS", "3000"))
+MEMORY_RECENT_TOKENS = int(os.environ.get("MEMORY_RECENT_TOKENS", "1500"))
+MEMORY_SUMMARY_MODEL = os.environ.get("MEMORY_SUMMARY_MODEL", "gpt-3.5-turbo")
+
+# Approximate number of tokens added by the chat format around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+logger = logging.getLogger(__name__)
+
+
+def create_summarizer(model=MEMORY_SUMMARY_MODEL):
+    """
+    Creates the chain summarizing the earlier turns of a conversation.
+
+    Parameters:
+        model (str): The OpenAI chat model writing the summaries.
+
+    Returns:
+        Runnable: A chain taking `{"summary", "turns"}` and returning the updated summary.
+    """
+    return PromptTemplates().get_memory_summary_prompt() | get_chat_model(model, temperature=0) | StrOutputParser()
+
+
+def message_tokens(message):
+    return tiktoken_len(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ConversationMemory:
+    """
+    ConversationMemory class.
+
+    This class holds the history of a tutoring session within a token budget. The recent messages are kept verbatim;
+    when the history grows beyond `max_tokens`, the oldest messages are folded into a rolling summary until the
+    verbatim messages fit in `recent_tokens`. The prompt built from the memory therefore stays bounded however long the
+    session is.
+
+    Attributes:
+        summarizer (Runnable): The chain updating the summary with the turns it replaces, see `create_summarizer`.
+        max_tokens (int): The token budget of the history, summary included.
+        recent_tokens (int): The token budget of the verbatim messages after a summarization.
+        summary (str): The summary of the turns no longer kept verbatim.
+
+    Methods:
+        add_messages(messages): Appends the messages of a turn to the history.
+        get_messages(): Returns the history to prepend to the next turn, summary first.
+        tokens(): Returns the number of tokens of the history, summary included.
+        summarize(): Folds the oldest messages into the summary when the history exceeds its budget.
+        asummarize(): Asynchronous version of summarize.
+    """
+    def __init__(self, summarizer=None, max_tokens=MEMORY_MAX_TOKENS, recent_tokens=MEMORY_RECENT_TOKENS):
+        self.summarizer = summarizer
+        self.max_tokens = max_tokens
+        self.recent_tokens = min(recent_tokens, max_tokens)
+        self.summary = ""
+        self._summary_tokens = 0
+        self._messages = []  # (message, tokens) pairs, oldest first
+
+    def add_messages(self, messages):
+        self._messages.extend((message, message_tokens(message)) for message in messages)
+
+    def get_messages(self):
+        messages = [message for message, _ in self._messages]
+        if self.summary:
+            messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        return messages
+
+    def tokens(self):
+        return self._summary_tokens + sum(tokens for _, tokens in self._messages)
+
+    def summarize(self):
+        old_messages = self._take_old_messages()
+        if not old_messages:
+            return
+        try:
+            summary = self.summarizer.invoke(self._summary_inputs(old_messages)) if self.summarizer else None
+        except Exception:
+            logger.exception("Conversation summarization failed, dropping %d messages", len(old_messages))
+            summary = None
+        self._set_summary(summary, old_messages)
+
+    async def asummarize(self):
+        old_messages = self._take_old_messages()
+        if not old_messages:
+            return
+        try:
+            summary = await self.summarizer.ainvoke(self._summary_inputs(old_messages)) if self.summarizer else None
+        except Exception:
+            logger.exception("Conversation summarization failed, dropping %d messages", len(old_messages))
+            summary = None
+        self._set_summary(summary, old_messages)
+
+    def _take_old_messages(self):
+        # Remove the oldest messages until the remaining ones fit in the recent budget and start with a user message,
+        # keeping the last turn whole so its function calls and results are never separated from their question
+        if self.tokens() <= self.max_tokens:
+            return []
+        last_turn = max(
+            (i for i, (message, _) in enumerate(self._messages) if isinstance(message, HumanMessage)),
+            default=len(self._messages) - 1,
+        )
+        folded = 0
+        recent = sum(tokens for _, tokens in self._messages)
+        while folded < last_turn and (
+            recent > self.recent_tokens or not isinstance(self._messages[folded][0], HumanMessage)
+        ):
+            recent -= self._messages[folded][1]
+            folded += 1
+        old_messages = [message for message, _ in self._messages[:folded]]
+        del self._messages[:folded]
+        return old_messages
+
+    def _summary_inputs(self, old_messages):
+        turns = "\n".join(
+            f"{'User' if isinstance(message, HumanMessage) else message.name or 'Tutor'}: {message.content}"
+            for message in old_messages
+        )
+        return {"summary": self.summary or "(none)", "turns": turns}
+
+    def _set_summary(self, summary, old_messages):
+        # Without a summary (no summarizer, or a failed call) the old messages are simply dropped
+        if summary:
+            self.summary = summary.strip()
+            self._summary_tokens = tiktoken_len(self.summary) + MESSAGE_OVERHEAD_TOKENS
+        logger.info(
+            "Folded %d messages into the conversation summary, history now %d tokens", len(old_messages), self.tokens()
+        )
@@ -0,0 +1,15 @@
+def percentile(values, rank):
+    """
+    Returns the nearest-rank percentile of a list of values, or None when it is empty.
+
+    Parameters:
+        values (list): The measured values.
+        rank (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile of the values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(rank / 100 * (len(values) - 1))))]
@@ -0,0 +1,281 @@
+import os
+import re
+import json
+
+# Configuration for the notebook loader
+NOTEBOOK_READ_BLOCK_SIZE = 64 * 1024
+NOTEBOOK_MAX_SOURCE_CHARS = int(os.environ.get("NOTEBOOK_MAX_SOURCE_CHARS", "200000"))
+NOTEBOOK_INCLUDE_OUTPUTS = os.environ.get("NOTEBOOK_INCLUDE_OUTPUTS", "false").lower() in ("1", "true", "yes")
+NOTEBOOK_MAX_OUTPUT_CHARS = int(os.environ.get("NOTEBOOK_MAX_OUTPUT_CHARS", "1000"))
+
+# Output MIME types kept as text; every other type (images, HTML, widgets...) is skipped without being read
+TEXT_OUTPUT_TYPES = ("text/plain", "text/markdown")
+
+TRUNCATED_MARK = "... [truncated]"
+
+_STRING_SPECIALS = re.compile(r'["\\]')
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_WHITESPACE = re.compile(r"\s*")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class NotebookFormatError(ValueError):
+    """Raised when a notebook file is not valid JSON or does not have the notebook structure."""
+
+
+class JsonStream:
+    """
+    JsonStream class.
+
+    A pull parser reading a JSON document from a text file in blocks of `block_size` characters. Values are either
+    read (strings truncated to a maximum length) or skipped; a skipped string is scanned but never held in memory, so
+    the memory used does not depend on the size of the values in the document.
+
+    Methods:
+        peek(): Returns the next non-whitespace character.
+        expect(char): Consumes a structural character.
+        iter_object(): Yields the keys of an object; the caller reads or skips the value of each key.
+        iter_array(): Yields once per item of an array; the caller reads or skips each item.
+        read_string(limit): Reads a string, keeping at most `limit` characters.
+        read_text(limit): Reads a string or an array of strings (the notebook multiline format), concatenated.
+        read_scalar(): Reads a number, boolean or null, or a string.
+        skip_value(): Skips any value.
+    """
+    def __init__(self, file, block_size=NOTEBOOK_READ_BLOCK_SIZE):
+        self.file = file
+        self.block_size = block_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Drop the consumed part of the buffer and read the next block
+        if self.eof:
+            return False
+        block = self.file.read(self.block_size)
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        self.eof = not block
+        return bool(block)
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise NotebookFormatError("Unexpected end of the notebook file")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise NotebookFormatError(f"Expected {char!r}, found {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def _separator(self, closing):
+        # Consumes the comma between two items; returns False at the end of the container
+        char = self.peek()
+        if char == closing:
+            self.pos += 1
+            return False
+        self.expect(",")
+        return True
+
+    def iter_object(self):
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_string()
+            self.expect(":")
+            yield key
+            if not self._separator("}"):
+                return
+
+    def iter_array(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if not self._separator("]"):
+                return
+
+    def read_string(self, limit=None):
+        """
+        Reads a string, keeping at most `limit` decoded characters.
+
+        Returns:
+            str: The string, ending with `TRUNCATED_MARK` when it was longer than `limit`.
+        """
+        self.expect('"')
+        parts, kept, truncated = [], 0, False
+        while True:
+            match = _STRING_SPECIALS.search(self.buffer, self.pos)
+            if match is None:
+                segment = self.buffer[self.pos:]
+                self.pos = len(self.buffer)
+                kept, truncated = self._keep(parts, segment, len(segment), kept, truncated, limit)
+                if not self._fill():
+                    raise NotebookFormatError("Unterminated string in the notebook file")
+                continue
+
+            segment = self.buffer[self.pos:match.start()]
+            kept, truncated = self._keep(parts, segment, len(segment), kept, truncated, limit)
+            self.pos = match.start()
+            if match.group() == '"':
+                self.pos += 1
+                break
+
+            # Escape sequence: decoded whole, the second half of a surrogate pair adding no character
+            while len(self.buffer) - self.pos < 6 and self._fill():
+                pass
+            length = 6 if self.buffer[self.pos + 1:self.pos + 2] == "u" else 2
+            char = self._unescape(self.buffer[self.pos:self.pos + length])
+            self.pos += length
+            pair = "\udc00" <= char <= "\udfff" and parts and "\ud800" <= parts[-1][-1:] <= "\udbff"
+            kept, truncated = self._keep(parts, char, 0 if pair else 1, kept, truncated, limit, whole=True)
+
+        # Join the surrogate pairs of \uXXXX escapes into their characters, as json.loads does
+        text = "".join(parts).encode("utf-16-le", "surrogatepass").decode("utf-16-le", "surrogatepass")
+        if truncated and text and "\ud800" <= text[-1] <= "\udbff":
+            # Drop the first half of a surrogate pair cut by the truncation
+            text = text[:-1]
+        return text + TRUNCATED_MARK if truncated else text
+
+    @staticmethod
+    def _unescape(escape):
+        if escape[1:2] == "u":
+            try:
+                return chr(int(escape[2:], 16))
+            except ValueError:
+                raise NotebookFormatError(f"Invalid escape {escape!r} in the notebook file") from None
+        if escape[1:2] not in _ESCAPES:
+            raise NotebookFormatError(f"Invalid escape {escape!r} in the notebook file")
+        return _ESCAPES[escape[1:2]]
+
+    @staticmethod
+    def _keep(parts, text, size, kept, truncated, limit, whole=False):
+        # Keeps decoded text, `size` characters long, while the limit allows
+        if truncated or not text:
+            return kept, truncated
+        if limit is not None and kept + size > limit:
+            if not whole:
+                parts.append(text[:limit - kept])
+            return limit, True
+        parts.append(text)
+        return kept + size, False
+
+    def read_text(self, limit=None):
+        if self.peek() != "[":
+            return self.read_string(limit)
+        parts, kept = [], 0
+        for _ in self.iter_array():
+            if limit is not None and kept >= limit:
+                self.skip_value()
+                if not parts or not parts[-1].endswith(TRUNCATED_MARK):
+                    parts.append(TRUNCATED_MARK)
+                continue
+            part = self.read_string(None if limit is None else limit - kept)
+            parts.append(part)
+            kept += len(part)
+        return "".join(parts)
+
+    def read_scalar(self):
+        char = self.peek()
+        if char == '"':
+            return self.read_string()
+        while len(self.buffer) - self.pos < 32 and self._fill():
+            pass
+        for literal, value in (("true", True), ("false", False), ("null", None)):
+            if self.buffer.startswith(literal, self.pos):
+                self.pos += len(literal)
+                return value
+        match = _NUMBER.match(self.buffer, self.pos)
+        if not match:
+            raise NotebookFormatError(f"Unexpected character {char!r} in the notebook file")
+        self.pos = match.end()
+        return json.loads(match.group())
+
+    def skip_value(self):
+        char = self.peek()
+        if char == "{":
+            for _ in self.iter_object():
+                self.skip_value()
+        elif char == "[":
+            for _ in self.iter_array():
+                self.skip_value()
+        elif char == '"':
+            self.read_string(limit=0)
+        else:
+            self.read_scalar()
+
+
+def _read_outputs(stream, max_chars):
+    # Keep the text of stream, result and error outputs; images and rich outputs are skipped unread
+    outputs = []
+    for _ in stream.iter_array():
+        output = {}
+        for key in stream.iter_object():
+            if key == "output_type":
+                output["output_type"] = stream.read_string()
+            elif key == "text":
+                output["text"] = stream.read_text(max_chars)
+            elif key == "data":
+                for mime_type in stream.iter_object():
+                    if mime_type in TEXT_OUTPUT_TYPES and "text" not in output:
+                        output["text"] = stream.read_text(max_chars)
+                    else:
+                        stream.skip_value()
+            elif key in ("ename", "evalue"):
+                output[key] = stream.read_string(max_chars)
+            else:
+                stream.skip_value()
+        if output.get("output_type") == "error":
+            outputs.append(f"{output.get('ename', 'Error')}: {output.get('evalue', '')}")
+        elif output.get("text", "").strip():
+            outputs.append(output["text"].strip("\n"))
+    return outputs
+
+
+def iter_notebook_cells(notebook_path, include_outputs=NOTEBOOK_INCLUDE_OUTPUTS, max_output_chars=NOTEBOOK_MAX_OUTPUT_CHARS,
+                        max_source_chars=NOTEBOOK_MAX_SOURCE_CHARS):
+    """
+    Reads the cells of a notebook file one at a time, without loading the notebook in memory.
+
+    The file is parsed incrementally: each cell is yielded as soon as it is read, image and other binary outputs are
+    skipped without being materialized, and text outputs are truncated, so memory stays bounded whatever the size of
+    the notebook.
+
+    Parameters:
+        notebook_path (str): The path to the .ipynb file.
+        include_outputs (bool): Whether to read the text outputs of the code cells.
+        max_output_chars (int): The maximum number of characters kept per output.
+        max_source_chars (int): The maximum number of characters kept per cell source.
+
+    Yields:
+        dict: The non-empty cells, with their `index`, `cell_type`, `source` text and `outputs` (a list of texts).
+
+    Raises:
+        NotebookFormatError: If the file is not a valid notebook.
+    """
+    with open(notebook_path, encoding="utf-8-sig") as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object():
+            if key != "cells":
+                stream.skip_value()
+                continue
+            for index, _ in enumerate(stream.iter_array()):
+                cell = {"index": index, "cell_type": "code", "source": "", "outputs": []}
+                for cell_key in stream.iter_object():
+                    if cell_key == "cell_type":
+                        cell["cell_type"] = stream.read_string()
+                    elif cell_key == "source":
+                        cell["source"] = stream.read_text(max_source_chars).strip("\n")
+                    elif cell_key == "outputs" and include_outputs:
+                        cell["outputs"] = _read_outputs(stream, max_output_chars)
+                    else:
+                        stream.skip_value()
+                if cell["source"].strip():
+                    yield cell
@@ -1,4 +1,7 @@
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+# Answer of the direct QA prompt when the notebook context does not cover the question; never shown to the user
+NO_ANSWER_MARKER = "NO_ANSWER"
 
 class PromptTemplates:
     """
@@ -10,10 +13,15 @@ class PromptTemplates:
     Methods:
         __init__(): Initializes all prompt templates as instance variables.
         get_rag_qa_prompt(): Returns the RAG QA prompt.
+        get_direct_qa_prompt(): Returns the prompt answering a question of the conversation from the notebook context in one call.
+        get_standalone_question_prompt(): Returns the prompt rewriting a follow-up question as a standalone question.
         get_qa_agent_prompt(): Returns the QA Agent prompt.
         get_quiz_agent_prompt(): Returns the Quiz Agent prompt.
         get_flashcards_agent_prompt(): Returns the Flashcards Agent prompt.
         get_supervisor_agent_prompt(): Returns the Supervisor Agent prompt.
+        get_memory_summary_prompt(): Returns the prompt summarizing the earlier turns of a conversation.
+        get_study_bank_prompt(): Returns the prompt generating the quiz questions and flashcards of a notebook section.
+        get_quiz_section_prompt(): Returns the prompt generating quiz questions on a notebook section for a quiz request.
 
     Example usage:
         prompt_templates = PromptTemplates()
@@ -31,6 +39,27 @@ class PromptTemplates:
             Answer the query in a pretty format if the context is related to it; otherwise, answer: 'Sorry, I can't answer. Please ask another question.'
         """)
 
+        self.direct_QA_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are a QA assistant who answers questions about the provided notebook content.
+            Answer the user's last question from the notebook excerpts below, in a pretty format, quoting the relevant code.
+            Cite the cells you used, e.g. (cell 3). Use the conversation to understand follow-up questions.
+            If the excerpts do not contain the information needed to answer, reply with exactly """ + NO_ANSWER_MARKER + """ and nothing else.
+
+            NOTEBOOK EXCERPTS:
+            {context}"""),
+            MessagesPlaceholder(variable_name="messages"),
+        ])
+
+        self.standalone_question_prompt = ChatPromptTemplate.from_template("""
+            CONVERSATION:
+            {history}
+
+            FOLLOW-UP QUESTION:
+            {question}
+
+            Rewrite the follow-up question about the notebook as a standalone question, replacing its references to the conversation (e.g. "that", "the second one") with what they refer to. Keep its meaning and language. If it is already standalone, return it unchanged. Answer with the question only.
+        """)
+
         self.QAAgent_prompt = """"You are a QA assistant who answers questions about the provided notebook content.
         Provide the notebook code and context to answer the user's questions accurately and informatively."""
 
@@ -50,9 +79,59 @@ class PromptTemplates:
 
         self.SupervisorAgent_prompt = "You are a supervisor tasked with managing a conversation between the following agents: QAAgent, QuizAgent, FlashcardsAgent. Given the user request, decide which agent should act next."
 
+        self.memory_summary_prompt = ChatPromptTemplate.from_template("""
+            You are summarizing a tutoring conversation about a Jupyter notebook, so that it can continue without its earlier turns.
+
+            CURRENT SUMMARY:
+            {summary}
+
+            NEW TURNS:
+            {turns}
+
+            Write an updated summary in at most 200 words. Keep the topics and questions the user asked about, the answers and explanations given, and the quizzes and flashcards created (with their subjects). Leave out greetings and formatting.
+        """)
+
+        self.study_bank_prompt = ChatPromptTemplate.from_template("""
+            You are preparing study material for a section of a Jupyter notebook.
+
+            SECTION:
+            {section}
+
+            CONTENT:
+            {content}
+
+            Write {count} multiple-choice quiz questions and {count} flashcards testing the key concepts and code of this section only.
+            Answer with a JSON object of the form:
+            {{"quiz": [{{"question": "...", "choices": ["...", "...", "...", "..."], "answer": "the correct choice, with a one-sentence explanation"}}],
+             "flashcards": [{{"question": "front of the card", "answer": "back of the card"}}]}}
+        """)
+
+        self.quiz_section_prompt = ChatPromptTemplate.from_template("""
+            You are writing part of a quiz on a Jupyter notebook. This part covers one section of the notebook.
+
+            SECTION:
+            {section}
+
+            CONTENT:
+            {content}
+
+            QUIZ REQUEST:
+            {request}
+
+            Write {count} multiple-choice quiz questions testing the key concepts and code of this section only, following the quiz request where it applies to this section. This is batch {batch} of {batches} for this section: vary the concepts the questions test.
+            Answer with a JSON object of the form:
+            {{"quiz": [{{"question": "...", "choices": ["...", "...", "...", "..."], "answer": "the correct choice, with a one-sentence explanation"}}]}}
+        """)
+
     def get_rag_qa_prompt(self):
         return self.rag_QA_prompt
 
+    def get_direct_qa_prompt(self):
+        return self.direct_QA_prompt
+
+    def get_standalone_question_prompt(self):
+        return self.standalone_question_prompt
+
     def get_qa_agent_prompt(self):
         return self.QAAgent_prompt
 
@@ -64,3 +143,12 @@ class PromptTemplates:
 
     def get_supervisor_agent_prompt(self):
         return self.SupervisorAgent_prompt
+
+    def get_memory_summary_prompt(self):
+        return self.memory_summary_prompt
+
+    def get_study_bank_prompt(self):
+        return self.study_bank_prompt
+
+    def get_quiz_section_prompt(self):
+        return self.quiz_section_prompt
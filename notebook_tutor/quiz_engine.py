@@ -0,0 +1,208 @@
+import os
+import math
+import asyncio
+import logging
+from itertools import zip_longest
+from langchain_core.output_parsers import JsonOutputParser
+from prompt_templates import PromptTemplates
+from clients import get_chat_model
+from keyword_index import code_tokens
+from retrievers import normalize_question
+from study_bank import sections_for_bank, topic_terms, requested_count
+from tracing import span
+
+# Configuration for the parallel quiz generation
+QUIZ_MODE = os.environ.get("QUIZ_MODE", "parallel")  # "parallel", or "agent" to let the quiz agent write the quiz
+QUIZ_MODEL = os.environ.get("QUIZ_MODEL", "gpt-4o")
+QUIZ_QUESTIONS_PER_CALL = int(os.environ.get("QUIZ_QUESTIONS_PER_CALL", "3"))
+QUIZ_CONCURRENCY = int(os.environ.get("QUIZ_CONCURRENCY", "8"))
+QUIZ_SECTION_MAX_TOKENS = int(os.environ.get("QUIZ_SECTION_MAX_TOKENS", "1500"))
+
+QUIZ_MODES = ("parallel", "agent")
+if QUIZ_MODE not in QUIZ_MODES:
+    raise ValueError(f"Unknown quiz mode {QUIZ_MODE!r}, expected one of {QUIZ_MODES}")
+
+# Extra questions asked of each call, so the quiz is complete once duplicates are dropped
+QUIZ_SPARE_QUESTIONS = 1
+
+logger = logging.getLogger(__name__)
+
+
+def select_sections(sections, terms, calls):
+    """
+    Picks the sections a quiz covers: the sections mentioning the topics of the request, most mentions first, or
+    sections spread evenly over the notebook when the request names no topic.
+
+    Parameters:
+        sections (list): The (section heading, section text) pairs of the notebook, in notebook order.
+        terms (set): The topic terms of the request.
+        calls (int): The number of generation calls of the quiz.
+
+    Returns:
+        list: The selected (section heading, section text) pairs, empty when no section mentions the topics.
+    """
+    if terms:
+        scored = [(len(terms & set(code_tokens(f"{heading}\n{text}"))), index) for index, (heading, text) in enumerate(sections)]
+        ranked = sorted((item for item in scored if item[0] > 0), key=lambda item: (-item[0], item[1]))
+        return [sections[index] for _, index in ranked[:calls]]
+    if len(sections) <= calls:
+        return list(sections)
+    step = len(sections) / calls
+    return [sections[int(i * step)] for i in range(calls)]
+
+
+def merge_questions(batches, count, exclude=""):
+    """
+    Merges the questions of the generation calls into one quiz: invalid questions, duplicates and questions already
+    asked in the conversation are dropped, and the calls are interleaved so every section is covered.
+
+    Parameters:
+        batches (list): The questions of each call, as lists of dictionaries.
+        count (int): The number of questions of the quiz.
+        exclude (str): The text of the conversation so far.
+
+    Returns:
+        list: At most `count` questions.
+    """
+    exclude = normalize_question(exclude)
+    seen = set()
+    queues = []
+    for batch in batches:
+        queue = []
+        for item in batch:
+            if not isinstance(item, dict) or not item.get("question") or not item.get("answer"):
+                continue
+            key = normalize_question(str(item["question"]))
+            if not key or key in seen or key in exclude:
+                continue
+            seen.add(key)
+            queue.append(item)
+        queues.append(queue)
+
+    questions = []
+    for round_items in zip_longest(*queues):
+        questions.extend(item for item in round_items if item is not None)
+    return questions[:count]
+
+
+class QuizEngine:
+    """
+    QuizEngine class.
+
+    This class writes quizzes with a map-reduce over the sections of the notebook instead of one long generation: the
+    sections are read from the section metadata of the indexed chunks, the questions are split into calls of
+    `questions_per_call` questions spread over the sections, the calls run in parallel (at most `max_concurrency` at
+    once), and their questions are merged and deduplicated. The latency of a quiz is that of one short call, whatever
+    its number of questions.
+
+    Attributes:
+        model (str): The OpenAI chat model writing the questions.
+        questions_per_call (int): The number of questions written by each call.
+        max_concurrency (int): The maximum number of calls running at once.
+        section_max_tokens (int): The token budget of the section text sent to each call.
+
+    Methods:
+        plan(request, documents): Returns the inputs of the calls writing a quiz, and its number of questions.
+        create(request, documents, exclude, config): Writes a quiz.
+        acreate(request, documents, exclude, config): Writes a quiz asynchronously.
+    """
+    def __init__(self, model=QUIZ_MODEL, questions_per_call=QUIZ_QUESTIONS_PER_CALL, max_concurrency=QUIZ_CONCURRENCY,
+                 section_max_tokens=QUIZ_SECTION_MAX_TOKENS):
+        self.model = model
+        self.questions_per_call = questions_per_call
+        self.max_concurrency = max_concurrency
+        self.section_max_tokens = section_max_tokens
+
+    def _create_chain(self):
+        return PromptTemplates().get_quiz_section_prompt() | get_chat_model(self.model, temperature=0.7) | JsonOutputParser()
+
+    def plan(self, request, documents):
+        """
+        Splits a quiz request into generation calls over the sections of the notebook.
+
+        Parameters:
+            request (str): The user request.
+            documents (list): The chunks of the notebook.
+
+        Returns:
+            tuple: The inputs of the calls (empty when no section matches the request) and the number of questions.
+        """
+        count = requested_count(request, "quiz")
+        calls = math.ceil(count / self.questions_per_call)
+        sections = sections_for_bank(documents, max_sections=len(documents), max_tokens=self.section_max_tokens)
+        sections = select_sections(sections, topic_terms(request), calls)
+        if not sections:
+            return [], count
+
+        # Sections are assigned the calls in turn, so a notebook with few sections gets several calls per section.
+        # Calls are counted by section position, since several sections may share a heading
+        per_call = math.ceil(count / calls) + QUIZ_SPARE_QUESTIONS
+        assigned = [i % len(sections) for i in range(calls)]
+        batches = [assigned.count(position) for position in range(len(sections))]
+        inputs, batch_numbers = [], [0] * len(sections)
+        for position in assigned:
+            heading, text = sections[position]
+            batch_numbers[position] += 1
+            inputs.append({
+                "section": heading, "content": text, "request": request, "count": per_call,
+                "batch": batch_numbers[position], "batches": batches[position],
+            })
+        return inputs, count
+
+    def create(self, request, documents, exclude="", config=None):
+        """
+        Writes a quiz on the notebook for a request.
+
+        Parameters:
+            request (str): The user request.
+            documents (list): The chunks of the notebook.
+            exclude (str): The text of the conversation so far, whose questions are not asked again.
+            config (dict, optional): The config of the calls (e.g. their callbacks).
+
+        Returns:
+            list: The questions of the quiz, or None when no section of the notebook matches the request.
+        """
+        inputs, count = self.plan(request, documents)
+        if not inputs:
+            return None
+        with span("quiz.generate", calls=len(inputs), questions=count) as quiz_span:
+            results = self._create_chain().batch(inputs, self._config(config), return_exceptions=True)
+            questions = self._merge(inputs, results, count, exclude)
+            quiz_span.set(merged=len(questions))
+        return questions or None
+
+    async def acreate(self, request, documents, exclude="", config=None):
+        """
+        Writes a quiz on the notebook for a request asynchronously.
+
+        This is the asynchronous counterpart of `create`.
+        """
+        inputs, count = await asyncio.to_thread(self.plan, request, documents)
+        if not inputs:
+            return None
+        with span("quiz.generate", calls=len(inputs), questions=count) as quiz_span:
+            results = await self._create_chain().abatch(inputs, self._config(config), return_exceptions=True)
+            questions = self._merge(inputs, results, count, exclude)
+            quiz_span.set(merged=len(questions))
+        return questions or None
+
+    def _config(self, config):
+        return {**(config or {}), "max_concurrency": self.max_concurrency}
+
+    @staticmethod
+    def _merge(inputs, results, count, exclude):
+        batches = []
+        for call, result in zip(inputs, results):
+            if isinstance(result, Exception) or not isinstance(result, dict):
+                logger.warning("Quiz generation failed for section %r: %s", call["section"], result)
+                continue
+            batches.append(result.get("quiz") or [])
+        questions = merge_questions(batches, count, exclude)
+        if len(questions) < count:
+            logger.warning("Quiz has %d of the %d questions requested", len(questions), count)
+        logger.info("Quiz of %d questions written by %d parallel calls", len(questions), len(inputs))
+        return questions
+
+
+# Instantiate the quiz engine shared by all sessions
+quiz_engine = QuizEngine()
@@ -0,0 +1,204 @@
+import os
+import asyncio
+import logging
+from functools import lru_cache
+import numpy as np
+from langchain_core.runnables import RunnableLambda
+from retrievers import document_key
+from utils import get_token_counter
+
+# Configuration for the compression of the RAG context
+RAG_CONTEXT_COMPRESSION = os.environ.get("RAG_CONTEXT_COMPRESSION", "true").lower() in ("1", "true", "yes")
+RAG_CONTEXT_MAX_TOKENS = int(os.environ.get("RAG_CONTEXT_MAX_TOKENS", "1500"))
+RAG_CONTEXT_MAX_CHUNKS = int(os.environ.get("RAG_CONTEXT_MAX_CHUNKS", "4"))
+RAG_CONTEXT_MIN_OVERLAP = float(os.environ.get("RAG_CONTEXT_MIN_OVERLAP", "0.8"))  # share of lines making a duplicate
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", "0.7"))  # 1 ranks by relevance only, 0 by diversity only
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2, needs sentence-transformers
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_cross_encoder(model_name):
+    """
+    Loads a cross-encoder re-ranking model on the CPU, once per process.
+
+    Returns:
+        CrossEncoder: The model, or None when sentence-transformers is not installed.
+    """
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        logger.warning("sentence-transformers is not installed, the %s re-ranker is disabled", model_name)
+        return None
+    return CrossEncoder(model_name, device="cpu")
+
+
+def _lines(document):
+    return {line.strip() for line in document.page_content.split("\n") if line.strip()}
+
+
+def deduplicate(documents, min_overlap=RAG_CONTEXT_MIN_OVERLAP):
+    """
+    Drops the documents already returned, and the documents sharing at least `min_overlap` of their lines with a
+    better ranked document of the same notebook (overlapping windows, or the same cells found by several queries).
+
+    Parameters:
+        documents (list): The retrieved documents, best first.
+        min_overlap (float): The share of the lines of the shorter document two documents must share.
+
+    Returns:
+        list: The documents kept, in their order.
+    """
+    kept, kept_lines, seen = [], [], set()
+    for document in documents:
+        key = document_key(document)
+        if key in seen:
+            continue
+        lines = _lines(document)
+        source = document.metadata.get("source")
+        duplicate = any(
+            other.metadata.get("source") == source and lines and other_lines
+            and len(lines & other_lines) >= min_overlap * min(len(lines), len(other_lines))
+            for other, other_lines in zip(kept, kept_lines)
+        )
+        if not duplicate:
+            seen.add(key)
+            kept.append(document)
+            kept_lines.append(lines)
+    return kept
+
+
+def maximal_marginal_relevance(relevance, similarities, mmr_lambda=MMR_LAMBDA):
+    """
+    Orders documents by maximal marginal relevance: each step picks the document maximizing
+    `mmr_lambda * relevance - (1 - mmr_lambda) * max similarity to the documents already picked`.
+
+    Parameters:
+        relevance (array): The relevance of each document to the question.
+        similarities (array): The pairwise similarities of the documents.
+        mmr_lambda (float): The weight of relevance against diversity.
+
+    Returns:
+        list: The positions of the documents, in the order picked.
+    """
+    remaining = list(range(len(relevance)))
+    order = []
+    while remaining:
+        if order:
+            redundancy = similarities[np.ix_(remaining, order)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        order.append(remaining.pop(int(np.argmax(scores))))
+    return order
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class ContextCompressor:
+    """
+    ContextCompressor class.
+
+    This class shrinks the documents returned by the retriever before they are put in the RAG prompt: duplicate and
+    overlapping chunks are dropped, the others are re-ranked (by a CPU cross-encoder when `RERANKER_MODEL` is set)
+    and ordered by maximal marginal relevance, then kept best first within a token and a chunk budget.
+
+    Chunks are compared through the embedding model, whose cache already holds the vectors of every indexed chunk, so
+    re-ranking makes no embedding request for them.
+
+    Attributes:
+        embedding_model (object): The embedding model of the notebook collection, or None to skip MMR.
+        max_tokens (int): The token budget of the context.
+        max_chunks (int): The maximum number of chunks in the context.
+        mmr_lambda (float): The weight of relevance against diversity in MMR.
+        cross_encoder (object): The cross-encoder scoring (question, chunk) pairs, or None.
+
+    Methods:
+        compress(question, documents): Returns the documents to put in the prompt.
+        acompress(question, documents): Async version of `compress`.
+        as_runnable(): Returns the compressor as a runnable taking the question and the context of the RAG chain.
+    """
+    def __init__(self, embedding_model=None, max_tokens=RAG_CONTEXT_MAX_TOKENS, max_chunks=RAG_CONTEXT_MAX_CHUNKS,
+                 mmr_lambda=MMR_LAMBDA, reranker_model=RERANKER_MODEL, token_counter=None):
+        self.embedding_model = embedding_model
+        self.max_tokens = max_tokens
+        self.max_chunks = max_chunks
+        self.mmr_lambda = mmr_lambda
+        self.cross_encoder = get_cross_encoder(reranker_model) if reranker_model else None
+        self.token_counter = token_counter or get_token_counter()
+
+    def compress(self, question, documents):
+        documents = deduplicate(documents)
+        if len(documents) > 1:
+            documents = self._rank(documents, self._embed(question, documents), self._rerank(question, documents))
+        return self._trim(documents)
+
+    async def acompress(self, question, documents):
+        documents = deduplicate(documents)
+        if len(documents) > 1:
+            # The cross-encoder runs in a thread while the embeddings are looked up
+            vectors, cross_scores = await asyncio.gather(
+                self._aembed(question, documents), asyncio.to_thread(self._rerank, question, documents)
+            )
+            documents = self._rank(documents, vectors, cross_scores)
+        return self._trim(documents)
+
+    def as_runnable(self):
+        return RunnableLambda(self._compress_inputs, afunc=self._acompress_inputs, name="compress_context")
+
+    def _compress_inputs(self, inputs):
+        return self.compress(inputs["question"], inputs["context"])
+
+    async def _acompress_inputs(self, inputs):
+        return await self.acompress(inputs["question"], inputs["context"])
+
+    def _embed(self, question, documents):
+        if self.embedding_model is None:
+            return None
+        return self.embedding_model.embed_documents([question] + [document.page_content for document in documents])
+
+    async def _aembed(self, question, documents):
+        if self.embedding_model is None:
+            return None
+        return await self.embedding_model.aembed_documents([question] + [document.page_content for document in documents])
+
+    def _rerank(self, question, documents):
+        if self.cross_encoder is None:
+            return None
+        scores = np.asarray(self.cross_encoder.predict([(question, document.page_content) for document in documents]))
+        # Bring the logits to [0, 1], the scale of the cosine similarities MMR weighs them against
+        spread = scores.max() - scores.min()
+        return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+    def _rank(self, documents, vectors, cross_scores):
+        if vectors is None and cross_scores is None:
+            return documents
+        if vectors is None:
+            order = np.argsort(-cross_scores, kind="stable")
+        else:
+            vectors = _normalize(vectors)
+            relevance = cross_scores if cross_scores is not None else vectors[1:] @ vectors[0]
+            order = maximal_marginal_relevance(relevance, vectors[1:] @ vectors[1:].T, self.mmr_lambda)
+        return [documents[i] for i in order]
+
+    def _trim(self, documents):
+        # Keep the documents best first while they fit in the budget; the best one is always kept
+        kept, total = [], 0
+        lengths = self.token_counter.count_batch([document.page_content for document in documents])
+        for document, tokens in zip(documents, lengths):
+            if len(kept) >= self.max_chunks:
+                break
+            if kept and total + tokens > self.max_tokens:
+                continue
+            kept.append(document)
+            total += tokens
+        logger.info(
+            "RAG context compressed from %d chunks (%d tokens) to %d chunks (%d tokens)",
+            len(documents), sum(lengths), len(kept), total,
+        )
+        return kept
@@ -1,7 +1,79 @@
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
+import os
+import logging
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough
 from operator import itemgetter
-from prompt_templates import PromptTemplates
+from prompt_templates import PromptTemplates, NO_ANSWER_MARKER
+from answer_cache import SemanticAnswerCache
+from reranking import ContextCompressor, RAG_CONTEXT_COMPRESSION
+from clients import get_chat_model, AGENT_LLM_TAG
+from document_processing import collection_registry
+from tracing import span
+
+# Configuration for the semantic answer cache
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "256"))
+
+# Model rewriting follow-up questions as standalone questions before retrieval and the answer cache
+QUESTION_REWRITE_MODEL = os.environ.get("QUESTION_REWRITE_MODEL", "gpt-3.5-turbo")
+
+# Answer returned by the RAG prompt when the context does not cover the question; never cached
+NO_ANSWER_PREFIX = "Sorry, I can't answer"
+
+# Instantiate the answer cache shared by all sessions, dropping a notebook's answers whenever its index changes
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_entries_per_notebook=ANSWER_CACHE_MAX_ENTRIES,
+)
+collection_registry.change_callbacks.append(answer_cache.invalidate)
+
+logger = logging.getLogger(__name__)
+
+
+def format_context(documents):
+    """
+    Formats retrieved chunks for a prompt, each headed by the notebook cells it comes from so answers can cite them.
+
+    Parameters:
+        documents (list): The retrieved chunks.
+
+    Returns:
+        str: The formatted context.
+    """
+    parts = []
+    for document in documents:
+        cells = [cell for cell in document.metadata.get("cell_indexes") or [document.metadata.get("cell_index")] if cell is not None]
+        header = "cell " + ", ".join(str(cell) for cell in cells) if cells else "notebook"
+        if document.metadata.get("section"):
+            header += f" (section: {document.metadata['section']})"
+        parts.append(f"[{header}]\n{document.page_content}")
+    return "\n\n".join(parts)
+
+
+def conversation_history(messages):
+    """
+    Formats the turns of a conversation before its last user message, for the standalone question prompt.
+
+    Parameters:
+        messages (list): The messages of the conversation, ending with the user question.
+
+    Returns:
+        str: The earlier turns, one message per line, or an empty string for the first question of the conversation.
+    """
+    last = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=len(messages))
+    lines = []
+    for message in messages[:last]:
+        if isinstance(message, HumanMessage):
+            role = "User"
+        elif isinstance(message, SystemMessage):
+            role = "Summary"
+        else:
+            role = message.name or "Tutor"
+        lines.append(f"{role}: {message.content}")
+    return "\n".join(lines)
 
 
 class RetrievalManager:
@@ -9,19 +81,41 @@ class RetrievalManager:
     RetrievalManager class.
 
     This class represents a retrieval manager that processes questions using a retrieval-augmented QA chain and returns the response.
+    The chain is built once per retriever and reused for every question.
+    Unless `RAG_CONTEXT_COMPRESSION` is off, the retrieved documents are deduplicated, re-ranked and trimmed to a token budget by a `ContextCompressor` before they are put in the prompt.
+    When an embedding model and a cache namespace are given, answers are served from the semantic answer cache for questions similar to ones already answered about the same notebook by the same chain.
+    Follow-up questions (inputs with earlier `messages`) are first rewritten as standalone questions by `question_model`, so retrieval and the answer cache, shared by all sessions on the notebook, never see a question that only makes sense in its conversation.
 
     Attributes:
         retriever (object): The retriever object used for retrieval.
         chat_model (object): The ChatOpenAI object representing the OpenAI Chat model.
+        embedding_model (object): The embedding model used to embed questions for the answer cache and to re-rank the context.
+        cache_namespace (str): The notebook index the cached answers belong to.
+        answer_model (object): The streamed chat model answering the questions of the direct QA chain.
+        question_model (object): The chat model rewriting follow-up questions as standalone questions.
 
     Methods:
         notebook_QA(question):
             Processes a question using the retrieval-augmented QA chain and returns the response.
+        get_RAG_QA_chain():
+            Returns the retrieval-augmented QA chain, behind the answer cache when it is enabled.
+        get_direct_QA_chain():
+            Returns the direct QA chain, which answers a question of the conversation (`{"question", "messages"}`) with
+            one streamed call citing the notebook cells, or with `NO_ANSWER_MARKER` when the context does not cover it.
     """
-    def __init__(self, retriever):
+    def __init__(self, retriever, embedding_model=None, cache_namespace=None, answer_model=None, question_model=None):
         self.retriever = retriever
-        self.chat_model = ChatOpenAI(model="gpt-4-turbo", temperature=0.1)
+        self.chat_model = get_chat_model("gpt-4-turbo", temperature=0.1)
         self.prompts = PromptTemplates()
+        self.embedding_model = embedding_model
+        self.cache_namespace = cache_namespace
+        self.context_compressor = ContextCompressor(embedding_model) if RAG_CONTEXT_COMPRESSION else None
+        self.answer_model = answer_model or get_chat_model("gpt-4o", streaming=True, tags=[AGENT_LLM_TAG])
+        self.question_model = question_model or get_chat_model(QUESTION_REWRITE_MODEL, temperature=0)
+        self.question_chain = self._build_question_chain()
+        self.context_chain = self._build_context_chain()
+        self.rag_chain = self._build_RAG_QA_chain()
+        self.qa_chain = self._build_direct_QA_chain()
 
     def notebook_QA(self, question):
         """
@@ -33,19 +127,93 @@ class RetrievalManager:
         Returns:
             str: The response generated by the retrieval-augmented QA chain.
         """
-        retrieval_augmented_qa_chain = (
-            {"context": itemgetter("question") | self.retriever, "question": itemgetter("question")}
-            | RunnablePassthrough.assign(context=itemgetter("context"))
-            | {"response": self.prompts.get_rag_qa_prompt() | self.chat_model, "context": itemgetter("context")}
-        )
-
-        response = retrieval_augmented_qa_chain.invoke({"question": question})
+        response = self.rag_chain.invoke({"question": question})
 
         return response["response"].content
 
     def get_RAG_QA_chain(self):
+        return self.rag_chain
+
+    def get_direct_QA_chain(self):
+        return self.qa_chain
+
+    def _build_question_chain(self):
+        # Rewrites a follow-up question as a standalone question, and passes first questions through unchanged
+        rewrite = (
+            {"history": lambda inputs: conversation_history(inputs["messages"]), "question": itemgetter("question")}
+            | self.prompts.get_standalone_question_prompt()
+            | self.question_model
+            | StrOutputParser()
+        )
+        return RunnableBranch(
+            (lambda inputs: bool(conversation_history(inputs.get("messages") or [])), RunnablePassthrough.assign(question=rewrite)),
+            RunnablePassthrough(),
+        ).with_config(run_name="standalone_question")
+
+    def _build_context_chain(self):
+        # Retrieves the documents of the question and compresses them, passing the other inputs through
+        compress_context = self.context_compressor.as_runnable() if self.context_compressor else itemgetter("context")
         return (
-            {"context": itemgetter("question") | self.retriever, "question": itemgetter("question")}
-            | RunnablePassthrough.assign(context=itemgetter("context"))
-            | {"response": self.prompts.get_rag_qa_prompt() | self.chat_model, "context": itemgetter("context")}
+            RunnablePassthrough.assign(context=itemgetter("question") | self.retriever)
+            | RunnablePassthrough.assign(context=compress_context)
+        )
+
+    def _build_RAG_QA_chain(self):
+        rag_chain = self.context_chain | {
+            "response": self.prompts.get_rag_qa_prompt() | self.chat_model, "context": itemgetter("context")
+        }
+        return self._with_answer_cache(rag_chain, "rag_chain")
+
+    def _build_direct_QA_chain(self):
+        answer = {
+            "response": RunnablePassthrough.assign(context=lambda inputs: format_context(inputs["context"]))
+            | self.prompts.get_direct_qa_prompt()
+            | self.answer_model,
+            "context": itemgetter("context"),
+        }
+        # Without any context, the question cannot be answered from the notebook and no answer is generated
+        qa_chain = self.context_chain | RunnableBranch(
+            (lambda inputs: not inputs["context"], lambda inputs: {"response": AIMessage(content=NO_ANSWER_MARKER), "context": []}),
+            answer,
         )
+        return self._with_answer_cache(qa_chain, "qa_chain")
+
+    def _with_answer_cache(self, chain, name):
+        if self.embedding_model is None or self.cache_namespace is None:
+            return (self.question_chain | chain).with_config(run_name=name)
+
+        def answer(inputs, config):
+            inputs = self.question_chain.invoke(inputs, config)
+            with span("answer_cache.lookup") as lookup_span:
+                embedding = self.embedding_model.embed_query(inputs["question"])
+                cached = answer_cache.lookup(self.cache_namespace, embedding, chain=name)
+                lookup_span.set(hit=bool(cached))
+            if cached:
+                return self._cached_response(*cached)
+            response = chain.invoke(inputs, config)
+            self._store(name, inputs["question"], embedding, response)
+            return response
+
+        async def aanswer(inputs, config):
+            inputs = await self.question_chain.ainvoke(inputs, config)
+            with span("answer_cache.lookup") as lookup_span:
+                embedding = await self.embedding_model.aembed_query(inputs["question"])
+                cached = answer_cache.lookup(self.cache_namespace, embedding, chain=name)
+                lookup_span.set(hit=bool(cached))
+            if cached:
+                return self._cached_response(*cached)
+            response = await chain.ainvoke(inputs, config)
+            self._store(name, inputs["question"], embedding, response)
+            return response
+
+        return RunnableLambda(answer, afunc=aanswer, name=name)
+
+    @staticmethod
+    def _cached_response(answer, context):
+        logger.info("Answer served from the semantic cache (%s)", answer_cache.stats())
+        return {"response": AIMessage(content=answer), "context": context}
+
+    def _store(self, name, question, embedding, response):
+        content = response["response"].content
+        if NO_ANSWER_PREFIX not in content and not content.startswith(NO_ANSWER_MARKER):
+            answer_cache.store(self.cache_namespace, question, embedding, content, response["context"], chain=name)
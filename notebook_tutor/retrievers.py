@@ -0,0 +1,203 @@
+import re
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from typing import List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from langchain.retrievers import MultiQueryRetriever
+from keyword_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+# Retrieval modes supported by DocumentManager
+VECTOR_MODE = "vector"
+MULTI_QUERY_MODE = "multi_query"
+HYBRID_MODE = "hybrid"
+RETRIEVAL_MODES = (VECTOR_MODE, MULTI_QUERY_MODE, HYBRID_MODE)
+
+
+def normalize_question(question):
+    """
+    Normalizes a question so that near-identical phrasings share the same cache key.
+    """
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+class QueryVariantCache:
+    """
+    QueryVariantCache class.
+
+    This class represents an in-memory LRU cache of the query variants generated by the multi-query rewrite, keyed on
+    the normalized question text, so repeated questions skip the rewrite call.
+
+    Attributes:
+        max_size (int): The maximum number of questions kept in the cache.
+        hits (int): The number of lookups served from the cache.
+        misses (int): The number of lookups not found in the cache.
+
+    Methods:
+        get(question): Returns the cached variants of a question, or None.
+        put(question, variants): Stores the variants of a question.
+        stats(): Returns the cache size and the hit/miss counters.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question):
+        key = normalize_question(question)
+        with self._lock:
+            variants = self._entries.get(key)
+            if variants is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(variants)
+
+    def put(self, question, variants):
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = list(variants)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CachedMultiQueryRetriever(MultiQueryRetriever):
+    """
+    A `MultiQueryRetriever` that looks up the generated query variants in a `QueryVariantCache` before calling the LLM.
+    """
+    variant_cache: QueryVariantCache
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_llm(cls, retriever, llm, variant_cache, include_original=False):
+        multi_query_retriever = MultiQueryRetriever.from_llm(retriever=retriever, llm=llm, include_original=include_original)
+        return cls(
+            retriever=retriever,
+            llm_chain=multi_query_retriever.llm_chain,
+            include_original=include_original,
+            variant_cache=variant_cache,
+        )
+
+    def generate_queries(self, question: str, run_manager: CallbackManagerForRetrieverRun) -> List[str]:
+        variants = self.variant_cache.get(question)
+        if variants is None:
+            variants = super().generate_queries(question, run_manager)
+            self.variant_cache.put(question, variants)
+        return variants
+
+    async def agenerate_queries(self, question: str, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[str]:
+        variants = self.variant_cache.get(question)
+        if variants is None:
+            variants = await super().agenerate_queries(question, run_manager)
+            self.variant_cache.put(question, variants)
+        return variants
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    A retriever that answers from a plain vector search when its best hit is relevant enough, or when the question
+    names a code identifier found by the keyword index, and only falls back to the multi-query retriever (and its LLM
+    rewrite call) otherwise. The score threshold is on the relevance scale of the vector store, (cosine + 1) / 2 for
+    the Qdrant cosine collections and `CompactVectorStore`. Raw scores are normalized here with the store's relevance
+    function on both the sync and async paths, since the sync relevance search of the `Qdrant` store returns raw
+    cosines.
+    """
+    vectorstore: VectorStore
+    multi_query_retriever: MultiQueryRetriever
+    keyword_index: Optional[BM25Index] = None
+    score_threshold: float = 0.75
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _is_confident(self, query, docs_and_scores):
+        if self.keyword_index is not None and self.keyword_index.has_identifier_match(query):
+            return True
+        return bool(docs_and_scores) and docs_and_scores[0][1] >= self.score_threshold
+
+    def _relevance_scores(self, docs_and_scores):
+        relevance = self.vectorstore._select_relevance_score_fn()
+        return [(doc, relevance(score)) for doc, score in docs_and_scores]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs_and_scores = self._relevance_scores(self.vectorstore.similarity_search_with_score(query, k=self.k))
+        if self._is_confident(query, docs_and_scores):
+            return [doc for doc, _ in docs_and_scores]
+        logger.info("Vector search not confident enough, rewriting the query")
+        return self.multi_query_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        docs_and_scores = self._relevance_scores(await self.vectorstore.asimilarity_search_with_score(query, k=self.k))
+        if self._is_confident(query, docs_and_scores):
+            return [doc for doc, _ in docs_and_scores]
+        logger.info("Vector search not confident enough, rewriting the query")
+        return await self.multi_query_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+
+
+def document_key(document):
+    return document.metadata.get("cell_hash") or document.page_content
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    """
+    Fuses several rankings of documents by reciprocal rank: each document scores the sum of 1 / (rrf_k + rank) over
+    the rankings it appears in, so documents ranked well by several retrievers come first.
+
+    Parameters:
+        rankings (list): The lists of documents returned by each retriever, best first.
+        k (int): The number of documents to return.
+        rrf_k (int): The rank offset damping the weight of the first ranks.
+
+    Returns:
+        list: The k best documents, without duplicates.
+    """
+    scores, documents = {}, {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, 1):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class FusionRetriever(BaseRetriever):
+    """
+    A retriever running a dense retriever and a local keyword retriever and fusing their results by reciprocal rank.
+    The keyword search runs while the dense retriever waits on the network.
+    """
+    dense_retriever: BaseRetriever
+    keyword_retriever: BaseRetriever
+    k: int = 4
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        rankings = [self.dense_retriever.invoke(query, config=config), self.keyword_retriever.invoke(query, config=config)]
+        return reciprocal_rank_fusion(rankings, self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        rankings = await asyncio.gather(
+            self.dense_retriever.ainvoke(query, config=config),
+            self.keyword_retriever.ainvoke(query, config=config),
+        )
+        return reciprocal_rank_fusion(rankings, self.k, self.rrf_k)
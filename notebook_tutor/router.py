@@ -0,0 +1,335 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+import numpy as np
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+from metrics import percentile
+from tracing import tracer
+
+# Configuration for the supervisor fast path
+ROUTER_MODE = os.environ.get("ROUTER_MODE", "rules")  # one of "llm", "rules", "embeddings"
+ROUTER_EMBEDDING_MODEL = os.environ.get("ROUTER_EMBEDDING_MODEL", "text-embedding-3-small")
+ROUTER_SIMILARITY_THRESHOLD = float(os.environ.get("ROUTER_SIMILARITY_THRESHOLD", "0.5"))
+ROUTER_SIMILARITY_MARGIN = float(os.environ.get("ROUTER_SIMILARITY_MARGIN", "0.05"))
+ROUTER_SHADOW_RATE = float(os.environ.get("ROUTER_SHADOW_RATE", "0.0"))  # share of fast routes checked by the LLM
+
+ROUTER_MODES = ("llm", "rules", "embeddings")
+
+# Routing stages, from the cheapest to the most expensive
+DONE_STAGE = "done"
+RULES_STAGE = "rules"
+EMBEDDINGS_STAGE = "embeddings"
+LLM_STAGE = "llm"
+
+# Keyword rules of the agents that perform a task; a message matching exactly one of them is routed to it
+TASK_RULES = {
+    "FlashcardsAgent": re.compile(r"\bflash[- ]?cards?\b|\banki\b|\bstudy cards?\b|\brevision cards?\b", re.I),
+    "QuizAgent": re.compile(
+        r"\bquiz(?:zes)?\b|\btest me\b|\btest my (?:knowledge|understanding)\b|\bquestion me\b|\bmultiple[- ]choice\b"
+        r"|\bpractice questions?\b|\bexam questions?\b",
+        re.I,
+    ),
+}
+
+# Shape of a question about the notebook content
+QUESTION_RULE = re.compile(
+    r"^\s*(?:what|what's|whats|why|how|when|where|which|who|whom|whose|is|are|does|do|did|can|could|should|would|will"
+    r"|explain|describe|summari[sz]e|define|tell me|show me|walk me through|help me understand|give me an overview)\b"
+    r"|\?\s*$",
+    re.I,
+)
+
+# Verbs of a request for a task, telling "can you make a quiz?" apart from a question about quizzes
+REQUEST_RULE = re.compile(r"\b(?:make|create|generate|give|build|prepare|want|need|write|quiz me)\b", re.I)
+
+# Labelled examples of the embedding router
+ROUTING_EXAMPLES = {
+    "QAAgent": [
+        "What does this notebook do?",
+        "Explain the code in the second cell.",
+        "Why is the learning rate set to this value?",
+        "How is the dataset loaded?",
+        "Summarize the main steps of the notebook.",
+        "What is the difference between the two models used here?",
+        "I don't understand the retrieval part.",
+    ],
+    "QuizAgent": [
+        "Give me a quiz on this notebook.",
+        "Test my knowledge of the notebook.",
+        "Ask me some questions to check what I learned.",
+        "Create multiple choice questions about the code.",
+        "I want to practice with a few exam questions.",
+    ],
+    "FlashcardsAgent": [
+        "Make flashcards from the notebook.",
+        "Create study cards for the key concepts.",
+        "I need revision cards to memorize the main ideas.",
+        "Generate flashcards I can import into Anki.",
+        "Turn the notebook into cards for spaced repetition.",
+    ],
+}
+
+logger = logging.getLogger(__name__)
+
+
+def last_user_message(state):
+    """
+    Returns the content of the last user message of the conversation, or an empty string.
+    """
+    for message in reversed(state.get("messages", [])):
+        if isinstance(message, HumanMessage):
+            return str(message.content)
+    return ""
+
+
+def classify_by_rules(text):
+    """
+    Routes a message with the keyword rules.
+
+    Parameters:
+        text (str): The user message.
+
+    Returns:
+        str: The agent the message is routed to, or None when the rules are not confident.
+    """
+    tasks = [agent for agent, rule in TASK_RULES.items() if rule.search(text)]
+    is_question = bool(QUESTION_RULE.search(text))
+    if len(tasks) == 1:
+        # "Can you make a quiz?" asks for a quiz, "What is a quiz?" asks about one
+        return tasks[0] if not is_question or REQUEST_RULE.search(text) else None
+    if not tasks and is_question:
+        return "QAAgent"
+    return None
+
+
+class RoutingStats:
+    """
+    RoutingStats class.
+
+    This class counts the routes decided at each stage of the router and their latency, and the agreement of the fast
+    routes with the LLM supervisor on the share of them that is also sent to the LLM (`ROUTER_SHADOW_RATE`).
+
+    Methods:
+        record(stage, route, latency): Records a routing decision.
+        record_agreement(stage, agreed): Records whether a fast route matched the LLM supervisor's route.
+        summary(): Returns the count, p50/p95 latencies, routes and accuracy per stage.
+    """
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._latencies = defaultdict(list)
+        self._routes = defaultdict(lambda: defaultdict(int))
+        self._agreements = defaultdict(lambda: [0, 0])
+        self._lock = threading.Lock()
+
+    def record(self, stage, route, latency):
+        with self._lock:
+            self._latencies[stage] = (self._latencies[stage] + [latency])[-self.max_samples:]
+            self._routes[stage][route] += 1
+
+    def record_agreement(self, stage, agreed):
+        with self._lock:
+            self._agreements[stage][0] += int(agreed)
+            self._agreements[stage][1] += 1
+
+    def summary(self):
+        with self._lock:
+            summary = {}
+            for stage, routes in self._routes.items():
+                agreed, checked = self._agreements.get(stage, (0, 0))
+                summary[stage] = {
+                    "count": sum(routes.values()),
+                    "latency_p50": percentile(self._latencies[stage], 50),
+                    "latency_p95": percentile(self._latencies[stage], 95),
+                    "routes": dict(routes),
+                    "checked": checked,
+                    "accuracy": agreed / checked if checked else None,
+                }
+            return summary
+
+
+# Instantiate the routing statistics shared by all sessions
+routing_stats = RoutingStats()
+
+
+class EmbeddingRouter:
+    """
+    EmbeddingRouter class.
+
+    This class routes a message to the agent of the most similar labelled example, when its cosine similarity is at
+    least `threshold` and beats the best example of any other agent by `margin`. The examples are embedded once, on
+    first use.
+
+    Attributes:
+        embedding_model (object): The embedding model used to embed the examples and the messages.
+        examples (dict): The labelled examples, as lists of messages per agent.
+        threshold (float): The minimum similarity of a confident route.
+        margin (float): The minimum similarity gap between the best and the second best agent.
+
+    Methods:
+        classify(text): Returns the agent the message is routed to, or None when the router is not confident.
+        aclassify(text): Asynchronous version of classify.
+    """
+    def __init__(self, embedding_model, examples=None, threshold=0.5, margin=0.05):
+        self.embedding_model = embedding_model
+        self.examples = examples or ROUTING_EXAMPLES
+        self.threshold = threshold
+        self.margin = margin
+        self._labels = [agent for agent, texts in self.examples.items() for _ in texts]
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _example_texts(self):
+        return [text for texts in self.examples.values() for text in texts]
+
+    def classify(self, text):
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = self._normalize(self.embedding_model.embed_documents(self._example_texts()))
+        return self._decide(self.embedding_model.embed_query(text))
+
+    async def aclassify(self, text):
+        if self._matrix is None:
+            matrix = self._normalize(await self.embedding_model.aembed_documents(self._example_texts()))
+            with self._lock:
+                if self._matrix is None:
+                    self._matrix = matrix
+        return self._decide(await self.embedding_model.aembed_query(text))
+
+    def _decide(self, embedding):
+        similarities = self._matrix @ self._normalize(embedding)
+        best = {}
+        for label, similarity in zip(self._labels, similarities):
+            best[label] = max(best.get(label, -1.0), float(similarity))
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        agent, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+        if score >= self.threshold and score - runner_up >= self.margin:
+            return agent
+        return None
+
+
+class SupervisorRouter:
+    """
+    SupervisorRouter class.
+
+    This class decides the next node of the tutor graph in stages, from the cheapest to the most expensive:
+    the turn is finished without any call once an agent has produced its answer; otherwise the keyword rules, then
+    (in the `embeddings` mode) the embedding router, route the message when they are confident; only ambiguous
+    messages reach the LLM supervisor. Every decision is recorded in `routing_stats`.
+
+    Attributes:
+        supervisor (Runnable): The LLM supervisor, returning `{"next": <route>}`.
+        mode (str): One of `ROUTER_MODES`; `llm` always asks the LLM supervisor.
+        embedding_router (EmbeddingRouter): The embedding router used in the `embeddings` mode.
+        shadow_rate (float): The share of fast routes also sent to the LLM supervisor to measure their accuracy.
+
+    Methods:
+        route(state, config): Returns the next route of the graph.
+        aroute(state, config): Asynchronous version of route.
+        as_runnable(): Returns the router as a graph node, natively sync and async.
+    """
+    def __init__(self, supervisor, mode=ROUTER_MODE, embedding_router=None, shadow_rate=ROUTER_SHADOW_RATE):
+        if mode not in ROUTER_MODES:
+            raise ValueError(f"Unknown router mode {mode!r}, expected one of {ROUTER_MODES}")
+        self.supervisor = supervisor
+        self.mode = mode
+        self.embedding_router = embedding_router
+        self.shadow_rate = shadow_rate
+        self._shadow_tasks = set()
+
+    @staticmethod
+    def _is_done(state):
+        return state.get("quiz_created") or state.get("question_answered") or state.get("flashcards_created")
+
+    def route(self, state, config=None):
+        started = time.perf_counter()
+        if self._is_done(state):
+            return self._decided(DONE_STAGE, "FINISH", started)
+
+        text = last_user_message(state)
+        if self.mode != "llm":
+            route = classify_by_rules(text)
+            if route:
+                self._shadow(state, RULES_STAGE, route)
+                return self._decided(RULES_STAGE, route, started)
+        if self.mode == "embeddings" and self.embedding_router is not None:
+            route = self.embedding_router.classify(text)
+            if route:
+                self._shadow(state, EMBEDDINGS_STAGE, route)
+                return self._decided(EMBEDDINGS_STAGE, route, started)
+
+        route = self.supervisor.invoke(state, config)["next"]
+        return self._decided(LLM_STAGE, route, started)
+
+    async def aroute(self, state, config=None):
+        started = time.perf_counter()
+        if self._is_done(state):
+            return self._decided(DONE_STAGE, "FINISH", started)
+
+        text = last_user_message(state)
+        if self.mode != "llm":
+            route = classify_by_rules(text)
+            if route:
+                self._ashadow(state, RULES_STAGE, route)
+                return self._decided(RULES_STAGE, route, started)
+        if self.mode == "embeddings" and self.embedding_router is not None:
+            route = await self.embedding_router.aclassify(text)
+            if route:
+                self._ashadow(state, EMBEDDINGS_STAGE, route)
+                return self._decided(EMBEDDINGS_STAGE, route, started)
+
+        route = (await self.supervisor.ainvoke(state, config))["next"]
+        return self._decided(LLM_STAGE, route, started)
+
+    def as_runnable(self):
+        return RunnableLambda(self.route, afunc=self.aroute, name="supervisor")
+
+    @staticmethod
+    def _decided(stage, route, started):
+        latency = time.perf_counter() - started
+        routing_stats.record(stage, route, latency)
+        tracer.record(f"route.{stage}", latency, route=route)
+        logger.info("Routed to %s by the %s stage in %.1fms", route, stage, latency * 1000)
+        return {"next": route}
+
+    def _should_shadow(self):
+        return self.shadow_rate > 0 and random.random() < self.shadow_rate
+
+    def _shadow(self, state, stage, route):
+        # Compare a fast route with the LLM supervisor's route, to measure the accuracy of the fast path
+        if self._should_shadow():
+            try:
+                self._record_agreement(stage, route, self.supervisor.invoke(state)["next"])
+            except Exception:
+                logger.exception("Shadow routing failed")
+
+    def _ashadow(self, state, stage, route):
+        # Same as _shadow, without delaying the turn: the LLM supervisor runs in the background
+        if self._should_shadow():
+            task = asyncio.create_task(self._acompare(state, stage, route))
+            self._shadow_tasks.add(task)
+            task.add_done_callback(self._shadow_tasks.discard)
+
+    async def _acompare(self, state, stage, route):
+        try:
+            self._record_agreement(stage, route, (await self.supervisor.ainvoke(state))["next"])
+        except Exception:
+            logger.exception("Shadow routing failed")
+
+    @staticmethod
+    def _record_agreement(stage, route, expected):
+        routing_stats.record_agreement(stage, route == expected)
+        if route != expected:
+            logger.info("Fast route %s disagreed with the LLM supervisor (%s) at the %s stage", route, expected, stage)
@@ -1,4 +1,5 @@
-from typing import List, TypedDict
+import operator
+from typing import Annotated, List, TypedDict
 from langchain_core.messages import BaseMessage
 
 # Define the state for the system
@@ -7,16 +8,18 @@ class TutorState(TypedDict):
     A class representing the state of the tutor system.
 
     Attributes:
-        messages (List[BaseMessage]): A list of messages in the system.
+        messages (List[BaseMessage]): A list of messages in the system. Nodes return only the messages they add, which are appended to it.
         next (str): The next step in the tutor system.
         quiz (List[dict]): A list of quiz questions and answers.
         quiz_created (bool): Indicates if a quiz has been created.
         question_answered (bool): Indicates if a question has been answered.
         flashcards_created (bool): Indicates if flashcards have been created.
+        flashcard_files (List[str]): The paths of the flashcard files exported during the turn.
     """
-    messages: List[BaseMessage]
+    messages: Annotated[List[BaseMessage], operator.add]
     next: str
     quiz: List[dict]
     quiz_created: bool
     question_answered: bool
     flashcards_created: bool
+    flashcard_files: List[str]
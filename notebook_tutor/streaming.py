@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+import chainlit as cl
+from langchain_core.callbacks import AsyncCallbackHandler
+from clients import AGENT_LLM_TAG
+from metrics import percentile
+from prompt_templates import NO_ANSWER_MARKER
+
+# Names of the agents whose answers are streamed
+STREAMED_AGENTS = ("QAAgent", "QuizAgent", "FlashcardsAgent")
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """
+    LatencyStats class.
+
+    This class collects the time to first token and the total latency of every agent answer, measured from the moment
+    the user message is received, and summarizes them per agent.
+
+    Methods:
+        record(agent, ttft, total): Records the latencies of one answer (ttft is None when nothing was streamed).
+        summary(): Returns the count and the p50/p95 latencies, in seconds, per agent.
+    """
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._samples = defaultdict(lambda: {"ttft": [], "total": []})
+        self._lock = threading.Lock()
+
+    def record(self, agent, ttft, total):
+        with self._lock:
+            samples = self._samples[agent]
+            if ttft is not None:
+                samples["ttft"] = (samples["ttft"] + [ttft])[-self.max_samples:]
+            samples["total"] = (samples["total"] + [total])[-self.max_samples:]
+
+    def summary(self):
+        with self._lock:
+            return {
+                agent: {
+                    "count": len(samples["total"]),
+                    "ttft_p50": percentile(samples["ttft"], 50),
+                    "ttft_p95": percentile(samples["ttft"], 95),
+                    "total_p50": percentile(samples["total"], 50),
+                    "total_p95": percentile(samples["total"], 95),
+                }
+                for agent, samples in self._samples.items()
+            }
+
+
+# Instantiate the latency statistics shared by all sessions
+latency_stats = LatencyStats()
+
+
+class TokenStreamHandler(AsyncCallbackHandler):
+    """
+    TokenStreamHandler class.
+
+    This callback handler streams the tokens of the agent LLM calls (tagged with `AGENT_LLM_TAG`) to the browser, one
+    Chainlit message per agent, and records the time to first token and the total latency of each agent answer.
+    Tokens of other LLM calls (the supervisor, the RAG chain behind the retrieval tool) are not streamed, nor is an
+    answer starting with `NO_ANSWER_MARKER`, which the QA agent replaces with its own.
+
+    Attributes:
+        started (float): The time the user message was received.
+        messages (dict): The streamed Chainlit message of each agent.
+
+    Methods:
+        has_streamed(agent): Returns whether the answer of an agent was streamed.
+        finish_agent(agent): Finalizes the streamed message of an agent and records its latencies.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.messages: Dict[str, cl.Message] = {}
+        self._first_token: Dict[str, float] = {}
+        self._runs: Dict[UUID, str] = {}
+        self._held: Dict[UUID, str] = {}
+
+    async def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        tags = tags or []
+        if AGENT_LLM_TAG not in tags:
+            return
+        agent = next((tag for tag in tags if tag in STREAMED_AGENTS), None)
+        if agent:
+            self._runs[run_id] = agent
+            self._held[run_id] = ""
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        agent = self._runs.get(run_id)
+        if agent is None or not token:
+            return
+        if run_id in self._held:
+            # Hold the first tokens while they may be the no-answer marker, which is dropped with the rest of the answer
+            held = self._held[run_id] + token
+            if held.lstrip().startswith(NO_ANSWER_MARKER):
+                del self._runs[run_id], self._held[run_id]
+                return
+            if NO_ANSWER_MARKER.startswith(held.lstrip()):
+                self._held[run_id] = held
+                return
+            del self._held[run_id]
+            token = held
+        await self._stream(agent, token)
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        agent, held = self._runs.pop(run_id, None), self._held.pop(run_id, None)
+        if agent and held and held.strip() != NO_ANSWER_MARKER:
+            await self._stream(agent, held)
+
+    async def _stream(self, agent, token):
+        if agent not in self.messages:
+            self._first_token[agent] = time.perf_counter() - self.started
+            self.messages[agent] = cl.Message(content="", author=agent)
+        await self.messages[agent].stream_token(token)
+
+    def has_streamed(self, agent):
+        return agent in self.messages
+
+    async def finish_agent(self, agent):
+        total = time.perf_counter() - self.started
+        ttft = self._first_token.get(agent)
+        latency_stats.record(agent, ttft, total)
+        logger.info(
+            "%s answered: time to first token %s, total %.2fs",
+            agent, f"{ttft:.2f}s" if ttft is not None else "n/a", total,
+        )
+
+        message = self.messages.get(agent)
+        if message:
+            await message.send()
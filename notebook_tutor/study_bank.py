@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import random
+import asyncio
+import logging
+import threading
+from langchain_core.output_parsers import JsonOutputParser
+from prompt_templates import PromptTemplates
+from clients import get_chat_model
+from keyword_index import code_tokens
+from retrievers import normalize_question
+from utils import get_token_counter
+
+# Configuration for the precomputed quiz and flashcard bank
+STUDY_BANK = os.environ.get("STUDY_BANK", "false").lower() in ("1", "true", "yes")
+STUDY_BANK_PATH = os.environ.get("STUDY_BANK_PATH", os.path.join(".cache", "study_bank"))
+STUDY_BANK_MODEL = os.environ.get("STUDY_BANK_MODEL", "gpt-4o")
+STUDY_BANK_ITEMS_PER_SECTION = int(os.environ.get("STUDY_BANK_ITEMS_PER_SECTION", "3"))
+STUDY_BANK_MAX_SECTIONS = int(os.environ.get("STUDY_BANK_MAX_SECTIONS", "30"))
+STUDY_BANK_SECTION_MAX_TOKENS = int(os.environ.get("STUDY_BANK_SECTION_MAX_TOKENS", "2000"))
+STUDY_BANK_CONCURRENCY = int(os.environ.get("STUDY_BANK_CONCURRENCY", "4"))
+STUDY_BANK_ATTEMPTS = int(os.environ.get("STUDY_BANK_ATTEMPTS", "3"))  # tries per section before giving up the bank
+STUDY_BANK_VERSION = "v1"
+
+# Number of items served when the request does not ask for a number, and the most served at once
+DEFAULT_SAMPLE_SIZE = {"quiz": 5, "flashcards": 5}
+MAX_SAMPLE_SIZE = 20
+
+# Bank kind served for each agent
+BANK_AGENTS = {"QuizAgent": "quiz", "FlashcardsAgent": "flashcards"}
+
+# Words of a quiz or flashcard request that do not name a topic of the notebook
+REQUEST_WORDS = frozenset(
+    "quiz quizzes test exam flashcard flashcards card cards anki question questions create make generate give build "
+    "prepare write want need please some few more new another other notebook content based whole entire all me us on "
+    "about of the a an for with from to and or my this that it could would can you".split()
+)
+
+logger = logging.getLogger(__name__)
+
+
+def sections_for_bank(documents, max_sections=STUDY_BANK_MAX_SECTIONS, max_tokens=STUDY_BANK_SECTION_MAX_TOKENS,
+                      token_counter=None):
+    """
+    Groups the chunks of a notebook by section heading, in notebook order.
+
+    Parameters:
+        documents (list): The chunks of the notebook, as cut by `NotebookChunker`.
+        max_sections (int): The maximum number of sections returned.
+        max_tokens (int): The token budget of the text of a section; further chunks are left out.
+        token_counter (TokenCounter, optional): The token counter measuring the chunks.
+
+    Returns:
+        list: The (section heading, section text) pairs.
+    """
+    token_counter = token_counter or get_token_counter()
+    sections = {}
+    lengths = token_counter.count_batch([document.page_content for document in documents])
+    for document, tokens in zip(documents, lengths):
+        section = sections.setdefault(document.metadata.get("section") or "Notebook", {"texts": [], "tokens": 0})
+        if section["texts"] and section["tokens"] + tokens > max_tokens:
+            continue
+        section["texts"].append(document.page_content)
+        section["tokens"] += tokens
+    return [(heading, "\n\n".join(section["texts"])) for heading, section in sections.items()][:max_sections]
+
+
+def topic_terms(request):
+    return {term for term in code_tokens(request) if term not in REQUEST_WORDS and not term.isdigit()}
+
+
+def requested_count(request, kind):
+    match = re.search(r"\b(\d{1,2})\b", request)
+    count = int(match.group(1)) if match else DEFAULT_SAMPLE_SIZE[kind]
+    return max(1, min(count, MAX_SAMPLE_SIZE))
+
+
+def format_quiz(items):
+    lines = ["Here is a quiz based on the notebook:", ""]
+    for number, item in enumerate(items, 1):
+        lines.append(f"{number}. {item['question']}")
+        lines.extend(f"   {letter}) {choice}" for letter, choice in zip("abcdefgh", item.get("choices") or []))
+    lines += ["", "Answers:"]
+    lines.extend(f"{number}. {item['answer']}" for number, item in enumerate(items, 1))
+    return "\n".join(lines)
+
+
+def format_flashcards(items):
+    lines = ["Here are your flashcards, exported in files you can import into Anki:", ""]
+    for number, item in enumerate(items, 1):
+        lines += [f"{number}. Front: {item['question']}", f"   Back: {item['answer']}"]
+    return "\n".join(lines)
+
+
+class StudyBank:
+    """
+    StudyBank class.
+
+    This class represents the bank of quiz questions and flashcards pre-generated for each notebook, keyed by the
+    notebook content hash and shared by all sessions. A bank is generated in the background once a notebook is
+    indexed, with one LLM call per section of the notebook, and saved as a JSON file so it survives restarts. Quiz and
+    flashcard requests are then answered by sampling the bank instead of running the agent.
+
+    Attributes:
+        path (str): The directory holding the bank files.
+        model (str): The OpenAI chat model generating the banks.
+        items_per_section (int): The number of quiz questions and of flashcards generated per section.
+        max_concurrency (int): The maximum number of sections generated at once.
+
+    Methods:
+        get(notebook_hash): Returns the bank of a notebook, or None when it is not generated yet.
+        schedule(notebook_hash, documents): Starts generating the bank of a notebook in the background, once.
+        generate(notebook_hash, documents): Generates and saves the bank of a notebook, unless a section keeps failing.
+        sample(notebook_hash, kind, request, exclude): Returns items of a bank matching a request.
+    """
+    def __init__(self, path=STUDY_BANK_PATH, model=STUDY_BANK_MODEL, items_per_section=STUDY_BANK_ITEMS_PER_SECTION,
+                 max_concurrency=STUDY_BANK_CONCURRENCY):
+        self.path = path
+        self.model = model
+        self.items_per_section = items_per_section
+        self.max_concurrency = max_concurrency
+        self._banks = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _file(self, notebook_hash):
+        return os.path.join(self.path, f"{notebook_hash}.{STUDY_BANK_VERSION}.json")
+
+    def get(self, notebook_hash):
+        with self._lock:
+            if notebook_hash in self._banks:
+                return self._banks[notebook_hash]
+        try:
+            with open(self._file(notebook_hash), encoding="utf-8") as f:
+                bank = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        with self._lock:
+            self._banks[notebook_hash] = bank
+        return bank
+
+    def schedule(self, notebook_hash, documents):
+        """
+        Starts generating the bank of a notebook in the background, unless it exists or is being generated.
+
+        Returns:
+            asyncio.Task: The generation task, or None when there is nothing to generate.
+        """
+        if self.get(notebook_hash) is not None:
+            return None
+        with self._lock:
+            task = self._tasks.get(notebook_hash)
+            if task is None:
+                task = asyncio.create_task(self.generate(notebook_hash, documents))
+                self._tasks[notebook_hash] = task
+                task.add_done_callback(lambda _: self._tasks.pop(notebook_hash, None))
+        return task
+
+    def _create_chain(self):
+        return PromptTemplates().get_study_bank_prompt() | get_chat_model(self.model, temperature=0.3) | JsonOutputParser()
+
+    async def generate(self, notebook_hash, documents):
+        """
+        Generates the bank of a notebook, one call per section, and saves it.
+
+        Sections whose call fails or returns something else than a JSON object are retried, up to
+        `STUDY_BANK_ATTEMPTS` tries. A bank missing sections is not saved, so the next upload of the notebook
+        schedules its generation again instead of keeping a partial bank.
+
+        Returns:
+            dict: The generated bank, or None when a section could not be generated.
+        """
+        sections = await asyncio.to_thread(sections_for_bank, documents)
+        inputs = [{"section": heading, "content": text, "count": self.items_per_section} for heading, text in sections]
+        chain = self._create_chain()
+        results = {}
+        pending = list(range(len(sections)))
+        for _ in range(STUDY_BANK_ATTEMPTS):
+            if not pending:
+                break
+            outputs = await chain.abatch(
+                [inputs[i] for i in pending], config={"max_concurrency": self.max_concurrency}, return_exceptions=True
+            )
+            failed = []
+            for i, result in zip(pending, outputs):
+                if isinstance(result, dict):
+                    results[i] = result
+                else:
+                    logger.warning("Study bank generation failed for section %r: %s", sections[i][0], result)
+                    failed.append(i)
+            pending = failed
+        if pending:
+            logger.warning(
+                "Study bank of notebook %s not saved: %d of %d sections failed",
+                notebook_hash[:12], len(pending), len(sections),
+            )
+            return None
+
+        bank = {"quiz": [], "flashcards": []}
+        seen = {"quiz": set(), "flashcards": set()}
+        for i, (heading, _) in enumerate(sections):
+            for kind in bank:
+                items = results[i].get(kind)
+                for item in items if isinstance(items, list) else []:
+                    if not isinstance(item, dict):
+                        continue
+                    key = normalize_question(str(item.get("question", "")))
+                    if not key or not item.get("answer") or key in seen[kind]:
+                        continue
+                    seen[kind].add(key)
+                    bank[kind].append({**item, "section": heading})
+
+        await asyncio.to_thread(self._save, notebook_hash, bank)
+        logger.info(
+            "Study bank of notebook %s generated: %d quiz questions, %d flashcards",
+            notebook_hash[:12], len(bank["quiz"]), len(bank["flashcards"]),
+        )
+        return bank
+
+    def _save(self, notebook_hash, bank):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(notebook_hash)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(bank, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._banks[notebook_hash] = bank
+
+    def sample(self, notebook_hash, kind, request, exclude=""):
+        """
+        Returns items of a bank matching a request, without the items already present in the conversation.
+
+        A request naming topics (e.g. "a quiz on pandas merge") is served from the items whose section, question or
+        answer mention one of them; a generic request is served from the whole bank.
+
+        Parameters:
+            notebook_hash (str): The content hash of the notebook.
+            kind (str): "quiz" or "flashcards".
+            request (str): The user request.
+            exclude (str): The text of the conversation so far.
+
+        Returns:
+            list: The sampled items, or None when the bank cannot serve the request (missing, or too few matching
+            items) and the agent must answer instead.
+        """
+        bank = self.get(notebook_hash)
+        if not bank:
+            return None
+        count = requested_count(request, kind)
+        exclude = normalize_question(exclude)
+        terms = topic_terms(request)
+        candidates = [
+            item for item in bank.get(kind, [])
+            if normalize_question(item["question"]) not in exclude
+            and (not terms or terms & set(code_tokens(" ".join(str(item[key]) for key in ("section", "question", "answer")))))
+        ]
+        if len(candidates) < count:
+            return None
+        return random.sample(candidates, count)
+
+
+# Instantiate the study bank shared by all sessions
+study_bank = StudyBank()
@@ -5,10 +5,29 @@ from langchain.callbacks.manager import (
     AsyncCallbackManagerForToolRun,
     CallbackManagerForToolRun,
 )
-import csv
+from contextvars import ContextVar
+from flashcard_export import EXPORTERS
+import asyncio
+import logging
 import uuid
 import os
 
+# Configuration for the flashcard export
+FLASHCARDS_DIR = os.environ.get("FLASHCARDS_DIR", "flashcards")
+FLASHCARDS_FORMATS = [fmt.strip() for fmt in os.environ.get("FLASHCARDS_FORMATS", "csv,apkg").split(",") if fmt.strip()]
+for fmt in FLASHCARDS_FORMATS:
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown flashcards format {fmt!r}, expected one of {tuple(EXPORTERS)}")
+
+logger = logging.getLogger(__name__)
+
+# The retrieval chain of the session whose request is being processed, set by the graph nodes from the graph config
+current_retrieval_chain: ContextVar = ContextVar("current_retrieval_chain", default=None)
+
+# The export directory of the session whose request is being processed, and the list collecting the files it exported
+current_export_dir: ContextVar = ContextVar("current_export_dir", default=None)
+current_exported_files: ContextVar = ContextVar("current_exported_files", default=None)
+
 class FlashcardInput(BaseModel):
     flashcards: list = Field(description="A list of flashcards. Each flashcard should be a dictionary with 'question' and 'answer' keys.")
 
@@ -16,7 +35,10 @@ class FlashcardTool(BaseTool):
     """
     FlashcardTool class.
 
-    This class represents a tool for creating flashcards in a .csv format suitable for import into Anki.
+    This class represents a tool for creating flashcards in the formats of `FLASHCARDS_FORMATS`: a .csv file and an
+    Anki package (.apkg), both suitable for import into Anki. The files are written to the export directory of the
+    current request (`current_export_dir`), and their paths are appended to `current_exported_files`, so the caller
+    gets the exact files without searching for them.
 
     Attributes:
         name (str): The name of the tool.
@@ -31,36 +53,40 @@ class FlashcardTool(BaseTool):
             Use the tool asynchronously.
     """
     name = "create_flashcards"
-    description = "Create flashcards in a .csv format suitable for import into Anki"
+    description = "Create flashcards in .csv and .apkg formats suitable for import into Anki"
     args_schema: Type[BaseModel] = FlashcardInput
 
     def _run(
         self, flashcards: list, run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
         """Use the tool to create flashcards."""
-        filename = f"flashcards_{uuid.uuid4()}.csv"
+        return self._write_flashcards(flashcards)
 
-        save_path = os.path.join('flashcards', filename)
+    async def _arun(
+        self, flashcards: list, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> str:
+        """Use the tool asynchronously."""
+        # The file is written in a worker thread so the event loop is never blocked on disk I/O
+        return await asyncio.to_thread(self._write_flashcards, flashcards)
 
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    def _write_flashcards(self, flashcards: list) -> str:
+        export_dir = current_export_dir.get() or FLASHCARDS_DIR
+        os.makedirs(export_dir, exist_ok=True)
+        base_name = f"flashcards_{uuid.uuid4()}"
 
-        with open(save_path, 'w', newline='') as csvfile:
-            fieldnames = ['Front', 'Back']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        paths = []
+        for fmt in FLASHCARDS_FORMATS:
+            save_path = os.path.join(export_dir, f"{base_name}.{fmt}")
+            EXPORTERS[fmt](flashcards, save_path)
+            paths.append(save_path)
 
-            writer.writeheader()
-            for card in flashcards:
-                writer.writerow({'Front': card['question'], 'Back': card['answer']})
+        exported_files = current_exported_files.get()
+        if exported_files is not None:
+            exported_files.extend(paths)
 
-        print("\033[93m" + f"Flashcards successfully created and saved to {save_path}" + "\033[0m")
+        logger.info("Flashcards successfully created and saved to %s", ", ".join(paths))
 
-        return "csv file created successfully."
-
-    async def _arun(
-        self, flashcards: list, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
-    ) -> str:
-        """Use the tool asynchronously."""
-        raise NotImplementedError("create_flashcards does not support async")
+        return "Flashcard files created successfully."
 
 # Instantiate the tool
 create_flashcards_tool = FlashcardTool()
@@ -70,21 +96,40 @@ class RetrievalChainWrapper:
     RetrievalChainWrapper class.
 
     This class wraps a retrieval chain and provides a method to retrieve information using the wrapped chain.
+    When no chain is given, the chain bound to the current request (`current_retrieval_chain`) is used, so one tool
+    instance can serve every session.
 
     Attributes:
-        retrieval_chain: The retrieval chain to be wrapped.
+        retrieval_chain: The retrieval chain to be wrapped, or None to use the chain of the current request.
 
     Methods:
         retrieve_information(query: str) -> str:
             Use this tool to retrieve information about the provided notebook.
+
+        aretrieve_information(query: str) -> str:
+            Use this tool asynchronously.
     """
-    def __init__(self, retrieval_chain):
+    def __init__(self, retrieval_chain=None):
         self.retrieval_chain = retrieval_chain
 
+    def _get_retrieval_chain(self):
+        retrieval_chain = self.retrieval_chain or current_retrieval_chain.get()
+        if retrieval_chain is None:
+            raise ValueError("No retrieval chain bound to the current request.")
+        return retrieval_chain
+
     def retrieve_information(
         self,
         query: Annotated[str, "query to ask the RAG tool"]
     ):
         """Use this tool to retrieve information about the provided notebook."""
-        response = self.retrieval_chain.invoke({"question": query})
+        response = self._get_retrieval_chain().invoke({"question": query})
+        return response["response"].content
+
+    async def aretrieve_information(
+        self,
+        query: Annotated[str, "query to ask the RAG tool"]
+    ):
+        """Use this tool to retrieve information about the provided notebook."""
+        response = await self._get_retrieval_chain().ainvoke({"question": query})
         return response["response"].content
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+from utils import get_token_counter
+
+# Configuration for the tracing of the pipeline stages
+TRACING = os.environ.get("TRACING", "false").lower() in ("1", "true", "yes")
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "jsonl")  # "jsonl", or "otel" (needs opentelemetry-sdk)
+TRACE_PATH = os.environ.get("TRACE_PATH", os.path.join(".cache", "traces.jsonl"))
+TRACE_EXPORTERS = ("jsonl", "otel")
+
+# Estimated price per million tokens (input, output), in USD
+MODEL_PRICES = {
+    "gpt-4o": (5.0, 15.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+
+# Named runnables recorded as stages of a turn
+TRACED_CHAINS = ("supervisor", "QAAgent", "QuizAgent", "FlashcardsAgent", "rag_chain", "qa_chain", "standalone_question", "compress_context")
+
+# The trace of the request being processed, set by `Tracer.start_trace`
+current_trace: ContextVar = ContextVar("current_trace", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_cost(model, input_tokens, output_tokens=0):
+    """
+    Returns the estimated cost of a model call in USD, or None for a model without a known price.
+    """
+    for name, (input_price, output_price) in MODEL_PRICES.items():
+        if model and model.startswith(name):
+            return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+    return None
+
+
+class _NoopSpan:
+    # Returned by `span` when tracing is disabled, so instrumented code costs one function call
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    A timed stage of a trace, used as a context manager. Attributes (e.g. token counts) can be added with `set`.
+    """
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.trace.add(self.name, "span", self.started, time.time() - self.started, **self.attributes)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    TraceCallbackHandler class.
+
+    This callback handler records the LLM calls, retriever searches, tool calls and named stages (`TRACED_CHAINS`)
+    of a LangChain run as spans of a `Trace`. LLM spans carry the model, the input and output token counts (from the
+    API usage, or counted with tiktoken for streamed calls) and the estimated cost, and every span is labelled with
+    the named stage it ran in.
+    """
+    run_inline = True
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, parent_run_id, kind, name, **attributes):
+        with self._lock:
+            parent = self._runs.get(parent_run_id)
+            stage = parent["stage"] if parent else None
+            # LangGraph wraps each node in a runnable of the same name, recorded once
+            recorded = kind != "chain" or (name in TRACED_CHAINS and name != stage)
+            self._runs[run_id] = {
+                "kind": kind, "name": name, "started": time.time(), "recorded": recorded,
+                "stage": name if recorded and kind == "chain" else stage,
+                "attributes": attributes,
+            }
+
+    def _end(self, run_id, **attributes):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None or not run["recorded"]:
+            return
+        self.trace.add(
+            run["name"], run["kind"], run["started"], time.time() - run["started"],
+            stage=run["stage"], **run["attributes"], **attributes,
+        )
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "chain", kwargs.get("name") or (serialized or {}).get("id", ["chain"])[-1])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or "unknown"
+        texts = [str(message.content) + json.dumps(message.additional_kwargs) for batch in messages for message in batch]
+        input_tokens = sum(get_token_counter().count_batch(texts))
+        self._start(run_id, parent_run_id, "llm", f"llm:{model}", model=model, input_tokens=input_tokens)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        with self._lock:
+            run = self._runs.get(run_id)
+        if run is None:
+            return
+        if usage.get("prompt_tokens"):
+            run["attributes"]["input_tokens"] = usage["prompt_tokens"]
+        output_tokens = usage.get("completion_tokens")
+        if not output_tokens:
+            texts = []
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    texts.append(generation.text + (json.dumps(message.additional_kwargs) if message else ""))
+            output_tokens = sum(get_token_counter().count_batch(texts))
+        attributes = run["attributes"]
+        cost = estimate_cost(attributes["model"], attributes["input_tokens"], output_tokens)
+        self._end(run_id, output_tokens=output_tokens, cost=cost)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("id", ["retriever"])[-1]
+        self._start(run_id, parent_run_id, "retriever", name)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "tool", (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+
+class Trace:
+    """
+    Trace class.
+
+    This class collects the spans of one request (an upload or a chat turn): stages timed with `span`, durations
+    recorded with `record`, and the LangChain runs seen by its `callback_handler`.
+
+    Attributes:
+        trace_id (str): The identifier of the trace.
+        name (str): The kind of request, e.g. "turn" or "upload".
+        attributes (dict): The attributes of the request, e.g. the session id.
+        spans (list): The recorded spans.
+
+    Methods:
+        add(name, kind, started, duration, **attributes): Records a span.
+        callback_handler(): Returns a callback handler recording the LangChain runs of the request.
+        summary(): Returns the total duration, tokens and cost, and the duration, tokens and cost per span name.
+        finish(error=None): Exports the spans and logs the summary, recording the error that failed the request.
+    """
+    def __init__(self, tracer, name, **attributes):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def add(self, name, kind, started, duration, **attributes):
+        with self._lock:
+            self.spans.append({"name": name, "kind": kind, "started": started, "duration": duration, **attributes})
+
+    def callback_handler(self):
+        return TraceCallbackHandler(self)
+
+    def summary(self):
+        stages = {}
+        for span in self.spans:
+            stage = stages.setdefault(span["name"], {"count": 0, "duration": 0.0, "tokens": 0, "cost": 0.0})
+            stage["count"] += 1
+            stage["duration"] += span["duration"]
+        # Tokens and cost are counted on the model calls, and on the named stage they ran in
+        tokens = cost = 0
+        for span in self.spans:
+            span_tokens, span_cost = span.get("input_tokens", 0) + span.get("output_tokens", 0), span.get("cost") or 0.0
+            tokens, cost = tokens + span_tokens, cost + span_cost
+            for name in {span["name"], span.get("stage")} - {None}:
+                if name in stages:
+                    stages[name]["tokens"] += span_tokens
+                    stages[name]["cost"] += span_cost
+        return {"duration": time.time() - self.started, "tokens": tokens, "cost": cost, "stages": stages}
+
+    def finish(self, error=None):
+        """
+        Exports the spans of the trace and logs its summary.
+
+        Parameters:
+            error (BaseException, optional): The exception that failed the request, recorded as the `error` attribute.
+
+        Returns:
+            dict: The summary of the trace.
+        """
+        if self._token is not None:
+            current_trace.reset(self._token)
+            self._token = None
+        if error is not None:
+            self.attributes["error"] = type(error).__name__
+        summary = self.summary()
+        self.tracer.export(self, summary)
+        lines = [
+            f"{self.name} {self.trace_id[:8]}: {summary['duration']:.2f}s, {summary['tokens']} tokens, "
+            f"${summary['cost']:.4f}" + (f", failed with {type(error).__name__}: {error}" if error is not None else "")
+        ]
+        for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["duration"]):
+            lines.append(
+                f"  {name:<32} x{stage['count']:<3} {stage['duration']:7.3f}s {stage['tokens']:7d} tokens "
+                f"${stage['cost']:.4f}"
+            )
+        logger.info("\n".join(lines))
+        return summary
+
+
+class Tracer:
+    """
+    Tracer class.
+
+    This class creates the traces of the requests and exports their spans, one JSON line per span to `path` or as
+    OpenTelemetry spans (exported by the OpenTelemetry SDK configured in the process). When it is disabled, no trace is
+    created, `span` returns a shared no-op span and no callback is added to the runs, so the instrumentation costs
+    nothing measurable.
+
+    Attributes:
+        enabled (bool): Whether traces are recorded.
+        exporter (str): "jsonl" or "otel".
+        path (str): The JSONL file the spans are appended to.
+
+    Methods:
+        start_trace(name, **attributes): Starts the trace of a request and makes it current, or returns None when disabled.
+        trace(name, **attributes): Context manager starting a trace and finishing it on exit, failed or not.
+        span(name, **attributes): Returns a context manager timing a stage of the current trace.
+        record(name, duration, started=None, **attributes): Records an already measured stage in the current trace.
+        embedding_usage(model, texts, misses): Estimates the tokens and cost of an embedding request.
+        export(trace, summary): Exports the spans of a finished trace.
+    """
+    def __init__(self, enabled=TRACING, exporter=TRACE_EXPORTER, path=TRACE_PATH):
+        if exporter not in TRACE_EXPORTERS:
+            raise ValueError(f"Unknown trace exporter {exporter!r}, expected one of {TRACE_EXPORTERS}")
+        self.enabled = enabled
+        self.exporter = exporter
+        self.path = path
+        self._otel_tracer = None
+        self._lock = threading.Lock()
+
+    def start_trace(self, name, **attributes):
+        if not self.enabled:
+            return None
+        trace = Trace(self, name, **attributes)
+        trace._token = current_trace.set(trace)
+        return trace
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        trace = self.start_trace(name, **attributes)
+        try:
+            yield trace
+        except BaseException as e:
+            if trace:
+                trace.finish(error=e)
+            raise
+        if trace:
+            trace.finish()
+
+    def span(self, name, **attributes):
+        trace = current_trace.get() if self.enabled else None
+        if trace is None:
+            return _NOOP_SPAN
+        return Span(trace, name, attributes)
+
+    def record(self, name, duration, started=None, **attributes):
+        trace = current_trace.get() if self.enabled else None
+        if trace is not None:
+            trace.add(name, "span", started or time.time() - duration, duration, **attributes)
+
+    def embedding_usage(self, model, texts, misses):
+        """
+        Estimates the tokens and cost of embedding texts of which `misses` were not found in the embedding cache.
+
+        Returns:
+            dict: The span attributes, empty when tracing is disabled.
+        """
+        if not self.enabled or not texts:
+            return {}
+        tokens = sum(get_token_counter().count_batch(texts))
+        billed = round(tokens * min(misses, len(texts)) / len(texts))
+        return {"model": model, "input_tokens": billed, "cost": estimate_cost(model, billed)}
+
+    def export(self, trace, summary):
+        try:
+            if self.exporter == "otel":
+                self._export_otel(trace)
+            else:
+                self._export_jsonl(trace, summary)
+        except Exception as e:
+            logger.warning("Could not export trace %s: %s", trace.trace_id, e)
+
+    def _export_jsonl(self, trace, summary):
+        common = {"trace_id": trace.trace_id, "trace": trace.name, **trace.attributes}
+        lines = [json.dumps({**common, **span}, default=str) for span in trace.spans]
+        lines.append(json.dumps({
+            **common, "name": trace.name, "kind": "trace", "started": trace.started, "duration": summary["duration"],
+            "tokens": summary["tokens"], "cost": summary["cost"],
+        }, default=str))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _export_otel(self, trace):
+        from opentelemetry import trace as otel_trace
+
+        if self._otel_tracer is None:
+            self._otel_tracer = otel_trace.get_tracer("notebook_tutor")
+        root = self._otel_tracer.start_span(trace.name, start_time=int(trace.started * 1e9), attributes={
+            key: str(value) for key, value in trace.attributes.items()
+        })
+        context = otel_trace.set_span_in_context(root)
+        for span in trace.spans:
+            attributes = {
+                key: value if isinstance(value, (str, bool, int, float)) else str(value)
+                for key, value in span.items()
+                if key not in ("name", "started", "duration") and value is not None
+            }
+            child = self._otel_tracer.start_span(
+                span["name"], context=context, start_time=int(span["started"] * 1e9), attributes=attributes
+            )
+            child.end(end_time=int((span["started"] + span["duration"]) * 1e9))
+        root.end()
+
+
+# Instantiate the tracer shared by all sessions
+tracer = Tracer()
+span = tracer.span
@@ -1,5 +1,141 @@
+import os
+import re
+import functools
+import threading
+from collections import OrderedDict
 import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Configuration for token counting
+TOKEN_COUNT_MODEL = "gpt-3.5-turbo"
+TOKEN_LENGTH_CACHE_SIZE = int(os.environ.get("TOKEN_LENGTH_CACHE_SIZE", "8192"))
+TOKEN_COUNT_THREADS = int(os.environ.get("TOKEN_COUNT_THREADS", "4"))
+
+
+class TokenCounter:
+    """
+    TokenCounter class.
+
+    This class counts tokens with a tiktoken encoding looked up once, keeps the lengths of recently counted strings
+    in an LRU cache, and counts lists of strings in one `encode_batch` call, which tiktoken runs on several threads.
+
+    Attributes:
+        encoding (tiktoken.Encoding): The encoding of the model.
+        cache_size (int): The maximum number of string lengths kept.
+        hits (int): The number of lengths served from the cache.
+        misses (int): The number of strings encoded.
+
+    Methods:
+        count(text): Returns the number of tokens of a string.
+        count_batch(texts): Returns the number of tokens of each string of a list.
+        stats(): Returns the number of cached lengths and the hit rate.
+    """
+    def __init__(self, model=TOKEN_COUNT_MODEL, cache_size=TOKEN_LENGTH_CACHE_SIZE, num_threads=TOKEN_COUNT_THREADS):
+        self.encoding = tiktoken.encoding_for_model(model)
+        self.cache_size = cache_size
+        self.num_threads = num_threads
+        self.hits = 0
+        self.misses = 0
+        self._lengths = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        with self._lock:
+            length = self._lengths.get(text)
+            if length is not None:
+                self._lengths.move_to_end(text)
+                self.hits += 1
+                return length
+        length = len(self.encoding.encode(text, disallowed_special=()))
+        with self._lock:
+            self.misses += 1
+            self._store(text, length)
+        return length
+
+    def count_batch(self, texts):
+        lengths = {}
+        with self._lock:
+            for text in texts:
+                length = self._lengths.get(text)
+                if length is not None:
+                    self._lengths.move_to_end(text)
+                    lengths[text] = length
+            self.hits += sum(1 for text in texts if text in lengths)
+        missing = list(dict.fromkeys(text for text in texts if text not in lengths))
+        if missing:
+            encoded = self.encoding.encode_batch(missing, num_threads=self.num_threads, disallowed_special=())
+            with self._lock:
+                for text, tokens in zip(missing, encoded):
+                    lengths[text] = len(tokens)
+                    self._store(text, len(tokens))
+                self.misses += len(missing)
+        return [lengths[text] for text in texts]
+
+    def _store(self, text, length):
+        self._lengths[text] = length
+        self._lengths.move_to_end(text)
+        while len(self._lengths) > self.cache_size:
+            self._lengths.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._lengths),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+# Return the token counter of a model shared by the process, creating it on first use
+@functools.lru_cache(maxsize=None)
+def get_token_counter(model=TOKEN_COUNT_MODEL):
+    return TokenCounter(model)
+
 
 def tiktoken_len(text):
-    tokens = tiktoken.encoding_for_model("gpt-3.5-turbo").encode(text)
-    return len(tokens)
+    return get_token_counter().count(text)
+
+
+class TokenTextSplitter(RecursiveCharacterTextSplitter):
+    """
+    TokenTextSplitter class.
+
+    A RecursiveCharacterTextSplitter measuring chunks in tokens with the shared `TokenCounter`. At each level of the
+    recursion, the candidate splits are counted in one batch before the splitter measures them one by one, so these
+    lookups, and the repeated ones made while merging the splits into chunks, are served from the length cache.
+
+    Attributes:
+        token_counter (TokenCounter): The token counter used as length function.
+    """
+    def __init__(self, token_counter=None, **kwargs):
+        self.token_counter = token_counter or get_token_counter()
+        super().__init__(length_function=self.token_counter.count, **kwargs)
+
+    def _split_text(self, text, separators):
+        self.token_counter.count_batch(self._candidate_splits(text, separators))
+        return super()._split_text(text, separators)
+
+    def _candidate_splits(self, text, separators):
+        # Same separator choice as RecursiveCharacterTextSplitter._split_text
+        separator = separators[-1]
+        for candidate in separators:
+            pattern = candidate if self._is_separator_regex else re.escape(candidate)
+            if candidate == "":
+                separator = candidate
+                break
+            if re.search(pattern, text):
+                separator = candidate
+                break
+        pattern = separator if self._is_separator_regex else re.escape(separator)
+        if not pattern:
+            # Splitting into characters: their lengths are counted on demand
+            return []
+        if self._keep_separator:
+            # Each separator is kept at the start of the split that follows it
+            parts = re.split(f"({pattern})", text)
+            splits = [parts[0]] + [parts[i] + parts[i + 1] for i in range(1, len(parts) - 1, 2)]
+        else:
+            splits = re.split(pattern, text)
+        return [split for split in splits if split]
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, block_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's content, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CollectionRegistry:
+    """
+    CollectionRegistry class.
+
+    This class represents the process-wide registry of notebook collections. Every notebook is indexed once into a
+    Qdrant collection named after its content hash, stored on local disk (or on a Qdrant server when `url` is given)
+    so that it is shared by all chat sessions and survives process restarts. Sessions reference-count the collections
+    they use, and collections that have not been used for `ttl_seconds` are deleted.
+
+    A local-path Qdrant store can only be opened by one process at a time; deployments running several worker
+    processes should point `url` at a Qdrant server instead.
+
+    Attributes:
+        path (str): The directory holding the local Qdrant storage and the registry manifest.
+        ttl_seconds (float): How long an unreferenced collection is kept before it is deleted.
+        client (QdrantClient): The Qdrant client shared by all sessions.
+        change_callbacks (list): Functions called with a collection name whenever that collection is (re)created or
+            deleted, e.g. to invalidate caches derived from its content.
+
+    Methods:
+        collection_name(index_key): Returns the collection name for an index key.
+        lock(name): Returns the lock serializing the indexing of a collection.
+        is_ready(name): Returns whether a collection is fully indexed.
+        create_collection(name, vector_size): (Re)creates an empty collection.
+        upsert(name, documents, vectors): Adds documents and their vectors to a collection.
+        mark_ready(name, **info): Records a collection as fully indexed.
+        find_base(cell_hashes, index_version, min_overlap): Returns the indexed collection sharing the most cells.
+        cell_hashes(name): Returns the cell hashes indexed in a collection.
+        vector_size(name): Returns the vector size of a collection.
+        copy_points(source, target, cell_hashes, metadata_updates): Copies the points of some chunks to another collection.
+        acquire(name): Increments the reference count of a collection.
+        release(name): Decrements the reference count of a collection.
+        expire_unused(): Deletes the collections unused for longer than `ttl_seconds`.
+    """
+    def __init__(self, path, url=None, ttl_seconds=24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(path, exist_ok=True)
+        self.client = QdrantClient(url=url) if url else QdrantClient(path=os.path.join(path, "qdrant"))
+
+        self._lock = threading.Lock()
+        self._collection_locks = {}
+        self._refs = {}
+        self.change_callbacks = []
+        self._manifest_path = os.path.join(path, "manifest.json")
+        self._manifest = self._read_manifest()
+
+        # Collections left by a previous process start their expiry clock now
+        started = time.time()
+        for info in self._manifest.values():
+            info["last_used"] = max(info.get("last_used", 0), started)
+
+    def _read_manifest(self):
+        if not os.path.exists(self._manifest_path):
+            return {}
+        with open(self._manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    @staticmethod
+    def collection_name(index_key):
+        return f"notebook_{index_key[:32]}"
+
+    def lock(self, name):
+        with self._lock:
+            return self._collection_locks.setdefault(name, threading.Lock())
+
+    def is_ready(self, name):
+        with self._lock:
+            ready = self._manifest.get(name, {}).get("ready", False)
+        return ready and self.client.collection_exists(name)
+
+    def _notify_change(self, name):
+        for callback in self.change_callbacks:
+            callback(name)
+
+    def create_collection(self, name, vector_size):
+        self.client.recreate_collection(
+            collection_name=name,
+            vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.COSINE),
+        )
+        self._notify_change(name)
+
+    def upsert(self, name, documents, vectors):
+        """
+        Adds documents and their vectors to a collection, using the payload layout of LangChain's `Qdrant` store.
+
+        Parameters:
+            name (str): The collection name.
+            documents (list): The documents to add.
+            vectors (list): The embedding of each document.
+        """
+        points = [
+            models.PointStruct(
+                id=uuid.uuid4().hex,
+                vector=vector,
+                payload={"page_content": doc.page_content, "metadata": doc.metadata},
+            )
+            for doc, vector in zip(documents, vectors)
+        ]
+        self.client.upsert(collection_name=name, points=points)
+
+    def mark_ready(self, name, **info):
+        with self._lock:
+            self._manifest[name] = {**info, "ready": True, "last_used": time.time()}
+            self._write_manifest()
+
+    def find_base(self, cell_hashes, index_version, min_overlap=0.5):
+        """
+        Returns the ready collection sharing the most cells with a notebook, to index it incrementally.
+
+        Parameters:
+            cell_hashes (list): The cell hashes of the notebook to index.
+            index_version (str): The index version the collection must have been built with.
+            min_overlap (float): The minimum share of the notebook cells the collection must contain.
+
+        Returns:
+            str: The name of the collection, or None if no collection shares enough cells.
+        """
+        wanted = set(cell_hashes)
+        if not wanted:
+            return None
+
+        best_name, best_overlap = None, 0
+        with self._lock:
+            candidates = [
+                (name, info.get("cell_hashes", [])) for name, info in self._manifest.items()
+                if info.get("ready") and info.get("index_version") == index_version
+            ]
+        for name, hashes in candidates:
+            overlap = len(wanted & set(hashes))
+            if overlap > best_overlap:
+                best_name, best_overlap = name, overlap
+
+        if best_name is None or best_overlap / len(wanted) < min_overlap:
+            return None
+        if not self.client.collection_exists(best_name):
+            return None
+        return best_name
+
+    def cell_hashes(self, name):
+        with self._lock:
+            return list(self._manifest.get(name, {}).get("cell_hashes", []))
+
+    def vector_size(self, name):
+        return self.client.get_collection(name).config.params.vectors.size
+
+    def copy_points(self, source, target, cell_hashes, metadata_updates, batch_size=256):
+        """
+        Copies the points of the given chunks, with their vectors, from one collection to another.
+
+        Parameters:
+            source (str): The collection to copy from.
+            target (str): The collection to copy to.
+            cell_hashes (set): The hashes of the chunks whose points are copied.
+            metadata_updates (dict): The metadata to update (e.g. the cell indexes) for each chunk hash in the target
+                collection.
+            batch_size (int): The number of points read and written per request.
+
+        Returns:
+            int: The number of copied points.
+        """
+        if not cell_hashes:
+            return 0
+
+        scroll_filter = models.Filter(
+            must=[models.FieldCondition(key="metadata.cell_hash", match=models.MatchAny(any=list(cell_hashes)))]
+        )
+        copied = 0
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=source,
+                scroll_filter=scroll_filter,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            points = []
+            for record in records:
+                payload = dict(record.payload)
+                metadata = dict(payload.get("metadata") or {})
+                metadata.update(metadata_updates.get(metadata.get("cell_hash"), {}))
+                payload["metadata"] = metadata
+                points.append(models.PointStruct(id=uuid.uuid4().hex, vector=record.vector, payload=payload))
+            if points:
+                self.client.upsert(collection_name=target, points=points)
+                copied += len(points)
+            if offset is None:
+                return copied
+
+    def acquire(self, name):
+        with self._lock:
+            self._refs[name] = self._refs.get(name, 0) + 1
+            if name in self._manifest:
+                self._manifest[name]["last_used"] = time.time()
+        self.expire_unused()
+
+    def release(self, name):
+        with self._lock:
+            self._refs[name] = max(self._refs.get(name, 0) - 1, 0)
+            if name in self._manifest:
+                self._manifest[name]["last_used"] = time.time()
+                self._write_manifest()
+        self.expire_unused()
+
+    def expire_unused(self):
+        """
+        Deletes the collections that no session references and that have not been used for `ttl_seconds`.
+        """
+        now = time.time()
+        with self._lock:
+            expired = [
+                name for name, info in self._manifest.items()
+                if not self._refs.get(name) and now - info.get("last_used", 0) > self.ttl_seconds
+            ]
+            for name in expired:
+                del self._manifest[name]
+                self._refs.pop(name, None)
+                self._collection_locks.pop(name, None)
+            if expired:
+                self._write_manifest()
+
+        for name in expired:
+            logger.info("Deleting expired collection %s", name)
+            self.client.delete_collection(name)
+            self._notify_change(name)
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The app modules import each other as top-level modules, the way Chainlit runs them
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "notebook_tutor")]
+
+# The app modules read their configuration when imported: keep the tests away from the real caches and API
+CACHE_DIR = tempfile.mkdtemp(prefix="notebook_tutor_tests_")
+for name, value in {
+    "OPENAI_API_KEY": "sk-test",
+    "EMBEDDING_CACHE_PATH": os.path.join(CACHE_DIR, "embeddings.sqlite3"),
+    "VECTOR_STORE_PATH": os.path.join(CACHE_DIR, "vector_store"),
+    "STUDY_BANK_PATH": os.path.join(CACHE_DIR, "study_bank"),
+    "TRACE_PATH": os.path.join(CACHE_DIR, "traces.jsonl"),
+}.items():
+    os.environ.setdefault(name, value)
+os.environ.pop("QDRANT_URL", None)
+
+
+class WordEncoding:
+    """A tiktoken encoding stand-in with one token per whitespace-separated word, which needs no download."""
+    def encode(self, text, **kwargs):
+        return [hash(word) % 50000 for word in text.split()]
+
+    def encode_batch(self, texts, **kwargs):
+        return [self.encode(text) for text in texts]
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    # Token counts become word counts, and the shared token counter is rebuilt with this encoding
+    import tiktoken
+    from utils import get_token_counter
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: WordEncoding())
+    get_token_counter.cache_clear()
+    yield
+    get_token_counter.cache_clear()
@@ -0,0 +1,75 @@
+import answer_cache as answer_cache_module
+from answer_cache import SemanticAnswerCache
+
+QUESTION = [1.0, 0.0, 0.0]
+# Cosine 0.98 and 0.8 with QUESTION
+PARAPHRASE = [0.98, 0.199, 0.0]
+OTHER_QUESTION = [0.8, 0.6, 0.0]
+
+
+def test_similar_question_is_served_from_the_cache():
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    cache.store("nb1", "What does load_data do?", QUESTION, "It loads the CSV.", ["context"])
+    assert cache.lookup("nb1", PARAPHRASE) == ("It loads the CSV.", ["context"])
+    assert cache.lookup("nb1", OTHER_QUESTION) is None
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_embeddings_are_compared_by_cosine():
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    cache.store("nb1", "q", [2.0, 0.0, 0.0], "answer", [])
+    assert cache.lookup("nb1", [5.0, 1.0, 0.0]) == ("answer", [])
+
+
+def test_notebooks_do_not_share_answers():
+    cache = SemanticAnswerCache()
+    cache.store("nb1", "q", QUESTION, "answer", [])
+    assert cache.lookup("nb2", QUESTION) is None
+
+
+def test_best_match_is_returned():
+    cache = SemanticAnswerCache(similarity_threshold=0.5)
+    cache.store("nb1", "other", OTHER_QUESTION, "other answer", [])
+    cache.store("nb1", "q", QUESTION, "answer", [])
+    assert cache.lookup("nb1", PARAPHRASE)[0] == "answer"
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache_module.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(ttl_seconds=60)
+    cache.store("nb1", "q", QUESTION, "answer", [])
+    now[0] += 59
+    assert cache.lookup("nb1", QUESTION) is not None
+    now[0] += 2
+    assert cache.lookup("nb1", QUESTION) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SemanticAnswerCache(max_entries_per_notebook=2)
+    cache.store("nb1", "x", [1.0, 0.0, 0.0], "x", [])
+    cache.store("nb1", "y", [0.0, 1.0, 0.0], "y", [])
+    assert cache.lookup("nb1", [1.0, 0.0, 0.0]) == ("x", [])
+    cache.store("nb1", "z", [0.0, 0.0, 1.0], "z", [])
+    assert cache.lookup("nb1", [0.0, 1.0, 0.0]) is None
+    assert cache.lookup("nb1", [1.0, 0.0, 0.0]) == ("x", [])
+
+
+def test_invalidate_drops_a_notebook():
+    cache = SemanticAnswerCache()
+    cache.store("nb1", "q", QUESTION, "answer", [])
+    cache.store("nb2", "q", QUESTION, "answer", [])
+    cache.invalidate("nb1")
+    assert cache.lookup("nb1", QUESTION) is None
+    assert cache.lookup("nb2", QUESTION) is not None
+
+
+def test_chains_do_not_share_answers():
+    cache = SemanticAnswerCache()
+    cache.store("nb1", "q", QUESTION, "direct answer", [], chain="qa_chain")
+    assert cache.lookup("nb1", QUESTION, chain="rag_chain") is None
+    assert cache.lookup("nb1", QUESTION, chain="qa_chain") == ("direct answer", [])
+    cache.store("nb1", "q", QUESTION, "rag answer", [], chain="rag_chain")
+    cache.invalidate("nb1")
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,91 @@
+import hashlib
+import pytest
+from chunking import NotebookChunker, code_blocks
+from utils import get_token_counter
+
+FUNCTIONS = "\n\n".join(
+    f"# Step {i} of the pipeline\ndef step_{i}(df):\n    " + " + ".join(["df"] * 8) + f"\n    return df.step_{i}()"
+    for i in range(6)
+)
+
+
+def cell(index, cell_type, source, outputs=()):
+    return {"index": index, "cell_type": cell_type, "source": source, "outputs": list(outputs)}
+
+
+def words(count, word="word"):
+    return " ".join([word] * count)
+
+
+@pytest.fixture
+def chunker(word_tokens):
+    return NotebookChunker(max_tokens=40, min_tokens=10)
+
+
+def test_sections_follow_the_headings(chunker):
+    chunks = chunker.chunk([
+        cell(0, "markdown", "Intro without heading " + words(10)),
+        cell(1, "markdown", "# Loading the data\n" + words(12)),
+        cell(2, "code", "df = pd.read_csv(path)", outputs=["   a  b\n0  1  2"]),
+        cell(3, "markdown", "## Training\n" + words(15)),
+        cell(4, "code", "model.fit(df)  " + words(12, "#")),
+    ], "notebook.ipynb")
+    assert [chunk.metadata["section"] for chunk in chunks] == [None, "Loading the data", "Training"]
+    assert [chunk.metadata["cell_indexes"] for chunk in chunks] == [[0], [1, 2], [3, 4]]
+    assert [chunk.metadata["cell_types"] for chunk in chunks] == [["markdown"], ["markdown", "code"], ["markdown", "code"]]
+    assert chunks[1].metadata["cell_index"] == 1 and chunks[1].metadata["cell_type"] == "markdown"
+    assert chunks[1].page_content.startswith("# Loading the data")
+    assert "```python\ndf = pd.read_csv(path)\n```\nOutput:\n```\n   a  b\n0  1  2\n```" in chunks[1].page_content
+    for chunk in chunks:
+        assert chunk.metadata["source"] == "notebook.ipynb"
+        assert chunk.metadata["cell_hash"] == hashlib.sha256(chunk.page_content.encode()).hexdigest()
+
+
+def test_chunks_stay_within_the_budget(chunker):
+    cells = [cell(0, "markdown", "# Cleaning\n" + words(5))] + [cell(i, "markdown", words(15)) for i in range(1, 8)]
+    chunks = chunker.chunk(cells, "notebook.ipynb")
+    counter = get_token_counter()
+    assert len(chunks) > 1
+    assert all(counter.count(chunk.page_content) <= 40 for chunk in chunks)
+    assert [index for chunk in chunks for index in chunk.metadata["cell_indexes"]] == list(range(8))
+    # Chunks continuing a section repeat its heading
+    assert all(chunk.metadata["section"] == "Cleaning" for chunk in chunks)
+    assert all(chunk.page_content.startswith("# Cleaning (continued)") for chunk in chunks[1:])
+
+
+def test_long_code_cells_are_split_between_functions(chunker):
+    chunks = chunker.chunk([cell(0, "code", FUNCTIONS)], "notebook.ipynb")
+    counter = get_token_counter()
+    assert len(chunks) > 1
+    assert all(counter.count(chunk.page_content) <= 40 for chunk in chunks)
+    assert all(chunk.metadata["cell_indexes"] == [0] for chunk in chunks)
+    text = "\n".join(chunk.page_content for chunk in chunks)
+    for i in range(6):
+        # Each function stays whole, with the comment above it
+        assert f"# Step {i} of the pipeline\ndef step_{i}(df):\n    df + df" in text
+        assert text.count(f"def step_{i}") == 1
+
+
+def test_small_chunks_are_merged(chunker):
+    chunks = chunker.chunk([
+        cell(0, "markdown", "# Imports\n" + words(1)),
+        cell(1, "code", "import numpy as np"),
+        cell(2, "markdown", "# Plotting\n" + words(20)),
+        cell(3, "markdown", "# Conclusion\n" + words(30)),
+    ], "notebook.ipynb")
+    # The 9-token "Imports" section is merged with the next one, "Plotting" (22 tokens) is not
+    assert [chunk.metadata["cell_indexes"] for chunk in chunks] == [[0, 1, 2], [3]]
+    assert [chunk.metadata["section"] for chunk in chunks] == ["Imports", "Conclusion"]
+
+
+def test_small_chunks_are_not_merged_over_the_budget(chunker):
+    chunks = chunker.chunk([
+        cell(0, "markdown", "# Imports\n" + words(2)),
+        cell(1, "markdown", "# Model\n" + words(38)),
+    ], "notebook.ipynb")
+    assert [chunk.metadata["cell_indexes"] for chunk in chunks] == [[0], [1]]
+
+
+def test_code_blocks_without_valid_python():
+    source = "%matplotlib inline\nimport numpy as np\n\ndef f():\n    return 1\n\n!pip install pandas"
+    assert code_blocks(source) == ["%matplotlib inline\nimport numpy as np", "def f():\n    return 1", "!pip install pandas"]
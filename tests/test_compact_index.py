@@ -0,0 +1,135 @@
+import asyncio
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient, models
+from compact_index import QUANTIZATIONS, CompactVectorIndex, CompactVectorStore, filter_from_dict, matches_filter
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic pseudo-random embeddings of 64 dimensions."""
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        rng = np.random.default_rng(sum(text.encode("utf-8")) * 7919 + len(text))
+        return rng.standard_normal(64).tolist()
+
+
+def random_vectors(count, dimension=64, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+
+@pytest.mark.parametrize("quantization", QUANTIZATIONS)
+def test_search_finds_the_query_vector(quantization):
+    vectors = random_vectors(200)
+    index = CompactVectorIndex(vectors, quantization=quantization, rescore_factor=8)
+    for row in (0, 57, 199):
+        (best, score), *_ = index.search(vectors[row], k=3)
+        assert best == row
+        assert score == pytest.approx(1.0, abs=0.02)
+
+
+def test_search_is_restricted_to_the_mask():
+    vectors = random_vectors(50)
+    mask = np.arange(50) % 2 == 1
+    results = CompactVectorIndex(vectors).search(vectors[10], k=5, mask=mask)
+    assert len(results) == 5
+    assert all(row % 2 == 1 for row, _ in results)
+
+
+@pytest.mark.parametrize("quantization", QUANTIZATIONS)
+def test_extend_returns_a_new_index(quantization):
+    vectors = random_vectors(20)
+    index = CompactVectorIndex(vectors[:15], quantization=quantization)
+    extended = index.extend(vectors[15:])
+    assert (index.size, extended.size) == (15, 20)
+    assert extended.search(vectors[18], k=1)[0][0] == 18
+    assert index.search(vectors[18], k=1)[0][0] != 18
+
+
+def test_extend_rejects_another_dimension():
+    with pytest.raises(ValueError):
+        CompactVectorIndex(random_vectors(3)).extend(random_vectors(2, dimension=32))
+
+
+def test_add_texts_appends_to_the_store():
+    embeddings = HashEmbeddings()
+    store = CompactVectorStore.from_texts(["import pandas", "df.head()"], embeddings, metadatas=[{"cell": 0}, {"cell": 1}])
+    ids = store.add_documents([Document(page_content="plt.show()", metadata={"cell": 2})])
+    assert store.ids[-1:] == ids
+    assert store.similarity_search("plt.show()", k=1)[0].metadata == {"cell": 2}
+    assert asyncio.run(store.aadd_texts(["model.fit(x, y)"], [{"cell": 3}]))
+    assert [doc.metadata["cell"] for doc in store.similarity_search("model.fit(x, y)", k=4)][0] == 3
+    assert len(store.documents) == store.index.size == 4
+
+
+def test_add_texts_does_not_change_the_shared_index():
+    embeddings = HashEmbeddings()
+    texts = ["import pandas", "df.head()"]
+    shared = CompactVectorIndex(embeddings.embed_documents(texts))
+    documents = [Document(page_content=text) for text in texts]
+    store = CompactVectorStore(shared, documents, embeddings)
+    store.add_texts(["plt.show()"])
+    other = CompactVectorStore(shared, documents, embeddings)
+    assert shared.size == 2
+    assert len(other.similarity_search("plt.show()", k=4)) == 2
+
+
+def test_search_with_filter():
+    store = CompactVectorStore.from_texts(
+        ["import pandas", "# Loading", "df.head()"], HashEmbeddings(),
+        metadatas=[{"cell_type": "code"}, {"cell_type": "markdown"}, {"cell_type": "code"}],
+    )
+    docs = store.similarity_search("import pandas", k=4, filter={"cell_type": "code"})
+    assert [doc.page_content for doc in docs] == ["import pandas", "df.head()"]
+
+
+METADATAS = [
+    {"cell_type": "code", "cell_indexes": [0, 1], "section": "Loading the data", "tokens": 120},
+    {"cell_type": "markdown", "cell_indexes": [2], "section": "Loading the data", "tokens": 40},
+    {"cell_type": "code", "cell_indexes": [3], "section": "Training", "tokens": 300, "source": {"kind": "output"}},
+    {"cell_type": "code", "cell_indexes": [], "section": None, "tokens": 10},
+]
+
+FILTERS = [
+    models.Filter(must=[models.FieldCondition(key="metadata.cell_type", match=models.MatchValue(value="code"))]),
+    models.Filter(must=[models.FieldCondition(key="metadata.cell_indexes", match=models.MatchValue(value=1))]),
+    models.Filter(must=[models.FieldCondition(key="metadata.cell_indexes", match=models.MatchAny(any=[2, 3]))]),
+    models.Filter(must=[models.FieldCondition(key="metadata.cell_type", match=models.MatchExcept(**{"except": ["code"]}))]),
+    models.Filter(must=[models.FieldCondition(key="metadata.section", match=models.MatchText(text="Loading"))]),
+    models.Filter(must=[models.FieldCondition(key="metadata.tokens", range=models.Range(gte=40, lt=300))]),
+    models.Filter(must=[models.FieldCondition(key="metadata.source.kind", match=models.MatchValue(value="output"))]),
+    models.Filter(must=[models.IsEmptyCondition(is_empty=models.PayloadField(key="metadata.cell_indexes"))]),
+    models.Filter(must=[models.IsNullCondition(is_null=models.PayloadField(key="metadata.section"))]),
+    models.Filter(
+        should=[
+            models.FieldCondition(key="metadata.cell_type", match=models.MatchValue(value="markdown")),
+            models.FieldCondition(key="metadata.tokens", range=models.Range(gt=200)),
+        ],
+        must_not=[models.FieldCondition(key="metadata.section", match=models.MatchValue(value="Training"))],
+    ),
+    models.Filter(must=[
+        models.FieldCondition(key="metadata.cell_type", match=models.MatchValue(value="code")),
+        models.Filter(should=[models.FieldCondition(key="metadata.section", match=models.MatchValue(value="Training"))]),
+    ]),
+]
+
+
+@pytest.mark.parametrize("filter", FILTERS)
+def test_matches_filter_like_qdrant(filter):
+    client = QdrantClient(":memory:")
+    client.create_collection("chunks", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    client.upsert("chunks", points=[
+        models.PointStruct(id=row, vector=[1.0, float(row)], payload={"page_content": "", "metadata": metadata})
+        for row, metadata in enumerate(METADATAS)
+    ])
+    expected = {record.id for record in client.scroll("chunks", scroll_filter=filter, limit=10)[0]}
+    assert {row for row, metadata in enumerate(METADATAS) if matches_filter(metadata, filter)} == expected
+
+
+def test_filter_from_dict():
+    filter = filter_from_dict({"cell_type": "code", "source": {"kind": "output"}})
+    assert [condition.key for condition in filter.must] == ["metadata.cell_type", "metadata.source.kind"]
+    assert [row for row, metadata in enumerate(METADATAS) if matches_filter(metadata, filter)] == [2]
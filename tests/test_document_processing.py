@@ -0,0 +1,44 @@
+import asyncio
+import json
+import pytest
+from langchain_core.documents import Document
+from document_processing import DocumentManager, collection_registry
+
+
+class FailingEmbeddings:
+    """Embeddings whose requests fail, like an exhausted rate limit."""
+    misses = 0
+
+    def embed_documents(self, texts):
+        raise RuntimeError("rate limited")
+
+    async def aembed_documents(self, texts):
+        raise RuntimeError("rate limited")
+
+
+@pytest.fixture
+def doc_manager(tmp_path, monkeypatch):
+    path = tmp_path / "notebook.ipynb"
+    path.write_text(json.dumps({"cells": [{"cell_type": "code", "source": ["print(1)"], "metadata": {}}]}))
+    doc_manager = DocumentManager(str(path), vector_index="qdrant")
+    doc_manager.docs = [Document(page_content="print(1)", metadata={"cell_hash": "h1", "cell_indexes": [0]})]
+    monkeypatch.setattr(doc_manager, "_get_embedding_model", lambda max_retries=2: FailingEmbeddings())
+    return doc_manager
+
+
+def references(doc_manager):
+    return collection_registry._refs.get(doc_manager.collection_name, 0)
+
+
+def test_failed_indexing_releases_the_collection(doc_manager):
+    with pytest.raises(RuntimeError):
+        doc_manager.initialize_retriever()
+    assert references(doc_manager) == 0
+    assert not doc_manager._acquired
+
+
+def test_failed_async_indexing_releases_the_collection(doc_manager):
+    with pytest.raises(RuntimeError):
+        asyncio.run(doc_manager.ainitialize_retriever())
+    assert references(doc_manager) == 0
+    assert not doc_manager._acquired
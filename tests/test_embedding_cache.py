@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from langchain_core.embeddings import Embeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+class CountingEmbeddings(Embeddings):
+    """Embeds each text as its length and records the texts it embeds."""
+    def __init__(self):
+        self.documents = []
+        self.queries = []
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(text)), 1.0]
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_entries=3)
+
+
+def test_only_missing_documents_are_embedded(cache):
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, cache, "model")
+    assert embeddings.embed_documents(["a", "bb"]) == [[1.0, 1.0], [2.0, 1.0]]
+    assert asyncio.run(embeddings.aembed_documents(["bb", "ccc"])) == [[2.0, 1.0], [3.0, 1.0]]
+    assert model.documents == ["a", "bb", "ccc"]
+    assert embeddings.stats() == {"hits": 1, "misses": 3, "hit_rate": 0.25}
+
+
+def test_models_do_not_share_vectors(cache):
+    CachedEmbeddings(CountingEmbeddings(), cache, "model").embed_documents(["a"])
+    assert cache.get_many("other model", ["a"]) == [None]
+
+
+def test_least_recently_used_vectors_are_evicted(cache):
+    embeddings = CachedEmbeddings(CountingEmbeddings(), cache, "model")
+    embeddings.embed_documents(["a", "bb", "ccc"])
+    embeddings.embed_documents(["dddd"])
+    assert cache.stats()["entries"] == 3
+
+
+def test_queries_are_not_cached(cache):
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, cache, "model")
+    assert embeddings.embed_query("What does load_data do?") == [23.0, 1.0]
+    assert asyncio.run(embeddings.aembed_query("What does load_data do?")) == [23.0, 1.0]
+    assert model.queries == ["What does load_data do?"] * 2
+    assert model.documents == []
+    assert cache.get_many("model", ["What does load_data do?"]) == [None]
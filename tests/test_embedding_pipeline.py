@@ -0,0 +1,99 @@
+import asyncio
+import base64
+import json
+import httpx
+import numpy as np
+import openai
+import pytest
+from langchain_openai import OpenAIEmbeddings
+from conftest import WordEncoding
+from embedding_pipeline import AsyncEmbeddingPipeline
+
+TEXTS = [f"text {i}" for i in range(10)]
+
+
+class EmbeddingsServer:
+    """
+    An embeddings endpoint behind an httpx mock transport. Each text is embedded as (i, 1) for the i-th of `TEXTS`,
+    and the first `rate_limited` requests get a 429 with a Retry-After header.
+    """
+    def __init__(self, rate_limited=0, latency=0.0):
+        self.rate_limited = rate_limited
+        self.latency = latency
+        self.batches = []
+        self.responses = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._texts = {tuple(WordEncoding().encode(text)): i for i, text in enumerate(TEXTS)}
+
+    async def handle(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if len(self.responses) < self.rate_limited:
+                self.responses.append(429)
+                return httpx.Response(429, headers={"retry-after": "0.01"}, json={"error": {"message": "Rate limit"}})
+            body = json.loads(request.content)
+            indexes = [self._texts[tuple(tokens)] for tokens in body["input"]]
+            self.batches.append(indexes)
+            self.responses.append(200)
+            data = [
+                {"object": "embedding", "index": position, "embedding": self._encode([float(i), 1.0], body)}
+                for position, i in enumerate(indexes)
+            ]
+            return httpx.Response(200, json={
+                "object": "list", "data": data, "model": body["model"],
+                "usage": {"prompt_tokens": len(indexes), "total_tokens": len(indexes)},
+            })
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _encode(vector, body):
+        if body.get("encoding_format") == "base64":
+            return base64.b64encode(np.array(vector, dtype=np.float32).tobytes()).decode()
+        return vector
+
+    def embeddings(self):
+        client = openai.AsyncOpenAI(
+            api_key="sk-test", max_retries=0, http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+        )
+        return OpenAIEmbeddings(model="text-embedding-3-small", client=None, async_client=client.embeddings)
+
+
+def text_index(vector):
+    # The server's (i, 1) vectors come back normalized
+    return round(vector[0] / vector[1])
+
+
+def test_vectors_are_returned_in_order_of_the_texts(word_tokens):
+    server = EmbeddingsServer(latency=0.01)
+    progress = []
+
+    async def on_progress(done, total):
+        progress.append((done, total))
+
+    pipeline = AsyncEmbeddingPipeline(server.embeddings(), batch_size=3, max_concurrency=2)
+    vectors = asyncio.run(pipeline.embed(TEXTS, on_progress))
+    assert [text_index(vector) for vector in vectors] == list(range(10))
+    assert sorted(server.batches) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    assert server.max_in_flight == 2
+    assert len(progress) == 4 and progress == sorted(progress) and progress[-1] == (10, 10)
+
+
+def test_rate_limited_batches_are_retried(word_tokens):
+    server = EmbeddingsServer(rate_limited=2)
+    pipeline = AsyncEmbeddingPipeline(server.embeddings(), batch_size=5, max_concurrency=1, initial_backoff=10.0)
+    vectors = asyncio.run(asyncio.wait_for(pipeline.embed(TEXTS), timeout=5))
+    # Both retries waited for the Retry-After delay rather than the 10s backoff
+    assert server.responses == [429, 429, 200, 200]
+    assert [text_index(vector) for vector in vectors] == list(range(10))
+
+
+def test_rate_limit_is_raised_after_the_last_retry(word_tokens):
+    server = EmbeddingsServer(rate_limited=3)
+    pipeline = AsyncEmbeddingPipeline(server.embeddings(), batch_size=10, max_retries=2)
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(pipeline.embed(TEXTS))
+    assert server.responses == [429, 429, 429]
@@ -0,0 +1,64 @@
+import csv
+import sqlite3
+import zipfile
+import flashcard_export
+from flashcard_export import write_apkg, write_csv
+
+CARDS = [
+    {"question": "What does df.head() return?", "answer": "The first 5 rows."},
+    {"question": "What is <b>x</b>?", "answer": "A variable\non two lines."},
+]
+
+
+def read_apkg(path, tmp_path):
+    with zipfile.ZipFile(path) as package:
+        assert sorted(package.namelist()) == ["collection.anki2", "media"]
+        database = tmp_path / f"{path.stem}.anki2"
+        database.write_bytes(package.read("collection.anki2"))
+    connection = sqlite3.connect(database)
+    try:
+        notes = connection.execute("SELECT id, guid, flds, sfld FROM notes ORDER BY id").fetchall()
+        cards = connection.execute("SELECT id, nid, due FROM cards ORDER BY id").fetchall()
+    finally:
+        connection.close()
+    return notes, cards
+
+
+def test_write_csv(tmp_path):
+    path = tmp_path / "cards.csv"
+    assert write_csv(iter(CARDS), str(path)) == 2
+    with open(path, newline="", encoding="utf-8") as f:
+        assert list(csv.DictReader(f)) == [{"Front": card["question"], "Back": card["answer"]} for card in CARDS]
+
+
+def test_write_apkg(tmp_path, monkeypatch):
+    monkeypatch.setattr(flashcard_export, "EXPORT_BATCH_SIZE", 1)
+    path = tmp_path / "cards.apkg"
+    assert write_apkg(iter(CARDS), str(path)) == 2
+    assert not (tmp_path / "cards.apkg.anki2").exists()
+    notes, cards = read_apkg(path, tmp_path)
+    assert [note[2] for note in notes] == [
+        "What does df.head() return?\x1fThe first 5 rows.", "What is &lt;b&gt;x&lt;/b&gt;?\x1fA variable<br>on two lines.",
+    ]
+    assert [(card[1], card[2]) for card in cards] == [(notes[0][0], 1), (notes[1][0], 2)]
+
+
+def test_exports_in_the_same_millisecond_have_distinct_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(flashcard_export.time, "time", lambda: 1700000000.0)
+    first, second = tmp_path / "first.apkg", tmp_path / "second.apkg"
+    write_apkg(CARDS, str(first))
+    write_apkg([{"question": "Other?", "answer": "Yes."}, *CARDS], str(second))
+    first_notes, _ = read_apkg(first, tmp_path)
+    second_notes, _ = read_apkg(second, tmp_path)
+    assert not {note[0] for note in first_notes} & {note[0] for note in second_notes}
+    # The same card in the same deck keeps its guid, so importing it again updates the note
+    assert {note[1] for note in first_notes} < {note[1] for note in second_notes}
+
+
+def test_guid_depends_on_the_answer_and_the_deck(tmp_path):
+    paths = [tmp_path / "a.apkg", tmp_path / "b.apkg", tmp_path / "c.apkg"]
+    write_apkg([{"question": "Q?", "answer": "A"}], str(paths[0]))
+    write_apkg([{"question": "Q?", "answer": "B"}], str(paths[1]))
+    write_apkg([{"question": "Q?", "answer": "A"}], str(paths[2]), deck_name="Other deck")
+    guids = {read_apkg(path, tmp_path)[0][0][1] for path in paths}
+    assert len(guids) == 3
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+import pytest
+import ingestion as ingestion_module
+from ingestion import IngestionService, IngestionStats
+
+
+class Calls(list):
+    """The notebooks chunked by the fake `chunk_notebook`, which blocks until `release` is called."""
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def release(self):
+        self.released.set()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = Calls()
+
+    def chunk_notebook(notebook_path):
+        calls.append(notebook_path)
+        started = time.time()
+        calls.released.wait(5)
+        return [f"chunk of {notebook_path}"], f"index of {notebook_path}", started, time.time()
+
+    monkeypatch.setattr(ingestion_module, "chunk_notebook", chunk_notebook)
+    return calls
+
+
+async def submit_together(service, calls, uploads):
+    jobs = [asyncio.ensure_future(service.submit(path, notebook_hash)) for path, notebook_hash in uploads]
+    await asyncio.sleep(0.05)
+    in_flight = service.in_flight()
+    calls.release()
+    return await asyncio.gather(*jobs), in_flight
+
+
+def test_uploads_of_the_same_notebook_share_one_job(calls):
+    service = IngestionService(max_workers=0)
+    results, in_flight = asyncio.run(submit_together(service, calls, [("a.ipynb", "h1"), ("copy.ipynb", "h1")]))
+    assert calls == ["a.ipynb"]
+    assert in_flight == 1
+    assert results == [(["chunk of a.ipynb"], "index of a.ipynb")] * 2
+    assert service.in_flight() == 0
+    summary = service.stats.summary()
+    assert (summary["jobs"], summary["shared"]) == (1, 1)
+
+
+def test_different_notebooks_run_separate_jobs(calls):
+    service = IngestionService(max_workers=0)
+    results, in_flight = asyncio.run(submit_together(service, calls, [("a.ipynb", "h1"), ("b.ipynb", "h2")]))
+    assert sorted(calls) == ["a.ipynb", "b.ipynb"]
+    assert in_flight == 2
+    assert [docs for docs, _ in results] == [["chunk of a.ipynb"], ["chunk of b.ipynb"]]
+    summary = service.stats.summary()
+    assert (summary["jobs"], summary["shared"]) == (2, 0)
+
+
+def test_finished_jobs_are_not_shared(calls):
+    calls.release()
+    service = IngestionService(max_workers=0)
+    asyncio.run(service.submit("a.ipynb", "h1"))
+    asyncio.run(service.submit("a.ipynb", "h1"))
+    assert calls == ["a.ipynb", "a.ipynb"]
+    assert service.stats.summary()["shared"] == 0
+
+
+def test_stats_summary():
+    stats = IngestionStats(max_samples=3)
+    assert stats.summary() == {
+        "jobs": 0, "shared": 0, "wait_p50": None, "wait_p95": None, "run_p50": None, "run_p95": None,
+        "total_p50": None, "total_p95": None,
+    }
+    for wait, run in ((0.0, 1.0), (1.0, 2.0), (2.0, 3.0), (3.0, 4.0)):
+        stats.record(wait, run)
+    stats.record_shared()
+    summary = stats.summary()
+    assert (summary["jobs"], summary["shared"]) == (3, 1)
+    assert summary["run_p50"] == 3.0
+    assert summary["total_p95"] == 7.0
+
+
+def test_shutdown_stops_the_pool():
+    service = IngestionService(max_workers=1)
+    executor = service._get_executor()
+    assert service._get_executor() is executor
+    service.shutdown()
+    assert service._executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(time.time)
+    service.shutdown()
+    assert service._get_executor() is not executor
+    service.shutdown()
+
+
+def test_thread_mode_has_no_pool():
+    service = IngestionService(max_workers=0)
+    service.start()
+    assert service._get_executor() is None
+    service.shutdown()
@@ -0,0 +1,54 @@
+from langchain_core.documents import Document
+from keyword_index import BM25Index, KeywordRetriever, code_identifiers, code_tokens
+
+CHUNKS = [
+    Document(page_content="import numpy as np\nnorm = np.linalg.norm(vector)"),
+    Document(page_content="dataset = load_dataset('imdb')\ndataset.train_test_split(test_size=0.2)"),
+    Document(page_content="# Plotting the results\nplt.plot(history.history['loss'])"),
+    Document(page_content="class TextClassifier:\n    def fit(self, X, y): ..."),
+]
+
+
+def test_code_tokens_keep_identifiers_whole_and_split():
+    tokens = code_tokens("What does np.linalg.norm do in load_dataset and fooBar?")
+    assert {"np.linalg.norm", "np", "linalg", "norm", "load_dataset", "load", "dataset", "foobar", "foo", "bar"} <= set(tokens)
+    assert not {"what", "does", "do", "in", "and"} & set(tokens)
+
+
+def test_code_identifiers():
+    assert code_identifiers("Why does df.merge fail in load_data() and myFunc?") == {"df.merge", "load_data", "myfunc"}
+    assert code_identifiers("How is the data cleaned?") == set()
+
+
+def test_search_ranks_the_chunk_naming_the_identifier():
+    index = BM25Index(CHUNKS)
+    (best, score), *_ = index.search("where is np.linalg.norm used", k=2)
+    assert best is CHUNKS[0] and score > 0
+    assert index.search("train_test_split", k=4)[0][0] is CHUNKS[1]
+    assert index.search("TextClassifier fit")[0][0] is CHUNKS[3]
+
+
+def test_search_without_matching_terms():
+    assert BM25Index(CHUNKS).search("weather forecast") == []
+    assert BM25Index([]).search("np") == []
+
+
+def test_rare_terms_weigh_more():
+    index = BM25Index([
+        Document(page_content="data data data rare_term"),
+        Document(page_content="data"),
+        Document(page_content="data other"),
+    ])
+    assert index.search("data rare_term", k=1)[0][0].page_content == "data data data rare_term"
+
+
+def test_has_identifier_match():
+    index = BM25Index(CHUNKS)
+    assert index.has_identifier_match("What does load_dataset return?")
+    assert not index.has_identifier_match("What does load_model return?")
+    assert not index.has_identifier_match("How are the results plotted?")
+
+
+def test_keyword_retriever():
+    retriever = KeywordRetriever(index=BM25Index(CHUNKS), k=1)
+    assert retriever.invoke("plt.plot loss") == [CHUNKS[2]]
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage, FunctionMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from memory import ConversationMemory
+
+
+class Summarizer:
+    """A summarizer chain recording the turns it folds and answering a numbered summary."""
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.inputs = []
+
+    def runnable(self):
+        def summarize(inputs):
+            self.inputs.append(inputs)
+            if self.fail:
+                raise RuntimeError("rate limited")
+            return f" summary {len(self.inputs)} "
+
+        return RunnableLambda(summarize)
+
+
+def turn(number):
+    # 10 tokens per message with the word encoding: 6 words and the chat format overhead
+    return [
+        HumanMessage(content=f"question {number} about the notebook please"),
+        AIMessage(content=f"answer {number} from the notebook cells", name="QAAgent"),
+    ]
+
+
+@pytest.fixture
+def summarizer():
+    return Summarizer()
+
+
+@pytest.fixture
+def memory(word_tokens, summarizer):
+    return ConversationMemory(summarizer.runnable(), max_tokens=40, recent_tokens=20)
+
+
+def test_history_within_budget_is_kept(memory, summarizer):
+    memory.add_messages(turn(1) + turn(2))
+    assert memory.tokens() == 40
+    memory.summarize()
+    assert summarizer.inputs == []
+    assert memory.get_messages() == turn(1) + turn(2)
+
+
+def test_oldest_turns_are_folded_over_budget(memory, summarizer):
+    memory.add_messages(turn(1) + turn(2) + turn(3))
+    memory.summarize()
+    assert summarizer.inputs == [{
+        "summary": "(none)",
+        "turns": "User: question 1 about the notebook please\nQAAgent: answer 1 from the notebook cells\n"
+                 "User: question 2 about the notebook please\nQAAgent: answer 2 from the notebook cells",
+    }]
+    assert memory.get_messages() == [SystemMessage(content="Summary of the earlier conversation: summary 1")] + turn(3)
+    # The summary counts toward the budget: "summary 1" and the overhead
+    assert memory.tokens() == 6 + 20
+
+
+def test_summary_is_updated(memory, summarizer):
+    memory.add_messages(turn(1) + turn(2) + turn(3))
+    memory.summarize()
+    memory.add_messages(turn(4))
+    memory.summarize()
+    assert summarizer.inputs[-1]["summary"] == "summary 1"
+    assert memory.get_messages()[0].content.endswith("summary 2")
+    assert memory.get_messages()[1:] == turn(4)
+
+
+def test_tool_calls_stay_with_their_turn(memory, summarizer):
+    question = HumanMessage(content="what does load_data return")
+    call = AIMessage(content="", additional_kwargs={"function_call": {"name": "retrieve_information", "arguments": "{}"}})
+    result = FunctionMessage(content="def load_data(path): return df", name="retrieve_information")
+    tool = ToolMessage(content="the first rows", tool_call_id="call_1")
+    answer = AIMessage(content="It returns the data frame", name="QAAgent")
+    memory.add_messages(turn(1) + [question, call, result, tool, answer])
+    memory.summarize()
+    # The recent budget would cut the turn after its function call: the whole turn is kept instead
+    assert memory.get_messages()[1:] == [question, call, result, tool, answer]
+
+
+def test_messages_after_the_last_question_are_kept(memory):
+    memory.add_messages([AIMessage(content="word " * 60, name="QAAgent")])
+    memory.summarize()
+    assert len(memory.get_messages()) == 1
+
+
+def test_failed_summary_drops_the_oldest_turns(word_tokens):
+    summarizer = Summarizer(fail=True)
+    memory = ConversationMemory(summarizer.runnable(), max_tokens=40, recent_tokens=20)
+    memory.add_messages(turn(1) + turn(2) + turn(3))
+    asyncio.run(memory.asummarize())
+    assert len(summarizer.inputs) == 1
+    assert memory.get_messages() == turn(3)
+    assert memory.tokens() == 20
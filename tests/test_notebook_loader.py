@@ -0,0 +1,88 @@
+import io
+import json
+import pytest
+from notebook_loader import TRUNCATED_MARK, JsonStream, NotebookFormatError, iter_notebook_cells
+
+
+def read(value, limit=None, block_size=4):
+    # Small blocks, so strings and escapes are split across reads
+    return JsonStream(io.StringIO(json.dumps(value)), block_size=block_size).read_string(limit)
+
+
+@pytest.mark.parametrize("value", ["plain", "quote \" and \\ backslash", "tab\tnew\nline", "é ü", "emoji 🎉 ok", "", "\ud800 lone"])
+def test_read_string_decodes_like_json(value):
+    assert read(value) == value
+
+
+def test_read_string_counts_decoded_characters():
+    # json.dumps escapes every non-ASCII character, six or twelve raw characters each
+    assert read("éééééééééé", limit=10) == "éééééééééé"
+    assert read("🎉🎉🎉🎉🎉", limit=5) == "🎉🎉🎉🎉🎉"
+    assert read("ééééé", limit=3) == "ééé" + TRUNCATED_MARK
+    assert read("a\nb\nc\nd", limit=4) == "a\nb\n" + TRUNCATED_MARK
+
+
+def test_read_string_does_not_cut_a_surrogate_pair():
+    assert read("ab🎉cd", limit=2) == "ab" + TRUNCATED_MARK
+    assert read("ab🎉cd", limit=3) == "ab🎉" + TRUNCATED_MARK
+
+
+def test_read_text_joins_the_multiline_format():
+    stream = JsonStream(io.StringIO(json.dumps(["line 1\n", "line 2\n", "line 3"])))
+    assert stream.read_text(limit=10) == "line 1\nlin" + TRUNCATED_MARK
+
+
+def test_skip_value_skips_nested_values():
+    stream = JsonStream(io.StringIO('{"a": [1, {"b": "x\\"y"}, null, true, -2.5e3], "c": "kept"}'), block_size=3)
+    values = {}
+    for key in stream.iter_object():
+        if key == "c":
+            values[key] = stream.read_string()
+        else:
+            stream.skip_value()
+    assert values == {"c": "kept"}
+
+
+def write_notebook(tmp_path, cells):
+    path = tmp_path / "notebook.ipynb"
+    path.write_text(json.dumps({"metadata": {"kernelspec": {"name": "python3"}}, "cells": cells, "nbformat": 4}))
+    return str(path)
+
+
+def test_iter_notebook_cells(tmp_path):
+    path = write_notebook(tmp_path, [
+        {"cell_type": "markdown", "metadata": {}, "source": ["# Title\n", "Intro"]},
+        {"cell_type": "code", "metadata": {}, "source": ["   "], "outputs": []},
+        {"cell_type": "code", "metadata": {}, "source": "print(x)", "outputs": [
+            {"output_type": "stream", "name": "stdout", "text": ["1\n", "2\n"]},
+            {"output_type": "display_data", "data": {"image/png": "iVBORw0KGgo=", "text/plain": ["<Figure>"]}},
+            {"output_type": "error", "ename": "NameError", "evalue": "name 'x' is not defined", "traceback": []},
+        ]},
+    ])
+    cells = list(iter_notebook_cells(path, include_outputs=True))
+    assert [(cell["index"], cell["cell_type"], cell["source"]) for cell in cells] == [
+        (0, "markdown", "# Title\nIntro"), (2, "code", "print(x)"),
+    ]
+    assert cells[1]["outputs"] == ["1\n2", "<Figure>", "NameError: name 'x' is not defined"]
+
+
+def test_iter_notebook_cells_skips_outputs_by_default(tmp_path):
+    path = write_notebook(tmp_path, [
+        {"cell_type": "code", "metadata": {}, "source": "print(1)", "outputs": [{"output_type": "stream", "text": "1"}]},
+    ])
+    assert [cell["outputs"] for cell in iter_notebook_cells(path)] == [[]]
+
+
+def test_iter_notebook_cells_truncates_outputs(tmp_path):
+    path = write_notebook(tmp_path, [
+        {"cell_type": "code", "metadata": {}, "source": "print(s)", "outputs": [{"output_type": "stream", "text": "é" * 50}]},
+    ])
+    (cell,) = iter_notebook_cells(path, include_outputs=True, max_output_chars=20)
+    assert cell["outputs"] == ["é" * 20 + TRUNCATED_MARK]
+
+
+def test_invalid_notebook(tmp_path):
+    path = tmp_path / "broken.ipynb"
+    path.write_text('{"cells": [{"cell_type": "code", "source": "x')
+    with pytest.raises(NotebookFormatError):
+        list(iter_notebook_cells(str(path)))
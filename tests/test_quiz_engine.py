@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from langchain_core.runnables import RunnableLambda
+import quiz_engine as quiz_engine_module
+from quiz_engine import QuizEngine, merge_questions
+
+# Two sections share the "Exercise" heading
+SECTIONS = [
+    ("Loading", "df = pd.read_csv(path)"),
+    ("Exercise", "Load the iris dataset"),
+    ("Plotting", "plt.plot(df.loss)"),
+    ("Exercise", "Plot the training loss"),
+]
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(quiz_engine_module, "sections_for_bank", lambda documents, **kwargs: SECTIONS)
+    return QuizEngine(questions_per_call=2, max_concurrency=2)
+
+
+def use_chain(engine, monkeypatch, respond):
+    calls = []
+
+    def generate(inputs):
+        calls.append(inputs)
+        return respond(inputs)
+
+    monkeypatch.setattr(engine, "_create_chain", lambda: RunnableLambda(generate))
+    return calls
+
+
+def questions(inputs):
+    return {"quiz": [
+        {"question": f"Question {number} on {inputs['content']}", "choices": ["a", "b"], "answer": "a"}
+        for number in range(inputs["count"])
+    ]}
+
+
+def test_calls_are_counted_per_section(engine):
+    inputs, count = engine.plan("Give me a quiz of 14 questions", [])
+    assert count == 14
+    assert [(call["content"], call["batch"], call["batches"]) for call in inputs] == [
+        ("df = pd.read_csv(path)", 1, 2),
+        ("Load the iris dataset", 1, 2),
+        ("plt.plot(df.loss)", 1, 2),
+        ("Plot the training loss", 1, 1),
+        ("df = pd.read_csv(path)", 2, 2),
+        ("Load the iris dataset", 2, 2),
+        ("plt.plot(df.loss)", 2, 2),
+    ]
+    assert {call["count"] for call in inputs} == {3}
+
+
+def test_request_topics_select_the_sections(engine):
+    inputs, _ = engine.plan("Quiz me on plotting", [])
+    assert [call["section"] for call in inputs] == ["Plotting", "Plotting", "Plotting"]
+    assert engine.plan("Quiz me on tensorflow", []) == ([], 5)
+
+
+def test_quiz_is_merged_from_the_calls(engine, monkeypatch):
+    calls = use_chain(engine, monkeypatch, questions)
+    quiz = engine.create("Give me a quiz of 8 questions", [])
+    assert len(calls) == 4
+    assert len(quiz) == 8
+    # Calls are interleaved, so every section is covered
+    assert [item["question"] for item in quiz[:4]] == [f"Question 0 on {text}" for _, text in SECTIONS]
+
+
+def test_failed_calls_and_duplicates_are_dropped(engine, monkeypatch):
+    def respond(inputs):
+        if inputs["content"] == "plt.plot(df.loss)":
+            raise RuntimeError("rate limited")
+        if inputs["section"] == "Exercise":
+            return {"quiz": [{"question": "What does the exercise ask?", "answer": "a"}, {"question": "No answer"}]}
+        return questions(inputs)
+
+    use_chain(engine, monkeypatch, respond)
+    quiz = asyncio.run(engine.acreate("Give me a quiz of 8 questions", [], exclude="Question 1 on df = pd.read_csv(path)"))
+    assert [item["question"] for item in quiz] == [
+        "Question 0 on df = pd.read_csv(path)", "What does the exercise ask?", "Question 2 on df = pd.read_csv(path)",
+    ]
+
+
+def test_no_matching_section(engine, monkeypatch):
+    calls = use_chain(engine, monkeypatch, questions)
+    assert engine.create("Quiz me on tensorflow", []) is None
+    assert calls == []
+
+
+def test_merge_questions_stops_at_the_count():
+    batches = [[{"question": f"q{i}", "answer": "a"} for i in range(3)], [{"question": "Q0?", "answer": "b"}]]
+    assert [item["question"] for item in merge_questions(batches, 3)] == ["q0", "q1", "q2"]
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from reranking import ContextCompressor, deduplicate
+
+QUESTION = "How is the data loaded?"
+
+
+class TableEmbeddings(Embeddings):
+    """Embeds texts with the vectors of a lookup table."""
+    VECTORS = {
+        QUESTION: [1.0, 0.0, 0.0],
+        "df = pd.read_csv(path)": [1.0, 0.0, 0.0],
+        "df = pd.read_parquet(path)": [0.99, 0.14, 0.0],
+        "plt.plot(df.loss)": [0.7, 0.0, 0.71],
+    }
+
+    def embed_documents(self, texts):
+        return [self.VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.VECTORS[text]
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+
+def chunk(text, source="notebook.ipynb", cell_hash=None):
+    return Document(page_content=text, metadata={"source": source, "cell_hash": cell_hash or text})
+
+
+CSV, PARQUET, PLOT = chunk("df = pd.read_csv(path)"), chunk("df = pd.read_parquet(path)"), chunk("plt.plot(df.loss)")
+
+
+def contents(documents):
+    return [document.page_content for document in documents]
+
+
+def test_duplicates_are_dropped():
+    lines = "\n".join(f"line {i}" for i in range(10))
+    documents = [
+        chunk("a", cell_hash="h1"),
+        chunk("a again", cell_hash="h1"),
+        chunk(lines),
+        # Shares 9 of its 10 lines with the chunk above
+        chunk(lines.replace("line 9", "line nine")),
+        # Same lines, other notebook
+        chunk(lines, source="other.ipynb", cell_hash="h2"),
+    ]
+    assert deduplicate(documents) == [documents[0], documents[2], documents[4]]
+
+
+@pytest.mark.parametrize("mmr_lambda, expected", [
+    # Relevance only: the near duplicate of the best chunk comes second
+    (1.0, ["df = pd.read_csv(path)", "df = pd.read_parquet(path)", "plt.plot(df.loss)"]),
+    # Diversity only: the chunk least similar to the first pick comes second
+    (0.0, ["df = pd.read_csv(path)", "plt.plot(df.loss)", "df = pd.read_parquet(path)"]),
+])
+def test_mmr_lambda(word_tokens, mmr_lambda, expected):
+    compressor = ContextCompressor(TableEmbeddings(), max_tokens=100, max_chunks=3, mmr_lambda=mmr_lambda)
+    assert contents(compressor.compress(QUESTION, [CSV, PARQUET, PLOT])) == expected
+    assert contents(asyncio.run(compressor.acompress(QUESTION, [CSV, PARQUET, PLOT]))) == expected
+
+
+def test_relevance_orders_the_context(word_tokens):
+    compressor = ContextCompressor(TableEmbeddings(), max_tokens=100, max_chunks=3, mmr_lambda=1.0)
+    assert contents(compressor.compress(QUESTION, [PLOT, PARQUET, CSV]))[0] == "df = pd.read_csv(path)"
+
+
+def test_context_is_trimmed_to_the_budget(word_tokens):
+    long_chunk, short_chunk = chunk("x " * 8 + "end"), chunk("y " * 2 + "end")
+    # Without embeddings the retriever's order is kept: 3, 9 and 3 tokens
+    compressor = ContextCompressor(None, max_tokens=7, max_chunks=3)
+    assert contents(compressor.compress(QUESTION, [CSV, long_chunk, short_chunk])) == [CSV.page_content, short_chunk.page_content]
+    # The best chunk is kept even over the budget
+    assert compressor.compress(QUESTION, [long_chunk, CSV]) == [long_chunk]
+    assert ContextCompressor(None, max_tokens=100, max_chunks=1).compress(QUESTION, [CSV, short_chunk]) == [CSV]
+
+
+def test_runnable(word_tokens):
+    compressor = ContextCompressor(TableEmbeddings(), max_tokens=100, max_chunks=2, mmr_lambda=1.0)
+    inputs = {"question": QUESTION, "context": [PLOT, CSV, CSV]}
+    assert contents(compressor.as_runnable().invoke(inputs)) == ["df = pd.read_csv(path)", "plt.plot(df.loss)"]
@@ -0,0 +1,57 @@
+import asyncio
+import hashlib
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.retrievers import BaseRetriever
+import retrieval as retrieval_module
+from retrieval import RetrievalManager, answer_cache
+
+
+class HashEmbeddings(Embeddings):
+    """Embeds each text with a vector derived from its hash, so only identical texts are similar."""
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [byte / 255 - 0.5 for byte in hashlib.md5(text.encode()).digest()]
+
+
+class NotebookRetriever(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager):
+        return [Document(page_content="def load_data(path): ...", metadata={"cell_indexes": [3]})]
+
+
+@pytest.fixture
+def manager(monkeypatch, word_tokens):
+    # The RAG chain answers with its own model, the direct QA chain with `answer_model`
+    monkeypatch.setattr(retrieval_module, "get_chat_model", lambda *args, **kwargs: FakeListChatModel(responses=["RAG answer"]))
+    answer_cache.invalidate("nb")
+    yield RetrievalManager(
+        NotebookRetriever(),
+        embedding_model=HashEmbeddings(),
+        cache_namespace="nb",
+        answer_model=FakeListChatModel(responses=["Direct answer [cell 3]"]),
+        question_model=FakeListChatModel(responses=["unused"]),
+    )
+    answer_cache.invalidate("nb")
+
+
+def test_chains_do_not_share_cached_answers(manager):
+    question = {"question": "What does load_data do?", "messages": [HumanMessage(content="What does load_data do?")]}
+    assert manager.get_direct_QA_chain().invoke(question)["response"].content == "Direct answer [cell 3]"
+    assert manager.get_RAG_QA_chain().invoke(question)["response"].content == "RAG answer"
+    assert asyncio.run(manager.get_RAG_QA_chain().ainvoke(question))["response"].content == "RAG answer"
+    assert answer_cache.stats()["entries"] == 2
+
+
+def test_invalidation_drops_the_answers_of_every_chain(manager):
+    question = {"question": "What does load_data do?", "messages": [HumanMessage(content="What does load_data do?")]}
+    manager.get_direct_QA_chain().invoke(question)
+    manager.get_RAG_QA_chain().invoke(question)
+    answer_cache.invalidate("nb")
+    embedding = HashEmbeddings().embed_query(question["question"])
+    assert answer_cache.lookup("nb", embedding, chain="qa_chain") is None
+    assert answer_cache.lookup("nb", embedding, chain="rag_chain") is None
@@ -0,0 +1,147 @@
+import asyncio
+from typing import List
+import pytest
+from langchain.retrievers import MultiQueryRetriever
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import FakeListLLM
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores import Qdrant
+from qdrant_client import QdrantClient, models
+from compact_index import CompactVectorStore
+from retrievers import FusionRetriever, HybridRetriever, QueryVariantCache, normalize_question, reciprocal_rank_fusion
+
+
+class TableEmbeddings(Embeddings):
+    """Embeds texts with the vectors of a lookup table."""
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+class RecordingRetriever(BaseRetriever):
+    """Returns no document and records the queries it receives."""
+    queries: List[str] = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.queries.append(query)
+        return []
+
+
+CHUNKS = ["def load_data(path):", "plt.plot(history)"]
+
+
+def qdrant_store(embeddings):
+    # Built like `DocumentManager._vectorstore`, on a sync client only
+    client = QdrantClient(":memory:")
+    client.create_collection("chunks", vectors_config=models.VectorParams(size=3, distance=models.Distance.COSINE))
+    vectorstore = Qdrant(client, "chunks", embeddings)
+    vectorstore.add_texts(CHUNKS)
+    return vectorstore
+
+
+@pytest.fixture(params=["compact", "qdrant"])
+def hybrid(request):
+    embeddings = TableEmbeddings({
+        "def load_data(path):": [1.0, 0.0, 0.0],
+        "plt.plot(history)": [0.0, 1.0, 0.0],
+        # Cosine 0.95 with the first chunk
+        "What does load_data do?": [0.95, 0.0, 0.31],
+        # Cosine 0.6 with the first chunk, a relevance score of 0.8
+        "How is the data loaded?": [0.6, 0.0, 0.8],
+        # Cosine 0.2 with both chunks, a relevance score of 0.6
+        "What is the weather like?": [0.2, 0.2, 0.96],
+    })
+    if request.param == "qdrant":
+        vectorstore = qdrant_store(embeddings)
+    else:
+        vectorstore = CompactVectorStore.from_texts(CHUNKS, embeddings)
+    rewritten = RecordingRetriever(queries=[])
+    multi_query = MultiQueryRetriever.from_llm(retriever=rewritten, llm=FakeListLLM(responses=["first variant\nsecond variant"]))
+    return HybridRetriever(vectorstore=vectorstore, multi_query_retriever=multi_query, k=1), rewritten
+
+
+def test_relevant_question_is_not_rewritten(hybrid):
+    retriever, rewritten = hybrid
+    docs = retriever.invoke("What does load_data do?")
+    assert [doc.page_content for doc in docs] == ["def load_data(path):"]
+    assert rewritten.queries == []
+
+
+@pytest.mark.parametrize("question, rewrite", [
+    ("What does load_data do?", False), ("How is the data loaded?", False), ("What is the weather like?", True),
+])
+def test_sync_and_async_searches_agree(hybrid, question, rewrite):
+    retriever, rewritten = hybrid
+    retriever.invoke(question)
+    asyncio.run(retriever.ainvoke(question))
+    assert len(rewritten.queries) == (4 if rewrite else 0)
+
+
+def test_unrelated_question_is_rewritten(hybrid):
+    retriever, rewritten = hybrid
+    retriever.invoke("What is the weather like?")
+    assert rewritten.queries == ["first variant", "second variant"]
+
+
+def test_unrelated_question_is_rewritten_async(hybrid):
+    retriever, rewritten = hybrid
+    asyncio.run(retriever.ainvoke("What is the weather like?"))
+    assert sorted(rewritten.queries) == ["first variant", "second variant"]
+
+
+def chunk(text, cell_hash=None):
+    return Document(page_content=text, metadata={"cell_hash": cell_hash} if cell_hash else {})
+
+
+def test_reciprocal_rank_fusion_favours_documents_ranked_by_both():
+    a, b, c, d = chunk("a", "ha"), chunk("b", "hb"), chunk("c", "hc"), chunk("d", "hd")
+    fused = reciprocal_rank_fusion([[a, b, c], [c, d, b]], k=4)
+    # c: 1/63 + 1/61, b: 1/62 + 1/63, a: 1/61, d: 1/62
+    assert [doc.page_content for doc in fused] == ["c", "b", "a", "d"]
+
+
+def test_reciprocal_rank_fusion_deduplicates_by_chunk_hash():
+    dense, keyword = chunk("same chunk", "h1"), chunk("same chunk", "h1")
+    fused = reciprocal_rank_fusion([[dense, chunk("other", "h2")], [keyword]], k=4)
+    assert fused[0] is dense
+    assert len(fused) == 2
+
+
+def test_reciprocal_rank_fusion_returns_k_documents():
+    ranking = [chunk(str(i)) for i in range(10)]
+    assert [doc.page_content for doc in reciprocal_rank_fusion([ranking], k=3)] == ["0", "1", "2"]
+    assert reciprocal_rank_fusion([[], []], k=3) == []
+
+
+def test_fusion_retriever():
+    code, markdown = chunk("def load_data(path):", "h1"), chunk("# Loading the data", "h2")
+
+    class Fixed(BaseRetriever):
+        documents: List[Document]
+
+        def _get_relevant_documents(self, query, *, run_manager):
+            return self.documents
+
+    retriever = FusionRetriever(dense_retriever=Fixed(documents=[markdown, code]), keyword_retriever=Fixed(documents=[code]), k=2)
+    assert retriever.invoke("load_data") == [code, markdown]
+    assert asyncio.run(retriever.ainvoke("load_data")) == [code, markdown]
+
+
+def test_normalize_question():
+    assert normalize_question("  What does   load_data() DO? ") == "what does load_data do"
+
+
+def test_query_variant_cache():
+    cache = QueryVariantCache(max_size=2)
+    cache.put("What is X?", ["x one", "x two"])
+    cache.put("What is Y?", ["y"])
+    assert cache.get("what is x") == ["x one", "x two"]
+    cache.put("What is Z?", ["z"])
+    assert cache.get("What is Y?") is None
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 1}
@@ -0,0 +1,124 @@
+import asyncio
+import pytest
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+import router as router_module
+from router import EmbeddingRouter, RoutingStats, SupervisorRouter, classify_by_rules, last_user_message
+
+RULE_CASES = [
+    ("Make flashcards from the notebook", "FlashcardsAgent"),
+    ("Can you create some Anki cards for me?", "FlashcardsAgent"),
+    ("Give me a quiz on the training loop", "QuizAgent"),
+    ("Test my knowledge of pandas", "QuizAgent"),
+    ("Could you quiz me on this?", "QuizAgent"),
+    ("I want 10 multiple-choice questions", "QuizAgent"),
+    ("What does load_data do?", "QAAgent"),
+    ("Explain the second cell", "QAAgent"),
+    ("the loss goes up after epoch 3?", "QAAgent"),
+    # Questions about a task, not requests for it
+    ("What is a quiz?", None),
+    ("How do flashcards work?", None),
+    # Several tasks, or neither a task nor a question
+    ("Make a quiz and flashcards", None),
+    ("thanks", None),
+    ("", None),
+]
+
+
+@pytest.mark.parametrize("text, expected", RULE_CASES)
+def test_classify_by_rules(text, expected):
+    assert classify_by_rules(text) == expected
+
+
+class Supervisor:
+    """The LLM supervisor, answering `route` and recording the messages it routes."""
+    def __init__(self, route="QAAgent"):
+        self.route = route
+        self.calls = []
+
+    def runnable(self):
+        def decide(state):
+            self.calls.append(last_user_message(state))
+            return {"next": self.route}
+
+        return RunnableLambda(decide)
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = RoutingStats()
+    monkeypatch.setattr(router_module, "routing_stats", stats)
+    return stats
+
+
+def conversation(text, **flags):
+    return {"messages": [HumanMessage(content="Hi"), AIMessage(content="Hello!"), HumanMessage(content=text)], **flags}
+
+
+@pytest.mark.parametrize("text, expected", RULE_CASES)
+def test_rules_stage(stats, text, expected):
+    supervisor = Supervisor(route="FINISH")
+    router = SupervisorRouter(supervisor.runnable(), mode="rules")
+    assert router.route(conversation(text)) == {"next": expected or "FINISH"}
+    assert supervisor.calls == ([] if expected else [text])
+    assert list(stats.summary()) == ["rules" if expected else "llm"]
+
+
+@pytest.mark.parametrize("flag", ["question_answered", "quiz_created", "flashcards_created"])
+def test_turn_finishes_once_an_agent_answered(stats, flag):
+    supervisor = Supervisor()
+    router = SupervisorRouter(supervisor.runnable(), mode="rules")
+    assert asyncio.run(router.aroute(conversation("Make a quiz and flashcards", **{flag: True}))) == {"next": "FINISH"}
+    assert supervisor.calls == []
+    assert stats.summary()["done"]["routes"] == {"FINISH": 1}
+
+
+def test_llm_mode_always_asks_the_supervisor(stats):
+    supervisor = Supervisor(route="QuizAgent")
+    router = SupervisorRouter(supervisor.runnable(), mode="llm")
+    assert router.route(conversation("What does load_data do?")) == {"next": "QuizAgent"}
+    assert supervisor.calls == ["What does load_data do?"]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        SupervisorRouter(Supervisor().runnable(), mode="regex")
+
+
+class AxisEmbeddings(Embeddings):
+    """Embeds texts with the vectors of a lookup table, on one axis per agent."""
+    VECTORS = {
+        "explain": [1.0, 0.0, 0.0],
+        "quiz": [0.0, 1.0, 0.0],
+        "cards": [0.0, 0.0, 1.0],
+        "I would like to practise before the exam": [0.1, 0.9, 0.2],
+        "Let's go over it again": [0.6, 0.6, 0.0],
+    }
+
+    def embed_documents(self, texts):
+        return [self.VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.VECTORS[text]
+
+
+@pytest.fixture
+def embedding_router():
+    examples = {"QAAgent": ["explain"], "QuizAgent": ["quiz"], "FlashcardsAgent": ["cards"]}
+    return EmbeddingRouter(AxisEmbeddings(), examples=examples, threshold=0.5, margin=0.05)
+
+
+def test_embeddings_stage(stats, embedding_router):
+    supervisor = Supervisor()
+    router = SupervisorRouter(supervisor.runnable(), mode="embeddings", embedding_router=embedding_router)
+    # Confident rules are decided before the embeddings
+    assert router.route(conversation("What does load_data do?")) == {"next": "QAAgent"}
+    assert router.route(conversation("I would like to practise before the exam")) == {"next": "QuizAgent"}
+    # As close to two agents, the message goes to the LLM supervisor
+    assert asyncio.run(router.aroute(conversation("Let's go over it again"))) == {"next": "QAAgent"}
+    assert supervisor.calls == ["Let's go over it again"]
+    summary = stats.summary()
+    assert {stage: summary[stage]["routes"] for stage in summary} == {
+        "rules": {"QAAgent": 1}, "embeddings": {"QuizAgent": 1}, "llm": {"QAAgent": 1},
+    }
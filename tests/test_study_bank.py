@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from langchain_core.runnables import RunnableLambda
+import study_bank as study_bank_module
+from study_bank import StudyBank
+
+SECTIONS = [("Loading", "df = pd.read_csv(path)"), ("Plotting", "plt.plot(df.x)")]
+
+
+def section_items(section):
+    return {
+        "quiz": [{"question": f"What does the {section} section do?", "choices": ["a", "b"], "answer": "a"}],
+        "flashcards": [{"question": f"{section}?", "answer": "yes"}],
+    }
+
+
+@pytest.fixture
+def bank(tmp_path, monkeypatch):
+    monkeypatch.setattr(study_bank_module, "sections_for_bank", lambda documents: SECTIONS)
+    return StudyBank(path=str(tmp_path))
+
+
+def use_chain(bank, monkeypatch, respond):
+    calls = []
+
+    def generate(inputs):
+        calls.append(inputs["section"])
+        return respond(inputs["section"], calls.count(inputs["section"]))
+
+    monkeypatch.setattr(bank, "_create_chain", lambda: RunnableLambda(generate))
+    return calls
+
+
+def test_generate_saves_the_bank(bank, monkeypatch):
+    use_chain(bank, monkeypatch, lambda section, attempt: section_items(section))
+    generated = asyncio.run(bank.generate("abc", []))
+    assert [item["section"] for item in generated["quiz"]] == ["Loading", "Plotting"]
+    assert StudyBank(path=bank.path).get("abc") == generated
+
+
+def test_generate_retries_failed_sections(bank, monkeypatch):
+    def respond(section, attempt):
+        if section == "Plotting" and attempt == 1:
+            raise RuntimeError("rate limited")
+        return section_items(section)
+
+    calls = use_chain(bank, monkeypatch, respond)
+    generated = asyncio.run(bank.generate("abc", []))
+    assert sorted(calls) == ["Loading", "Plotting", "Plotting"]
+    assert len(generated["flashcards"]) == 2
+
+
+@pytest.mark.parametrize("result", [RuntimeError("server error"), ["not", "an", "object"]])
+def test_generate_does_not_save_a_partial_bank(bank, monkeypatch, result):
+    def respond(section, attempt):
+        if section == "Plotting":
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return section_items(section)
+
+    calls = use_chain(bank, monkeypatch, respond)
+    assert asyncio.run(bank.generate("abc", [])) is None
+    assert calls.count("Plotting") == study_bank_module.STUDY_BANK_ATTEMPTS
+    assert bank.get("abc") is None
+
+
+def test_generate_skips_malformed_items(bank, monkeypatch):
+    use_chain(bank, monkeypatch, lambda section, attempt: {"quiz": ["question", {"question": "Q?"}], "flashcards": None})
+    assert asyncio.run(bank.generate("abc", [])) == {"quiz": [], "flashcards": []}
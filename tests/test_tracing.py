@@ -0,0 +1,72 @@
+import json
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from tracing import Tracer, current_trace, estimate_cost
+
+
+@pytest.fixture
+def tracer(tmp_path, word_tokens):
+    return Tracer(enabled=True, exporter="jsonl", path=str(tmp_path / "traces" / "traces.jsonl"))
+
+
+def exported(tracer):
+    with open(tracer.path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_spans_are_exported_as_json_lines(tracer):
+    with tracer.trace("turn", session="s1") as trace:
+        assert current_trace.get() is trace
+        with tracer.span("answer_cache.lookup") as span:
+            span.set(hit=False)
+        tracer.record("ingestion.run", 0.5, chunks=12)
+    assert current_trace.get() is None
+
+    lines = exported(tracer)
+    assert [(line["name"], line["kind"]) for line in lines] == [
+        ("answer_cache.lookup", "span"), ("ingestion.run", "span"), ("turn", "trace"),
+    ]
+    assert {line["trace_id"] for line in lines} == {trace.trace_id}
+    assert all(line["session"] == "s1" and "error" not in line for line in lines)
+    assert lines[0]["hit"] is False
+    assert (lines[1]["duration"], lines[1]["chunks"]) == (0.5, 12)
+
+
+def test_failed_requests_are_exported_with_their_error(tracer):
+    with pytest.raises(RuntimeError):
+        with tracer.trace("upload", session="s1"):
+            with tracer.span("load_document"):
+                raise RuntimeError("not a notebook")
+    assert current_trace.get() is None
+
+    lines = exported(tracer)
+    assert [(line["name"], line["error"]) for line in lines] == [("load_document", "RuntimeError"), ("upload", "RuntimeError")]
+
+
+def test_model_calls_are_counted(tracer):
+    model = FakeListChatModel(responses=["three word answer"])
+    with tracer.trace("turn") as trace:
+        model.invoke("What does load_data do?", config={"callbacks": [trace.callback_handler()]})
+        summary = trace.summary()
+    (line,) = [line for line in exported(tracer) if line["kind"] == "llm"]
+    assert (line["input_tokens"], line["output_tokens"]) == (4, 3)
+    assert summary["tokens"] == 7
+
+
+def test_disabled_tracer_records_nothing(tmp_path):
+    tracer = Tracer(enabled=False, path=str(tmp_path / "traces.jsonl"))
+    with tracer.trace("turn") as trace:
+        with tracer.span("stage"):
+            pass
+    assert trace is None
+    assert not (tmp_path / "traces.jsonl").exists()
+
+
+def test_estimate_cost():
+    assert estimate_cost("gpt-4o-2024-05-13", 1_000_000, 1_000_000) == 20.0
+    assert estimate_cost("llama", 1000) is None
+
+
+def test_unknown_exporter():
+    with pytest.raises(ValueError):
+        Tracer(exporter="zipkin")
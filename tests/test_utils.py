@@ -0,0 +1,53 @@
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils import TokenCounter, TokenTextSplitter, get_token_counter, tiktoken_len
+
+
+@pytest.fixture
+def counter(word_tokens):
+    return TokenCounter(cache_size=2)
+
+
+def test_lengths_are_cached(counter):
+    assert counter.count("import pandas as pd") == 4
+    assert counter.count("import pandas as pd") == 4
+    assert counter.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_batches_encode_each_missing_text_once(counter):
+    counter.count("a b")
+    assert counter.count_batch(["a b", "c d e", "c d e", ""]) == [2, 3, 3, 0]
+    assert (counter.hits, counter.misses) == (1, 3)
+
+
+def test_least_recently_used_lengths_are_evicted(counter):
+    counter.count_batch(["a", "b c"])
+    counter.count("a")
+    counter.count("d e f")
+    assert counter.stats()["entries"] == 2
+    counter.count("b c")
+    assert counter.misses == 4
+
+
+def test_token_counter_is_shared(word_tokens):
+    assert get_token_counter() is get_token_counter()
+    assert tiktoken_len("one two three") == 3
+
+
+TEXT = "\n\n".join(
+    f"Paragraph {i} " + " ".join(f"word{j}" for j in range(i * 7 % 23 + 3)) + ".\n" + "A second line here."
+    for i in range(30)
+)
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(10, 0), (40, 0), (40, 10), (200, 20)])
+def test_splitter_matches_the_character_splitter(word_tokens, chunk_size, chunk_overlap):
+    counter = TokenCounter()
+    splitter = TokenTextSplitter(token_counter=counter, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    expected = RecursiveCharacterTextSplitter(
+        length_function=TokenCounter().count, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    ).split_text(TEXT)
+    chunks = splitter.split_text(TEXT)
+    assert chunks == expected
+    assert all(counter.count(chunk) <= chunk_size for chunk in chunks)
+    assert counter.hits > 0
@@ -0,0 +1,96 @@
+import pytest
+from langchain_core.documents import Document
+import vector_store
+from vector_store import CollectionRegistry, hash_file
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(vector_store.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def registry(tmp_path, clock):
+    registry = CollectionRegistry(str(tmp_path / "store"), ttl_seconds=60)
+    yield registry
+    registry.client.close()
+
+
+def index(registry, name, cell_hashes):
+    registry.create_collection(name, vector_size=2)
+    documents = [Document(page_content=cell_hash, metadata={"cell_hash": cell_hash}) for cell_hash in cell_hashes]
+    registry.upsert(name, documents, [[1.0, float(i)] for i in range(len(documents))])
+    registry.mark_ready(name, index_version="v1", cell_hashes=list(cell_hashes))
+
+
+def test_hash_file(tmp_path):
+    path = tmp_path / "notebook.ipynb"
+    path.write_bytes(b"x" * 5000)
+    assert hash_file(str(path), block_size=1024) == hash_file(str(path))
+
+
+def test_unreferenced_collection_expires_after_the_ttl(registry, clock):
+    changed = []
+    registry.change_callbacks.append(changed.append)
+    index(registry, "notebook_a", ["h1"])
+    registry.acquire("notebook_a")
+    registry.release("notebook_a")
+    clock[0] += 59
+    registry.expire_unused()
+    assert registry.is_ready("notebook_a")
+    clock[0] += 2
+    registry.expire_unused()
+    assert not registry.is_ready("notebook_a")
+    assert not registry.client.collection_exists("notebook_a")
+    assert changed == ["notebook_a", "notebook_a"]
+
+
+def test_referenced_collection_does_not_expire(registry, clock):
+    index(registry, "notebook_a", ["h1"])
+    registry.acquire("notebook_a")
+    registry.acquire("notebook_a")
+    registry.release("notebook_a")
+    clock[0] += 3600
+    registry.expire_unused()
+    assert registry.is_ready("notebook_a")
+    registry.release("notebook_a")
+    clock[0] += 61
+    registry.expire_unused()
+    assert not registry.is_ready("notebook_a")
+
+
+def test_release_without_reference_does_not_go_negative(registry, clock):
+    index(registry, "notebook_a", ["h1"])
+    registry.release("notebook_a")
+    registry.acquire("notebook_a")
+    clock[0] += 3600
+    registry.expire_unused()
+    assert registry.is_ready("notebook_a")
+
+
+def test_manifest_survives_a_restart(tmp_path, registry, clock):
+    index(registry, "notebook_a", ["h1", "h2"])
+    registry.client.close()
+    reopened = CollectionRegistry(registry.path, ttl_seconds=60)
+    try:
+        assert reopened.is_ready("notebook_a")
+        assert reopened.cell_hashes("notebook_a") == ["h1", "h2"]
+    finally:
+        reopened.client.close()
+
+
+def test_find_base_and_copy_points(registry):
+    index(registry, "notebook_v1", ["h1", "h2", "h3"])
+    assert registry.find_base(["h1", "h2", "h4"], "v1", min_overlap=0.5) == "notebook_v1"
+    assert registry.find_base(["h1", "h4", "h5"], "v1", min_overlap=0.5) is None
+    assert registry.find_base(["h1", "h2"], "v2") is None
+
+    registry.create_collection("notebook_v2", vector_size=2)
+    copied = registry.copy_points("notebook_v1", "notebook_v2", {"h1", "h2"}, {"h2": {"cell_indexes": [7]}})
+    assert copied == 2
+    records, _ = registry.client.scroll("notebook_v2", with_payload=True, limit=10)
+    assert sorted((r.payload["metadata"]["cell_hash"], r.payload["metadata"].get("cell_indexes")) for r in records) == [
+        ("h1", None), ("h2", [7]),
+    ]